@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Profile, Stock, StockData, Watchlist, Alert, PotentialStock, NewsSource, Article
+from .models import (Profile, Stock, StockData, Watchlist, Alert, PotentialStock, NewsSource, Article,
+                     IndicatorState, BacktestRun, TickerCoverage)
 
 # 1. Profile Admin
 @admin.register(Profile)
@@ -57,4 +58,27 @@ class ArticleAdmin(admin.ModelAdmin):
     search_fields = ('title', 'description', 'content_markdown')  # Tìm kiếm theo tiêu đề/nội dung
     list_filter = ('source', 'published_at')  # Lọc theo nguồn và ngày xuất bản
     readonly_fields = ('crawled_at',)  # Không cho chỉnh sửa thời gian crawl
-    # Để hiển thị related_stocks, có thể dùng filter_horizontal = ('related_stocks',) nếu cần chỉnh ManyToMany
\ No newline at end of file
+    # Để hiển thị related_stocks, có thể dùng filter_horizontal = ('related_stocks',) nếu cần chỉnh ManyToMany
+
+# 9. IndicatorState Admin
+@admin.register(IndicatorState)
+class IndicatorStateAdmin(admin.ModelAdmin):
+    list_display = ('stock', 'last_date', 'bar_count', 'updated_at')
+    search_fields = ('stock__ticker',)
+    readonly_fields = ('updated_at',)
+
+# 10. BacktestRun Admin
+@admin.register(BacktestRun)
+class BacktestRunAdmin(admin.ModelAdmin):
+    list_display = ('key', 'status', 'data_version', 'trade_count', 'created_at', 'completed_at')
+    list_filter = ('status',)
+    search_fields = ('key',)
+    readonly_fields = ('created_at', 'completed_at')
+    exclude = ('equity_curve', 'trades')
+
+# 11. TickerCoverage Admin
+@admin.register(TickerCoverage)
+class TickerCoverageAdmin(admin.ModelAdmin):
+    list_display = ('stock', 'first_date', 'last_date', 'last_status', 'last_fetched_at', 'revised_at')
+    list_filter = ('last_status',)
+    search_fields = ('stock__ticker',)
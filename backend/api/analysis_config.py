@@ -22,12 +22,66 @@ SIGNAL_SCORES = {
     'RSI_BEARISH_DIVERGENCE': -8,
 }
 
-MAX_SCORES = {
-    'TREND': sum(v for k, v in SIGNAL_SCORES.items() if ('SMA' in k or 'HIGH' in k) and v > 0),
-    'MOMENTUM': sum(v for k, v in SIGNAL_SCORES.items() if ('RSI' in k or 'MACD' in k) and v > 0),
-    'VOLUME': sum(v for k, v in SIGNAL_SCORES.items() if ('RVOL' in k or 'CMF' in k) and v > 0),
-}
+
+def max_scores_for(signal_scores):
+    """Điểm tối đa của từng nhóm, suy ra từ tên khoá trong bảng điểm."""
+    return {
+        'TREND': sum(v for k, v in signal_scores.items() if ('SMA' in k or 'HIGH' in k) and v > 0),
+        'MOMENTUM': sum(v for k, v in signal_scores.items() if ('RSI' in k or 'MACD' in k) and v > 0),
+        'VOLUME': sum(v for k, v in signal_scores.items() if ('RVOL' in k or 'CMF' in k) and v > 0),
+    }
+
+
+MAX_SCORES = max_scores_for(SIGNAL_SCORES)
+
+# Các điều kiện chấm điểm, khai báo dạng dữ liệu và được api.rule_engine biên dịch thành phép tính trên mảng.
+# 'when' = (cột trái, toán tử, vế phải[, tham số]):
+#   - vế phải là tên cột hoặc hằng số; tham số của phép so sánh là hệ số nhân vế phải
+#   - 'crossed_within': trong `tham số` phiên gần nhất có cả phiên trái > phải lẫn phiên trái <= phải
+#   - 'is': cột cờ (boolean) được tính sẵn, ví dụ RSI_BEARISH_DIVERGENCE
+# Thứ tự danh sách là thứ tự các lý do trong key_reasons.
+SIGNAL_RULES = [
+    {'key': 'PRICE_ABOVE_SMA150', 'group': 'TREND', 'reason': "Uptrend Dài hạn",
+     'when': ('close', '>', 'SMA150')},
+    {'key': 'PRICE_ABOVE_SMA50', 'group': 'TREND', 'reason': "Uptrend Trung hạn",
+     'when': ('close', '>', 'SMA50')},
+    {'key': 'SMA50_ABOVE_SMA150', 'group': 'TREND', 'reason': "Cấu trúc Tăng giá",
+     'when': ('SMA50', '>', 'SMA150')},
+    {'key': 'NEAR_52_WEEK_HIGH_15_PERCENT', 'group': 'TREND', 'reason': "Gần Vùng Đỉnh",
+     'when': ('close', '>=', '52_Week_High', 0.85)},
+    {'key': 'NEAR_52_WEEK_HIGH_5_PERCENT', 'group': 'TREND', 'reason': "Sẵn sàng Bứt phá",
+     'when': ('close', '>=', '52_Week_High', 0.95)},
+    {'key': 'RSI_ABOVE_50', 'group': 'MOMENTUM', 'reason': "RSI Tích cực",
+     'when': ('RSI_14', '>', 50)},
+    {'key': 'RSI_ABOVE_60', 'group': 'MOMENTUM', 'reason': "RSI Mạnh",
+     'when': ('RSI_14', '>', 60)},
+    {'key': 'MACD_ABOVE_SIGNAL', 'group': 'MOMENTUM', 'reason': "MACD Bullish",
+     'when': ('MACD', '>', 'MACDs')},
+    {'key': 'MACD_RECENT_CROSSOVER', 'group': 'MOMENTUM', 'reason': "KÍCH HOẠT: MACD Crossover",
+     'when': ('MACD', 'crossed_within', 'MACDs', 3)},
+    # Lưu ý: điểm cộng vào MOMENTUM nhưng điểm tối đa được tính trong TREND (khoá có 'SMA') — giữ như bản gốc
+    {'key': 'SMA20_RECENT_CROSSOVER_SMA50', 'group': 'MOMENTUM', 'reason': "KÍCH HOẠT: Golden Cross",
+     'when': ('SMA20', 'crossed_within', 'SMA50', 5)},
+    {'key': 'RVOL_ABOVE_1_5', 'group': 'VOLUME', 'reason': "Dòng tiền Chú ý",
+     'when': ('RVOL', '>', 1.5)},
+    {'key': 'RVOL_ABOVE_2_5', 'group': 'VOLUME', 'reason': "Dòng tiền Lớn Tham gia",
+     'when': ('RVOL', '>', 2.5)},
+    {'key': 'CMF_ABOVE_ZERO', 'group': 'VOLUME', 'reason': "Áp lực Mua",
+     'when': ('CMF_20', '>', 0)},
+    {'key': 'BEARISH_ENGULFING_CANDLE', 'group': 'RISK', 'reason': "CẢNH BÁO: Nến Xấu",
+     'when': ('CDL_ENGULFING', '<', 0)},
+    {'key': 'RSI_BEARISH_DIVERGENCE', 'group': 'RISK', 'reason': "CẢNH BÁO: Phân kỳ Âm RSI",
+     'when': ('RSI_BEARISH_DIVERGENCE', 'is', True)},
+]
 
 MIN_DATA_POINTS = 252
 MIN_AVG_TRADE_VALUE = 1_000_000_000
-FINAL_SCORE_THRESHOLD = 65
\ No newline at end of file
+FINAL_SCORE_THRESHOLD = 65
+
+# Giá mục tiêu / cắt lỗ = giá đóng cửa ± hệ số × ATR_14
+ATR_TARGET_MULTIPLIER = '2'
+ATR_STOP_MULTIPLIER = '1.5'
+
+# Số phiên gần nhất cần tải cho chế độ phân tích ngày cuối: đủ cho MIN_DATA_POINTS phiên (52 tuần)
+# cộng thêm phần khởi động để SMA150 và các đường EMA/Wilder (MACD, RSI, ATR) hội tụ như khi tính trên toàn bộ lịch sử
+ANALYSIS_WINDOW_BARS = MIN_DATA_POINTS + 150
@@ -2,11 +2,16 @@ import pandas as pd
 import pandas_ta as ta
 import decimal
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from scipy.signal import argrelextrema
 from .analysis_config import (
     MASTER_WEIGHTS, SIGNAL_SCORES, MAX_SCORES, MIN_DATA_POINTS,
-    MIN_AVG_TRADE_VALUE, FINAL_SCORE_THRESHOLD
+    MIN_AVG_TRADE_VALUE, FINAL_SCORE_THRESHOLD, ATR_TARGET_MULTIPLIER, ATR_STOP_MULTIPLIER
 )
+from .rule_engine import compile_rules
+
+REQUIRED_COLS = ['RSI_14', 'ATR_14', 'MACD', 'MACDs', 'SMA20', 'SMA50', 'SMA150', 'CMF_20', 'Volume_SMA_50',
+                 'CDL_ENGULFING']
 
 
 def _detect_rsi_bearish_divergence(df, lookback=20):
@@ -28,146 +33,368 @@ def _detect_rsi_bearish_divergence(df, lookback=20):
     return False
 
 
-def run_analysis_on_data(df_all, scan_full_history=False):
+def _peak_masks(values, order):
     """
-    Hàm phân tích ADMRS cốt lõi.
-    - scan_full_history=False (mặc định): Chỉ phân tích ngày cuối cùng.
-    - scan_full_history=True: Quét toàn bộ lịch sử để tìm tín hiệu cho backtest.
+    left[d][t] = values[t] lớn hơn d phần tử liền trước; right[d][t] = lớn hơn d phần tử liền sau (d = 1..order).
+    Đỉnh đầy đủ của argrelextrema(order) là left[order] & right[order].
     """
-    all_potential_stocks = []
+    n = len(values)
+    left, right = [None], [None]
+    left_ok, right_ok = np.ones(n, dtype=bool), np.ones(n, dtype=bool)
+    for d in range(1, order + 1):
+        greater_prev = np.zeros(n, dtype=bool)
+        greater_next = np.zeros(n, dtype=bool)
+        if n > d:
+            greater_prev[d:] = values[d:] > values[:-d]
+            greater_next[:-d] = values[:-d] > values[d:]
+        left_ok = left_ok & greater_prev
+        right_ok = right_ok & greater_next
+        left.append(left_ok)
+        right.append(right_ok)
+    return left, right
 
-    for ticker, df_stock in df_all.groupby('stock_id'):
-        df_stock = df_stock.sort_values(by='date').reset_index(drop=True)
 
-        # --- Sàng lọc Ban đầu (Từ file gốc của bạn) ---
-        if len(df_stock) < MIN_DATA_POINTS:
-            continue
+def _last_two_window_peaks(values, lookback, order):
+    """
+    Với mọi phiên i, trả về (đỉnh cuối, đỉnh kế cuối, có đủ 2 đỉnh) mà argrelextrema(order, mode='clip')
+    tìm được trên cửa sổ values[i - lookback + 1 .. i].
 
-        # Nhân với 1000 để quy đổi đơn vị giá cho đúng
-        df_stock['trade_value'] = df_stock['close'] * 1000 * df_stock['volume']
-        avg_trade_value_20d = df_stock['trade_value'].rolling(window=20).mean().iloc[-1]
-        if pd.isna(avg_trade_value_20d) or avg_trade_value_20d < MIN_AVG_TRADE_VALUE:
-            continue
+    Đỉnh nằm cách hai mép cửa sổ từ `order` phiên trở lên là đỉnh toàn cục, chỉ cần tìm một lần cho cả chuỗi.
+    Các vị trí sát mép chỉ được so với các phần tử còn nằm trong cửa sổ (đúng như chế độ clip).
+    """
+    n = len(values)
+    idx = np.arange(n)
+    start = idx - lookback + 1
+    in_range = start >= 0
+    left, right = _peak_masks(values, order)
+
+    full_peak = left[order] & right[order]
+    last_full = np.maximum.accumulate(np.where(full_peak, idx, -1))
+
+    def at(mask, positions):
+        ok = in_range & mask[np.clip(positions, 0, n - 1)]
+        return np.where(ok, positions, -1)
+
+    # Ứng viên theo thứ tự vị trí giảm dần: mép phải, 2 đỉnh đầy đủ gần nhất, mép trái
+    candidates = [at(left[order] & right[e], idx - e) for e in range(1, order)]
+    p1 = np.where(in_range, last_full[np.clip(idx - order, 0, n - 1)], -1)
+    p1 = np.where(p1 >= start + order, p1, -1)
+    p2 = np.where(p1 >= 1, last_full[np.clip(p1 - 1, 0, n - 1)], -1)
+    p2 = np.where((p1 >= 0) & (p2 >= start + order), p2, -1)
+    candidates += [p1, p2]
+    candidates += [at(left[d] & right[order], start + d) for d in range(order - 1, 0, -1)]
+
+    stacked = np.stack(candidates, axis=1)
+    found = stacked >= 0
+    first_two = np.argsort(~found, axis=1, kind='stable')[:, :2]
+    last_peak = stacked[idx, first_two[:, 0]]
+    prev_peak = stacked[idx, first_two[:, 1]]
+    return last_peak, prev_peak, found.sum(axis=1) >= 2
+
+
+def _rsi_bearish_divergence_series(close, rsi, lookback=20, order=3):
+    """
+    Phiên bản vector hoá của _detect_rsi_bearish_divergence cho mọi phiên cùng lúc:
+    divergence[i] == _detect_rsi_bearish_divergence(df.iloc[:i + 1], lookback).
+    """
+    price_last, price_prev, price_ok = _last_two_window_peaks(close, lookback, order)
+    rsi_last, rsi_prev, rsi_ok = _last_two_window_peaks(rsi, lookback, order)
+    return (price_ok & rsi_ok
+            & (close[np.maximum(price_last, 0)] > close[np.maximum(price_prev, 0)])
+            & (rsi[np.maximum(rsi_last, 0)] < rsi[np.maximum(rsi_prev, 0)]))
+
+
+def _compute_indicators(df_stock):
+    """Tính toán các indicators ADMRS cho một mã (thêm cột trực tiếp vào df_stock)."""
+    df_stock['SMA20'] = ta.sma(df_stock['close'], length=20)
+    df_stock['SMA50'] = ta.sma(df_stock['close'], length=50)
+    df_stock['SMA150'] = ta.sma(df_stock['close'], length=150)
+    df_stock['RSI_14'] = ta.rsi(df_stock['close'], length=14)
+    macd = ta.macd(df_stock['close'], fast=12, slow=26, signal=9)
+    df_stock['MACD'] = macd['MACD_12_26_9']
+    df_stock['MACDs'] = macd['MACDs_12_26_9']
+    df_stock['Volume_SMA_50'] = ta.sma(df_stock['volume'], length=50)
+    df_stock['RVOL'] = df_stock['volume'] / df_stock['Volume_SMA_50']
+    df_stock['52_Week_High'] = df_stock['high'].rolling(window=252).max()
+    df_stock['CMF_20'] = ta.cmf(df_stock['high'], df_stock['low'], df_stock['close'], df_stock['volume'],
+                                length=20)
+    df_stock['ATR_14'] = ta.atr(df_stock['high'], df_stock['low'], df_stock['close'], length=14)
+    df_stock['CDL_ENGULFING'] = ta.cdl_pattern(df_stock['open'], df_stock['high'], df_stock['low'],
+                                               df_stock['close'], name="engulfing")
+    return df_stock
+
+
+def _price_levels(close, atr, target_multiplier=ATR_TARGET_MULTIPLIER, stop_multiplier=ATR_STOP_MULTIPLIER):
+    """Giá hiện tại, giá mục tiêu và giá cắt lỗ (Decimal, làm tròn 0.01) theo ATR."""
+    current_price_decimal = decimal.Decimal(str(close))
+    atr_decimal = decimal.Decimal(str(atr))
+    target_price = (current_price_decimal + (decimal.Decimal(str(target_multiplier)) * atr_decimal)).quantize(
+        decimal.Decimal('0.01'))
+    stop_loss = (current_price_decimal - (decimal.Decimal(str(stop_multiplier)) * atr_decimal)).quantize(
+        decimal.Decimal('0.01'))
+    return current_price_decimal, target_price, stop_loss
 
-        # --- Tính toán Indicators (Từ file gốc của bạn) ---
-        try:
-            df_stock['SMA20'] = ta.sma(df_stock['close'], length=20)
-            df_stock['SMA50'] = ta.sma(df_stock['close'], length=50)
-            df_stock['SMA150'] = ta.sma(df_stock['close'], length=150)
-            df_stock['RSI_14'] = ta.rsi(df_stock['close'], length=14)
-            macd = ta.macd(df_stock['close'], fast=12, slow=26, signal=9)
-            df_stock['MACD'] = macd['MACD_12_26_9']
-            df_stock['MACDs'] = macd['MACDs_12_26_9']
-            df_stock['Volume_SMA_50'] = ta.sma(df_stock['volume'], length=50)
-            df_stock['RVOL'] = df_stock['volume'] / df_stock['Volume_SMA_50']
-            df_stock['52_Week_High'] = df_stock['high'].rolling(window=252).max()
-            df_stock['CMF_20'] = ta.cmf(df_stock['high'], df_stock['low'], df_stock['close'], df_stock['volume'],
-                                        length=20)
-            df_stock['ATR_14'] = ta.atr(df_stock['high'], df_stock['low'], df_stock['close'], length=14)
-            df_stock['CDL_ENGULFING'] = ta.cdl_pattern(df_stock['open'], df_stock['high'], df_stock['low'],
-                                                       df_stock['close'], name="engulfing")
-        except Exception:
+
+def _build_signal(ticker, last_day, trend_score, momentum_score, volume_score, risk_score, key_reasons):
+    """Tổng hợp điểm của một phiên; trả về dict tín hiệu hoặc None nếu dưới ngưỡng."""
+    norm_trend = (trend_score / MAX_SCORES['TREND']) if MAX_SCORES['TREND'] > 0 else 0
+    norm_momentum = (momentum_score / MAX_SCORES['MOMENTUM']) if MAX_SCORES['MOMENTUM'] > 0 else 0
+    norm_volume = (volume_score / MAX_SCORES['VOLUME']) if MAX_SCORES['VOLUME'] > 0 else 0
+    final_score = (norm_trend * MASTER_WEIGHTS['TREND']) + (norm_momentum * MASTER_WEIGHTS['MOMENTUM']) + (
+                norm_volume * MASTER_WEIGHTS['VOLUME']) + risk_score
+    final_score = max(0, final_score)
+
+    if final_score < FINAL_SCORE_THRESHOLD:
+        return None
+
+    base_confidence = 50 + ((final_score - FINAL_SCORE_THRESHOLD) / (100 - FINAL_SCORE_THRESHOLD)) * 45
+    confidence_adjustment = 0
+    has_crossover = "KÍCH HOẠT: MACD Crossover" in key_reasons or "KÍCH HOẠT: Golden Cross" in key_reasons
+    has_high_volume = "Dòng tiền Lớn Tham gia" in key_reasons
+    if has_crossover: confidence_adjustment += 5
+    if has_high_volume: confidence_adjustment += 5
+    if has_crossover and has_high_volume: confidence_adjustment += 5
+    risk_penalty = 0
+    if "CẢNH BÁO: Nến Xấu" in key_reasons: risk_penalty -= 10
+    if "CẢNH BÁO: Phân kỳ Âm RSI" in key_reasons: risk_penalty -= 15
+    final_confidence = int(max(0, min(95, base_confidence + confidence_adjustment + risk_penalty)))
+
+    if norm_momentum >= 0.7 and norm_volume >= 0.6:
+        timeframe = "Ngắn hạn"
+    elif norm_trend >= 0.8 and norm_momentum < 0.7:
+        timeframe = "Trung hạn"
+    else:
+        timeframe = "Theo dõi"
+
+    current_price_decimal, target_price, stop_loss = _price_levels(last_day['close'], last_day['ATR_14'])
+
+    return {
+        'stock_id': ticker, 'analysis_date': last_day['date'],
+        'current_price': current_price_decimal, 'target_price': target_price,
+        'stop_loss': stop_loss, 'timeframe': timeframe,
+        'confidence': final_confidence, 'score': round(final_score / 10, 1),
+        'key_reasons': ", ".join(list(dict.fromkeys(key_reasons))),
+        'reason': f"Trend:{norm_trend:.2f},Mom:{norm_momentum:.2f},Vol:{norm_volume:.2f}"
+    }
+
+
+def _score_rows_loop(ticker, df_stock, start_index):
+    """Chấm điểm từng phiên bằng vòng lặp (bản gốc, giữ làm chuẩn đối chiếu)."""
+    signals = []
+    for i in range(start_index, len(df_stock)):
+        if i < 1: continue
+        last_day = df_stock.iloc[i]
+
+        if pd.isna(last_day[REQUIRED_COLS]).any():
             continue
 
-        # Xác định phạm vi quét
-        start_index = MIN_DATA_POINTS if scan_full_history else len(df_stock) - 1
-        end_index = len(df_stock)
-
-        for i in range(start_index, end_index):
-            if i < 1: continue
-            last_day = df_stock.iloc[i]
-
-            required_cols = ['RSI_14', 'ATR_14', 'MACD', 'MACDs', 'SMA20', 'SMA50', 'SMA150', 'CMF_20', 'Volume_SMA_50',
-                             'CDL_ENGULFING']
-            if pd.isna(last_day[required_cols]).any():
-                continue
-
-            # --- Chấm điểm (Logic từ file gốc của bạn) ---
-            trend_score, momentum_score, volume_score, risk_score = 0, 0, 0, 0
-            key_reasons = []
-
-            if last_day['close'] > last_day['SMA150']: trend_score += SIGNAL_SCORES[
-                'PRICE_ABOVE_SMA150']; key_reasons.append("Uptrend Dài hạn")
-            if last_day['close'] > last_day['SMA50']: trend_score += SIGNAL_SCORES[
-                'PRICE_ABOVE_SMA50']; key_reasons.append("Uptrend Trung hạn")
-            if last_day['SMA50'] > last_day['SMA150']: trend_score += SIGNAL_SCORES[
-                'SMA50_ABOVE_SMA150']; key_reasons.append("Cấu trúc Tăng giá")
-            if last_day['close'] >= last_day['52_Week_High'] * 0.85: trend_score += SIGNAL_SCORES[
-                'NEAR_52_WEEK_HIGH_15_PERCENT']; key_reasons.append("Gần Vùng Đỉnh")
-            if last_day['close'] >= last_day['52_Week_High'] * 0.95: trend_score += SIGNAL_SCORES[
-                'NEAR_52_WEEK_HIGH_5_PERCENT']; key_reasons.append("Sẵn sàng Bứt phá")
-
-            if last_day['RSI_14'] > 50: momentum_score += SIGNAL_SCORES['RSI_ABOVE_50']; key_reasons.append(
-                "RSI Tích cực")
-            if last_day['RSI_14'] > 60: momentum_score += SIGNAL_SCORES['RSI_ABOVE_60']; key_reasons.append("RSI Mạnh")
-            if last_day['MACD'] > last_day['MACDs']: momentum_score += SIGNAL_SCORES[
-                'MACD_ABOVE_SIGNAL']; key_reasons.append("MACD Bullish")
-
-            recent_macd_slice = df_stock[['MACD', 'MACDs']].iloc[max(0, i - 2):i + 1]
-            if any(recent_macd_slice['MACD'] > recent_macd_slice['MACDs']) and any(
-                    recent_macd_slice['MACD'] <= recent_macd_slice['MACDs']):
-                momentum_score += SIGNAL_SCORES['MACD_RECENT_CROSSOVER'];
-                key_reasons.append("KÍCH HOẠT: MACD Crossover")
-
-            recent_sma_slice = df_stock[['SMA20', 'SMA50']].iloc[max(0, i - 4):i + 1]
-            if any(recent_sma_slice['SMA20'] > recent_sma_slice['SMA50']) and any(
-                    recent_sma_slice['SMA20'] <= recent_sma_slice['SMA50']):
-                momentum_score += SIGNAL_SCORES['SMA20_RECENT_CROSSOVER_SMA50'];
-                key_reasons.append("KÍCH HOẠT: Golden Cross")
-
-            if last_day['RVOL'] > 1.5: volume_score += SIGNAL_SCORES['RVOL_ABOVE_1_5']; key_reasons.append(
-                "Dòng tiền Chú ý")
-            if last_day['RVOL'] > 2.5: volume_score += SIGNAL_SCORES['RVOL_ABOVE_2_5']; key_reasons.append(
-                "Dòng tiền Lớn Tham gia")
-            if last_day['CMF_20'] > 0: volume_score += SIGNAL_SCORES['CMF_ABOVE_ZERO']; key_reasons.append("Áp lực Mua")
-
-            if last_day['CDL_ENGULFING'] < 0: risk_score += SIGNAL_SCORES[
-                'BEARISH_ENGULFING_CANDLE']; key_reasons.append("CẢNH BÁO: Nến Xấu")
-            if _detect_rsi_bearish_divergence(df_stock.iloc[:i + 1]): risk_score += SIGNAL_SCORES[
-                'RSI_BEARISH_DIVERGENCE']; key_reasons.append("CẢNH BÁO: Phân kỳ Âm RSI")
-
-            # --- Tổng hợp (Logic từ file gốc của bạn) ---
-            norm_trend = (trend_score / MAX_SCORES['TREND']) if MAX_SCORES['TREND'] > 0 else 0
-            norm_momentum = (momentum_score / MAX_SCORES['MOMENTUM']) if MAX_SCORES['MOMENTUM'] > 0 else 0
-            norm_volume = (volume_score / MAX_SCORES['VOLUME']) if MAX_SCORES['VOLUME'] > 0 else 0
-            final_score = (norm_trend * MASTER_WEIGHTS['TREND']) + (norm_momentum * MASTER_WEIGHTS['MOMENTUM']) + (
-                        norm_volume * MASTER_WEIGHTS['VOLUME']) + risk_score
-            final_score = max(0, final_score)
-
-            if final_score >= FINAL_SCORE_THRESHOLD:
-                base_confidence = 50 + ((final_score - FINAL_SCORE_THRESHOLD) / (100 - FINAL_SCORE_THRESHOLD)) * 45
-                confidence_adjustment = 0
-                has_crossover = "KÍCH HOẠT: MACD Crossover" in key_reasons or "KÍCH HOẠT: Golden Cross" in key_reasons
-                has_high_volume = "Dòng tiền Lớn Tham gia" in key_reasons
-                if has_crossover: confidence_adjustment += 5
-                if has_high_volume: confidence_adjustment += 5
-                if has_crossover and has_high_volume: confidence_adjustment += 5
-                risk_penalty = 0
-                if "CẢNH BÁO: Nến Xấu" in key_reasons: risk_penalty -= 10
-                if "CẢNH BÁO: Phân kỳ Âm RSI" in key_reasons: risk_penalty -= 15
-                final_confidence = int(max(0, min(95, base_confidence + confidence_adjustment + risk_penalty)))
-
-                if norm_momentum >= 0.7 and norm_volume >= 0.6:
-                    timeframe = "Ngắn hạn"
-                elif norm_trend >= 0.8 and norm_momentum < 0.7:
-                    timeframe = "Trung hạn"
-                else:
-                    timeframe = "Theo dõi"
-
-                current_price_decimal = decimal.Decimal(str(last_day['close']))
-                atr_decimal = decimal.Decimal(str(last_day['ATR_14']))
-                target_price = (current_price_decimal + (decimal.Decimal('2') * atr_decimal)).quantize(
-                    decimal.Decimal('0.01'))
-                stop_loss = (current_price_decimal - (decimal.Decimal('1.5') * atr_decimal)).quantize(
-                    decimal.Decimal('0.01'))
-
-                all_potential_stocks.append({
-                    'stock_id': ticker, 'analysis_date': last_day['date'],
-                    'current_price': current_price_decimal, 'target_price': target_price,
-                    'stop_loss': stop_loss, 'timeframe': timeframe,
-                    'confidence': final_confidence, 'score': round(final_score / 10, 1),
-                    'key_reasons': ", ".join(list(dict.fromkeys(key_reasons))),
-                    'reason': f"Trend:{norm_trend:.2f},Mom:{norm_momentum:.2f},Vol:{norm_volume:.2f}"
-                })
-
-    return all_potential_stocks
\ No newline at end of file
+        trend_score, momentum_score, volume_score, risk_score = 0, 0, 0, 0
+        key_reasons = []
+
+        if last_day['close'] > last_day['SMA150']: trend_score += SIGNAL_SCORES[
+            'PRICE_ABOVE_SMA150']; key_reasons.append("Uptrend Dài hạn")
+        if last_day['close'] > last_day['SMA50']: trend_score += SIGNAL_SCORES[
+            'PRICE_ABOVE_SMA50']; key_reasons.append("Uptrend Trung hạn")
+        if last_day['SMA50'] > last_day['SMA150']: trend_score += SIGNAL_SCORES[
+            'SMA50_ABOVE_SMA150']; key_reasons.append("Cấu trúc Tăng giá")
+        if last_day['close'] >= last_day['52_Week_High'] * 0.85: trend_score += SIGNAL_SCORES[
+            'NEAR_52_WEEK_HIGH_15_PERCENT']; key_reasons.append("Gần Vùng Đỉnh")
+        if last_day['close'] >= last_day['52_Week_High'] * 0.95: trend_score += SIGNAL_SCORES[
+            'NEAR_52_WEEK_HIGH_5_PERCENT']; key_reasons.append("Sẵn sàng Bứt phá")
+
+        if last_day['RSI_14'] > 50: momentum_score += SIGNAL_SCORES['RSI_ABOVE_50']; key_reasons.append(
+            "RSI Tích cực")
+        if last_day['RSI_14'] > 60: momentum_score += SIGNAL_SCORES['RSI_ABOVE_60']; key_reasons.append("RSI Mạnh")
+        if last_day['MACD'] > last_day['MACDs']: momentum_score += SIGNAL_SCORES[
+            'MACD_ABOVE_SIGNAL']; key_reasons.append("MACD Bullish")
+
+        recent_macd_slice = df_stock[['MACD', 'MACDs']].iloc[max(0, i - 2):i + 1]
+        if any(recent_macd_slice['MACD'] > recent_macd_slice['MACDs']) and any(
+                recent_macd_slice['MACD'] <= recent_macd_slice['MACDs']):
+            momentum_score += SIGNAL_SCORES['MACD_RECENT_CROSSOVER'];
+            key_reasons.append("KÍCH HOẠT: MACD Crossover")
+
+        recent_sma_slice = df_stock[['SMA20', 'SMA50']].iloc[max(0, i - 4):i + 1]
+        if any(recent_sma_slice['SMA20'] > recent_sma_slice['SMA50']) and any(
+                recent_sma_slice['SMA20'] <= recent_sma_slice['SMA50']):
+            momentum_score += SIGNAL_SCORES['SMA20_RECENT_CROSSOVER_SMA50'];
+            key_reasons.append("KÍCH HOẠT: Golden Cross")
+
+        if last_day['RVOL'] > 1.5: volume_score += SIGNAL_SCORES['RVOL_ABOVE_1_5']; key_reasons.append(
+            "Dòng tiền Chú ý")
+        if last_day['RVOL'] > 2.5: volume_score += SIGNAL_SCORES['RVOL_ABOVE_2_5']; key_reasons.append(
+            "Dòng tiền Lớn Tham gia")
+        if last_day['CMF_20'] > 0: volume_score += SIGNAL_SCORES['CMF_ABOVE_ZERO']; key_reasons.append("Áp lực Mua")
+
+        if last_day['CDL_ENGULFING'] < 0: risk_score += SIGNAL_SCORES[
+            'BEARISH_ENGULFING_CANDLE']; key_reasons.append("CẢNH BÁO: Nến Xấu")
+        if _detect_rsi_bearish_divergence(df_stock.iloc[:i + 1]): risk_score += SIGNAL_SCORES[
+            'RSI_BEARISH_DIVERGENCE']; key_reasons.append("CẢNH BÁO: Phân kỳ Âm RSI")
+
+        signal = _build_signal(ticker, last_day, trend_score, momentum_score, volume_score, risk_score, key_reasons)
+        if signal:
+            signals.append(signal)
+    return signals
+
+
+def _rule_columns(df_stock, rules):
+    """Các mảng đầu vào cho bộ luật: cột indicator (float64) và cờ phân kỳ âm RSI tính sẵn."""
+    # Ép về float64 để phép so sánh/nhân giống hệt khi so sánh từng giá trị vô hướng trong vòng lặp
+    columns = {c: df_stock[c].to_numpy(dtype=np.float64) for c in rules.columns if c in df_stock.columns}
+    if 'RSI_BEARISH_DIVERGENCE' in rules.columns:
+        columns['RSI_BEARISH_DIVERGENCE'] = _rsi_bearish_divergence_series(df_stock['close'].to_numpy(),
+                                                                           df_stock['RSI_14'].to_numpy())
+    return columns
+
+
+def _eligible_rows(df_stock, start_index):
+    """Các phiên được chấm: từ start_index (tối thiểu 1) và đủ mọi indicator bắt buộc."""
+    in_range = np.zeros(len(df_stock), dtype=bool)
+    in_range[max(start_index, 1):] = True
+    return in_range & ~df_stock[REQUIRED_COLS].isna().any(axis=1).to_numpy()
+
+
+def _score_rows_vectorized(ticker, df_stock, start_index):
+    """
+    Chấm điểm toàn bộ các phiên cùng lúc bằng bộ luật biên dịch (api.rule_engine): mỗi luật SIGNAL_RULES
+    là một mảng boolean, cộng dồn thành điểm trend/momentum/volume/risk rồi chỉ dựng dict cho các phiên vượt ngưỡng.
+    Cho kết quả giống hệt _score_rows_loop.
+    """
+    rules = compile_rules()
+    masks = rules.evaluate(_rule_columns(df_stock, rules))
+    group_scores = rules.group_scores(masks)
+    final_score = rules.final_scores(group_scores)
+    selected = np.flatnonzero(_eligible_rows(df_stock, start_index) & (final_score >= FINAL_SCORE_THRESHOLD))
+
+    signals = []
+    for i in selected:
+        key_reasons = [reason for reason, mask in zip(rules.reasons, masks[:, i]) if mask]
+        signal = _build_signal(ticker, df_stock.iloc[i], int(group_scores['TREND'][i]),
+                               int(group_scores['MOMENTUM'][i]), int(group_scores['VOLUME'][i]),
+                               int(group_scores['RISK'][i]), key_reasons)
+        if signal:
+            signals.append(signal)
+    return signals
+
+
+OHLCV_COLS = ['open', 'high', 'low', 'close', 'volume']
+
+
+def _prepare_ticker(df_stock):
+    """Sàng lọc (độ dài, thanh khoản) và tính indicators cho một mã; None nếu mã bị loại."""
+    df_stock = df_stock.sort_values(by='date').reset_index(drop=True)
+
+    # --- Sàng lọc Ban đầu (Từ file gốc của bạn) ---
+    if len(df_stock) < MIN_DATA_POINTS:
+        return None
+
+    # Nhân với 1000 để quy đổi đơn vị giá cho đúng
+    df_stock['trade_value'] = df_stock['close'] * 1000 * df_stock['volume']
+    avg_trade_value_20d = df_stock['trade_value'].rolling(window=20).mean().iloc[-1]
+    if pd.isna(avg_trade_value_20d) or avg_trade_value_20d < MIN_AVG_TRADE_VALUE:
+        return None
+
+    # --- Tính toán Indicators (Từ file gốc của bạn) ---
+    try:
+        _compute_indicators(df_stock)
+    except Exception:
+        return None
+    return df_stock
+
+
+def _analyze_ticker(ticker, df_stock, scan_full_history=False, vectorized=True):
+    """Sàng lọc, tính indicators và chấm điểm cho một mã."""
+    df_stock = _prepare_ticker(df_stock)
+    if df_stock is None:
+        return []
+
+    # Xác định phạm vi quét
+    start_index = MIN_DATA_POINTS if scan_full_history else len(df_stock) - 1
+    score_rows = _score_rows_vectorized if vectorized else _score_rows_loop
+    return score_rows(ticker, df_stock, start_index)
+
+
+def _ticker_components(ticker, df_stock, weight_sets=None):
+    """
+    Thành phần thô của tín hiệu trên toàn bộ lịch sử một mã (các phiên đủ điều kiện chấm điểm):
+    ngày, điểm tổng hợp theo cấu hình hiện tại, giá đóng cửa và ATR_14.
+    weight_sets: dict tên -> bộ trọng số (xem CompiledRules.score_weight_sets); mỗi bộ thêm một cột
+    f'final_score_{tên}' chấm trên cùng ma trận luật.
+    """
+    df_stock = _prepare_ticker(df_stock)
+    if df_stock is None:
+        return None
+    rules = compile_rules()
+    masks = rules.evaluate(_rule_columns(df_stock, rules))
+    final_score = rules.final_scores(rules.group_scores(masks))
+    rows = _eligible_rows(df_stock, MIN_DATA_POINTS)
+    # float64 giống giá trị nhận được qua df_stock.iloc[i] trong _build_signal (cùng chuỗi str() khi sang Decimal)
+    frame = pd.DataFrame({
+        'ticker': ticker, 'date': df_stock['date'][rows].to_numpy(), 'final_score': final_score[rows],
+        'close': df_stock['close'][rows].to_numpy(dtype=np.float64),
+        'ATR_14': df_stock['ATR_14'][rows].to_numpy(dtype=np.float64),
+    })
+    if weight_sets:
+        scores = rules.score_weight_sets(masks, weight_sets.values())
+        for name, score in zip(weight_sets, scores):
+            frame[f'final_score_{name}'] = score[rows]
+    return frame
+
+
+def _pack_ticker(ticker, df_stock):
+    """Nén dữ liệu một mã thành các mảng NumPy gọn (ngày int64 + từng cột OHLCV) để gửi sang process con."""
+    dates = pd.to_datetime(df_stock['date']).to_numpy(dtype='datetime64[ns]').view(np.int64)
+    return ticker, dates, {col: df_stock[col].to_numpy() for col in OHLCV_COLS}
+
+
+def _run_packed(args):
+    """Điểm vào của process con: dựng lại DataFrame từ mảng rồi gọi hàm xử lý theo mã."""
+    func, (ticker, dates, columns), extra = args
+    df_stock = pd.DataFrame({'stock_id': ticker, 'date': dates.view('datetime64[ns]'), **columns})
+    return func(ticker, df_stock, *extra)
+
+
+def _map_tickers(df_all, func, extra=(), workers=1):
+    """
+    Gọi func(ticker, df_stock, *extra) cho từng mã đủ MIN_DATA_POINTS phiên, theo thứ tự mã.
+    workers > 1: chia các mã cho một process pool; kết quả vẫn theo đúng thứ tự như khi chạy tuần tự.
+    """
+    groups = ((ticker, df_stock) for ticker, df_stock in df_all.groupby('stock_id')
+              if len(df_stock) >= MIN_DATA_POINTS)
+
+    if workers <= 1:
+        return [func(ticker, df_stock, *extra) for ticker, df_stock in groups]
+
+    jobs = [(func, _pack_ticker(ticker, df_stock), extra) for ticker, df_stock in groups]
+    chunksize = max(1, len(jobs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # executor.map giữ nguyên thứ tự đầu vào nên kết quả gộp lại là tất định
+        return list(executor.map(_run_packed, jobs, chunksize=chunksize))
+
+
+def run_analysis_on_data(df_all, scan_full_history=False, vectorized=True, workers=1):
+    """
+    Hàm phân tích ADMRS cốt lõi.
+    - scan_full_history=False (mặc định): Chỉ phân tích ngày cuối cùng.
+    - scan_full_history=True: Quét toàn bộ lịch sử để tìm tín hiệu cho backtest.
+    - vectorized=True (mặc định): Chấm điểm bằng mảng NumPy; False dùng vòng lặp gốc theo từng phiên.
+    - workers > 1: Chia các mã cho một process pool; kết quả luôn theo thứ tự mã như khi chạy tuần tự.
+    """
+    results = _map_tickers(df_all, _analyze_ticker, (scan_full_history, vectorized), workers)
+    return [signal for signals in results for signal in signals]
+
+
+def compute_signal_components(df_all, workers=1, weight_sets=None):
+    """
+    Tính indicators và điểm tổng hợp một lần cho toàn bộ lịch sử, trả về DataFrame
+    (ticker, date, final_score, close, ATR_14) để đánh giá lại nhiều bộ tham số (ngưỡng điểm, hệ số ATR)
+    mà không phải tính lại indicators. Lọc final_score >= FINAL_SCORE_THRESHOLD cho kết quả
+    trùng với run_analysis_on_data(scan_full_history=True).
+    - weight_sets: dict tên -> bộ trọng số, thêm cột f'final_score_{tên}' cho mỗi bộ (cùng một lượt indicators).
+    """
+    frames = [frame for frame in _map_tickers(df_all, _ticker_components, (weight_sets,), workers=workers)
+              if frame is not None]
+    if not frames:
+        columns = ['ticker', 'date', 'final_score', 'close', 'ATR_14']
+        return pd.DataFrame(columns=columns + [f'final_score_{name}' for name in (weight_sets or {})])
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,475 @@
+# backend/api/backtest_engine.py
+"""
+Mô phỏng danh mục dựa trên tín hiệu ADMRS, dùng chung cho lệnh `backtest` và `backtest_sweep`.
+"""
+
+import decimal
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .analysis_logic import _price_levels
+from .analysis_config import ATR_TARGET_MULTIPLIER, ATR_STOP_MULTIPLIER, FINAL_SCORE_THRESHOLD
+from .price_panel import get_price_panel
+
+# --- Cấu hình Backtest ---
+INITIAL_CAPITAL = 100_000_000
+MAX_HOLDING_PERIOD = 60
+POSITION_SIZE = 0.10
+BACKTEST_START_YEAR = 2021
+
+
+def load_backtest_data():
+    """(df_all, open_prices, close_prices) từ price panel; None nếu chưa có dữ liệu."""
+    panel = get_price_panel()
+    if not panel.tickers:
+        return None
+    return panel.to_long_frame(), panel.frame('open').ffill(), panel.frame('close').ffill()
+
+
+def signals_to_frame(signals_list):
+    """DataFrame tín hiệu (index analysis_date, cột ticker/stop_loss/target_price...) từ list dict tín hiệu."""
+    signals_df = pd.DataFrame(signals_list).rename(columns={'stock_id': 'ticker'})
+    signals_df['analysis_date'] = pd.to_datetime(signals_df['analysis_date'])
+    return signals_df.set_index('analysis_date')
+
+
+def signals_from_components(components, threshold=FINAL_SCORE_THRESHOLD, target_multiplier=ATR_TARGET_MULTIPLIER,
+                            stop_multiplier=ATR_STOP_MULTIPLIER, score_column='final_score'):
+    """
+    Dựng DataFrame tín hiệu từ thành phần thô (analysis_logic.compute_signal_components) cho một bộ
+    ngưỡng điểm / hệ số ATR, với giá mục tiêu / cắt lỗ tính giống hệt lúc tạo tín hiệu.
+    - score_column: cột điểm dùng để so với ngưỡng (cột của một bộ trọng số khác nếu có).
+    """
+    selected = components[components[score_column] >= threshold]
+    levels = [_price_levels(close, atr, target_multiplier, stop_multiplier)[1:]
+              for close, atr in zip(selected['close'], selected['ATR_14'])]
+    signals_df = pd.DataFrame({
+        'ticker': selected['ticker'].to_numpy(),
+        'target_price': [target for target, _ in levels],
+        'stop_loss': [stop for _, stop in levels],
+    }, index=pd.DatetimeIndex(selected['date'].to_numpy(), name='analysis_date'))
+    return signals_df
+
+
+def _run_backtest_decimal(signals_df, open_prices, close_prices, max_holding_period=MAX_HOLDING_PERIOD,
+                          initial_capital=INITIAL_CAPITAL, position_size=POSITION_SIZE,
+                          start_year=BACKTEST_START_YEAR, on_buy=None):
+    """Mô phỏng bằng Decimal và truy cập pandas từng ô (bản gốc, giữ làm chuẩn đối chiếu cho run_backtest)."""
+    portfolio = {'cash': decimal.Decimal(str(initial_capital)), 'holdings': {}}
+
+    trading_days = close_prices[close_prices.index.year >= start_year].index
+    if trading_days.empty:
+        return None
+
+    portfolio_history = pd.Series(index=trading_days, dtype=float)
+
+    for i in range(len(trading_days)):
+        date = trading_days[i]
+
+        current_holdings_value = sum(
+            decimal.Decimal(str(data['shares'])) * decimal.Decimal(str(close_prices.loc[date, ticker]))
+            for ticker, data in portfolio['holdings'].items()
+            if ticker in close_prices.columns and not pd.isna(close_prices.loc[date, ticker])
+        )
+        total_value = portfolio['cash'] + current_holdings_value
+
+        tickers_to_sell = []
+        for ticker, trade_info in portfolio['holdings'].items():
+            days_held = (date - trade_info['entry_date']).days
+            current_price = decimal.Decimal(str(close_prices.loc[date, ticker]))
+
+            exit_signal = False
+            if current_price < trade_info['stop_loss']: exit_signal = True
+            if current_price > trade_info['target_price']: exit_signal = True
+            if days_held > max_holding_period * 1.4: exit_signal = True
+
+            if exit_signal and i + 1 < len(trading_days):
+                next_day_open_price = decimal.Decimal(str(open_prices.loc[trading_days[i + 1], ticker]))
+                if not pd.isna(next_day_open_price) and next_day_open_price > 0:
+                    cash_received = trade_info['shares'] * next_day_open_price
+                    portfolio['cash'] += cash_received
+                    tickers_to_sell.append(ticker)
+
+        for ticker in tickers_to_sell:
+            if ticker in portfolio['holdings']: del portfolio['holdings'][ticker]
+
+        last_signal_date = signals_df.index[signals_df.index < date].max()
+
+        if pd.notna(last_signal_date):
+            signals_to_act_on = signals_df.loc[last_signal_date]
+            if isinstance(signals_to_act_on, pd.Series):
+                signals_to_act_on = pd.DataFrame([signals_to_act_on])
+
+            amount_per_position = total_value * decimal.Decimal(str(position_size))
+
+            for _, signal in signals_to_act_on.iterrows():
+                ticker = signal['ticker']
+                if ticker not in portfolio['holdings']:
+                    buy_price = decimal.Decimal(str(open_prices.loc[date, ticker]))
+                    if not pd.isna(buy_price) and buy_price > 0 and portfolio['cash'] >= amount_per_position:
+                        shares_to_buy = amount_per_position // buy_price
+                        if shares_to_buy > 0:
+                            cost = shares_to_buy * buy_price
+                            portfolio['cash'] -= cost
+                            portfolio['holdings'][ticker] = {
+                                'shares': shares_to_buy, 'buy_price': buy_price, 'entry_date': date,
+                                'stop_loss': signal['stop_loss'], 'target_price': signal['target_price']
+                            }
+                            if on_buy:
+                                on_buy(date, ticker, shares_to_buy, buy_price)
+
+        final_holdings_value = sum(
+            decimal.Decimal(str(data['shares'])) * decimal.Decimal(str(close_prices.loc[date, ticker]))
+            for ticker, data in portfolio['holdings'].items()
+            if ticker in close_prices.columns and not pd.isna(close_prices.loc[date, ticker])
+        )
+        portfolio_history.loc[date] = float(portfolio['cash'] + final_holdings_value)
+
+    return portfolio_history
+
+
+def _to_cents(prices):
+    """Giá (VNĐ nghìn, 2 chữ số thập phân như StockData) -> số nguyên đơn vị 0.01 kèm mặt nạ hợp lệ."""
+    values = np.asarray(prices, dtype=np.float64)
+    valid = ~np.isnan(values)
+    return np.where(valid, np.rint(values * 100), 0).astype(np.int64), valid
+
+
+def _cents_to_decimal(cents):
+    return decimal.Decimal(int(cents)) / 100
+
+
+class SignalCalendar:
+    """
+    Lịch tín hiệu gom theo ngày, dựng một lần trước vòng mô phỏng.
+
+    Các tín hiệu được sắp theo ngày (giữ thứ tự gốc trong cùng ngày) thành các mảng song song; tín hiệu của
+    ngày thứ k nằm ở [offsets[k], offsets[k + 1]). day_bucket[i] là chỉ số ngày tín hiệu gần nhất trước phiên i
+    (-1 nếu chưa có), nên việc tra "tín hiệu của phiên trước" trong vòng lặp là O(1).
+    """
+
+    def __init__(self, signals_df, trading_days, column_of):
+        signal_dates = signals_df.index.to_numpy(dtype='datetime64[ns]')
+        order = np.argsort(signal_dates, kind='stable')
+        signal_dates = signal_dates[order]
+        self.columns = np.array([column_of[t] for t in signals_df['ticker']], dtype=np.int64)[order]
+        # Giá mục tiêu / cắt lỗ đã làm tròn 0.01 -> số nguyên đơn vị 0.01
+        self.targets = np.array([int(v * 100) for v in signals_df['target_price']], dtype=np.int64)[order]
+        self.stops = np.array([int(v * 100) for v in signals_df['stop_loss']], dtype=np.int64)[order]
+
+        self.dates, starts = np.unique(signal_dates, return_index=True)
+        self.offsets = np.append(starts, len(signal_dates))
+        self.day_bucket = np.searchsorted(self.dates, trading_days.to_numpy(dtype='datetime64[ns]'), side='left') - 1
+
+    def __len__(self):
+        return len(self.columns)
+
+
+def run_backtest(signals_df, open_prices, close_prices, max_holding_period=MAX_HOLDING_PERIOD,
+                 initial_capital=INITIAL_CAPITAL, position_size=POSITION_SIZE, start_year=BACKTEST_START_YEAR,
+                 on_buy=None, trades=None, consume_signals_once=False):
+    """
+    Mô phỏng danh mục theo từng phiên từ start_year; trả về chuỗi giá trị danh mục theo ngày
+    (None nếu không có phiên giao dịch nào trong khoảng backtest).
+    - on_buy(date, ticker, shares, price): callback tuỳ chọn khi mở vị thế.
+    - trades: list tuỳ chọn để nhận sổ lệnh (mỗi vị thế một dict, giá dạng Decimal).
+    - consume_signals_once: mỗi ngày tín hiệu chỉ được xét mua ở phiên đầu tiên sau nó; mặc định (False) giữ
+      hành vi gốc là xét lại cùng bộ tín hiệu cũ ở mọi phiên cho tới khi có ngày tín hiệu mới hơn.
+
+    Vị thế được giữ dạng struct-of-arrays theo chỉ số mã (số cổ phiếu, ngày vào, giá mục tiêu, giá cắt lỗ),
+    giá là số nguyên đơn vị 0.01 nên tiền mặt và giá trị danh mục được tính chính xác bằng số nguyên,
+    cho kết quả giống hệt _run_backtest_decimal. Decimal chỉ dùng khi xuất sổ lệnh / callback.
+    """
+    day_mask = np.asarray(close_prices.index.year >= start_year)
+    trading_days = close_prices.index[day_mask]
+    if trading_days.empty:
+        return None
+
+    tickers = list(close_prices.columns)
+    column_of = {ticker: i for i, ticker in enumerate(tickers)}
+    close_cents, close_valid = _to_cents(close_prices.to_numpy()[day_mask])
+    open_cents, open_valid = _to_cents(open_prices.reindex(index=close_prices.index, columns=tickers).to_numpy()[day_mask])
+    day_numbers = trading_days.to_numpy(dtype='datetime64[D]').astype(np.int64)
+    max_days_held = max_holding_period * 1.4
+
+    calendar = SignalCalendar(signals_df, trading_days, column_of)
+
+    # Tỷ trọng mỗi vị thế dạng phân số chính xác: amount = total * num / den
+    position_num, position_den = decimal.Decimal(str(position_size)).as_integer_ratio()
+
+    n_tickers = len(tickers)
+    shares = np.zeros(n_tickers, dtype=np.int64)
+    entry_day = np.zeros(n_tickers, dtype=np.int64)
+    targets = np.zeros(n_tickers, dtype=np.int64)
+    stops = np.zeros(n_tickers, dtype=np.int64)
+    cash = int(decimal.Decimal(str(initial_capital)) * 100)
+    equity = np.empty(len(trading_days), dtype=np.float64)
+    open_trades = {}
+    consumed_bucket = -1
+
+    for i in range(len(trading_days)):
+        held = np.flatnonzero(shares)
+        valued = held[close_valid[i, held]]
+        total_value = cash + int(shares[valued] @ close_cents[i, valued])
+
+        if len(held) and i + 1 < len(trading_days):
+            price = close_cents[i, held]
+            exit_signal = (price < stops[held]) | (price > targets[held]) | (
+                    (day_numbers[i] - entry_day[held]) > max_days_held)
+            next_open = open_cents[i + 1, held]
+            sold = held[exit_signal & open_valid[i + 1, held] & (next_open > 0)]
+            if len(sold):
+                cash += int(shares[sold] @ open_cents[i + 1, sold])
+                if trades is not None:
+                    for column in sold:
+                        trade = open_trades.pop(column)
+                        trade.update(exit_signal_date=trading_days[i], exit_date=trading_days[i + 1],
+                                     exit_price=_cents_to_decimal(open_cents[i + 1, column]))
+                        trades.append(trade)
+                shares[sold] = 0
+
+        # Các tín hiệu của ngày có tín hiệu gần nhất trước phiên hiện tại
+        bucket = calendar.day_bucket[i]
+        if bucket >= 0 and not (consume_signals_once and bucket == consumed_bucket):
+            consumed_bucket = bucket
+            for row in range(calendar.offsets[bucket], calendar.offsets[bucket + 1]):
+                column = calendar.columns[row]
+                if shares[column] or not open_valid[i, column]:
+                    continue
+                buy_price = int(open_cents[i, column])
+                if buy_price <= 0 or cash * position_den < total_value * position_num:
+                    continue
+                shares_to_buy = (total_value * position_num) // (position_den * buy_price)
+                if shares_to_buy > 0:
+                    cash -= shares_to_buy * buy_price
+                    shares[column] = shares_to_buy
+                    entry_day[column] = day_numbers[i]
+                    targets[column] = calendar.targets[row]
+                    stops[column] = calendar.stops[row]
+                    if on_buy or trades is not None:
+                        price_decimal = _cents_to_decimal(buy_price)
+                        if on_buy:
+                            on_buy(trading_days[i], tickers[column], decimal.Decimal(shares_to_buy), price_decimal)
+                        open_trades[column] = {
+                            'ticker': tickers[column], 'shares': shares_to_buy, 'entry_date': trading_days[i],
+                            'entry_price': price_decimal, 'target_price': _cents_to_decimal(targets[column]),
+                            'stop_loss': _cents_to_decimal(stops[column]),
+                            'exit_signal_date': None, 'exit_date': None, 'exit_price': None,
+                        }
+
+        held = np.flatnonzero(shares)
+        valued = held[close_valid[i, held]]
+        equity[i] = (cash + int(shares[valued] @ close_cents[i, valued])) / 100
+
+    if trades is not None:
+        trades.extend(open_trades.values())
+    return pd.Series(equity, index=trading_days, dtype=float)
+
+
+def performance_metrics(portfolio_history, initial_capital=INITIAL_CAPITAL):
+    """Các chỉ số hiệu suất (%, tỷ lệ) từ chuỗi giá trị danh mục; None nếu không có dữ liệu hợp lệ."""
+    portfolio_history = portfolio_history[portfolio_history > 0].dropna()
+    if portfolio_history.empty:
+        return None
+
+    daily_returns = portfolio_history.pct_change()
+    cumulative_returns = portfolio_history / initial_capital
+
+    total_days = len(portfolio_history)
+    annualized_return = (cumulative_returns.iloc[-1] ** (252 / total_days) - 1) * 100
+    annualized_volatility = daily_returns.std() * np.sqrt(252) * 100
+    sharpe_ratio = (annualized_return / annualized_volatility) if annualized_volatility != 0 else 0
+
+    rolling_max = cumulative_returns.cummax()
+    drawdown = (cumulative_returns - rolling_max) / rolling_max
+    max_drawdown = drawdown.min() * 100
+
+    calmar_ratio = (annualized_return / abs(max_drawdown)) if max_drawdown != 0 else 0
+
+    return {
+        'final_value': portfolio_history.iloc[-1],
+        'total_return': (cumulative_returns.iloc[-1] - 1) * 100,
+        'annualized_return': annualized_return,
+        'annualized_volatility': annualized_volatility,
+        'sharpe_ratio': sharpe_ratio,
+        'max_drawdown': max_drawdown,
+        'calmar_ratio': calmar_ratio,
+        'cumulative_returns': cumulative_returns,
+    }
+
+
+# --- Chạy song song nhiều mô phỏng (backtest_sweep, walk-forward) ---
+# Dữ liệu dùng chung của process con, gán một lần qua initializer thay vì gửi kèm từng tác vụ
+_worker_data = {}
+
+
+def _init_worker(components, open_prices, close_prices):
+    _worker_data.update(components=components, open_prices=open_prices, close_prices=close_prices)
+
+
+def _map_jobs(func, jobs, components, open_prices, close_prices, workers=1):
+    """Chạy func(job) cho từng tác vụ trên dữ liệu dùng chung, tuần tự hoặc qua process pool (giữ thứ tự)."""
+    if workers <= 1:
+        _init_worker(components, open_prices, close_prices)
+        return [func(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(components, open_prices, close_prices)) as executor:
+        return list(executor.map(func, jobs))
+
+
+# --- Quét tham số (lệnh backtest_sweep) ---
+
+
+def _evaluate_signal_set(args):
+    """Chạy backtest cho một bộ (ngưỡng, hệ số mục tiêu, hệ số cắt lỗ) với mọi thời gian nắm giữ."""
+    threshold, target_multiplier, stop_multiplier, holding_periods = args
+    signals_df = signals_from_components(_worker_data['components'], threshold, target_multiplier, stop_multiplier)
+    rows = []
+    for max_holding_period in holding_periods:
+        row = {'threshold': threshold, 'target_multiplier': target_multiplier, 'stop_multiplier': stop_multiplier,
+               'max_holding_period': max_holding_period, 'signals': len(signals_df)}
+        history = None
+        if not signals_df.empty:
+            history = run_backtest(signals_df, _worker_data['open_prices'], _worker_data['close_prices'],
+                                   max_holding_period=max_holding_period)
+        metrics = performance_metrics(history) if history is not None else None
+        if metrics:
+            row.update({key: value for key, value in metrics.items() if key != 'cumulative_returns'})
+        rows.append(row)
+    return rows
+
+
+def run_parameter_sweep(components, open_prices, close_prices, thresholds, target_multipliers, stop_multipliers,
+                        holding_periods, workers=1):
+    """
+    Đánh giá mọi tổ hợp tham số trên cùng bộ thành phần tín hiệu đã tính sẵn; trả về DataFrame
+    một dòng cho mỗi tổ hợp với các chỉ số hiệu suất (NaN nếu không có giao dịch).
+    """
+    jobs = [(threshold, target, stop, list(holding_periods))
+            for threshold in thresholds for target in target_multipliers for stop in stop_multipliers]
+    # Chỉ giữ các phiên có thể vượt ngưỡng thấp nhất để giảm dữ liệu gửi sang process con
+    components = components[components['final_score'] >= min(thresholds)].reset_index(drop=True)
+    results = _map_jobs(_evaluate_signal_set, jobs, components, open_prices, close_prices, workers)
+    return pd.DataFrame([row for rows in results for row in rows])
+
+
+# --- Nhiều chiến lược trong một lượt (lệnh backtest_batch) ---
+
+def _evaluate_strategy(strategy):
+    """Backtest một chiến lược (xem run_strategy_batch) trên thành phần tín hiệu dùng chung."""
+    signals_df = signals_from_components(_worker_data['components'], strategy['threshold'],
+                                         strategy['target_multiplier'], strategy['stop_multiplier'],
+                                         strategy['score_column'])
+    row = {'strategy': strategy['name'], 'signals': len(signals_df)}
+    trades = []
+    history = None
+    if not signals_df.empty:
+        history = run_backtest(signals_df, _worker_data['open_prices'], _worker_data['close_prices'],
+                               strategy['max_holding_period'], strategy['initial_capital'], strategy['position_size'],
+                               strategy['start_year'], trades=trades,
+                               consume_signals_once=strategy['consume_signals_once'])
+    metrics = performance_metrics(history, strategy['initial_capital']) if history is not None else None
+    if metrics:
+        row.update({key: value for key, value in metrics.items() if key != 'cumulative_returns'})
+    closed_trades = [t for t in trades if t['exit_price'] is not None]
+    row['closed_trades'] = len(closed_trades)
+    row['win_rate'] = (sum(t['exit_price'] > t['entry_price'] for t in closed_trades) / len(closed_trades) * 100
+                       if closed_trades else np.nan)
+    return row
+
+
+def run_strategy_batch(components, open_prices, close_prices, strategies, workers=1):
+    """
+    Backtest nhiều chiến lược trên cùng dữ liệu giá và cùng một lượt indicators; trả về DataFrame
+    một dòng cho mỗi chiến lược (index là tên) với các chỉ số hiệu suất.
+    Mỗi chiến lược là dict: name, score_column (cột điểm trong components), threshold, target_multiplier,
+    stop_multiplier, max_holding_period, position_size, initial_capital, start_year, consume_signals_once.
+    """
+    strategies = list(strategies)
+    score_columns = list(dict.fromkeys(strategy['score_column'] for strategy in strategies))
+    # Chỉ giữ các phiên có thể vượt ngưỡng của ít nhất một chiến lược để giảm dữ liệu gửi sang process con
+    keep = np.zeros(len(components), dtype=bool)
+    for strategy in strategies:
+        keep |= (components[strategy['score_column']] >= strategy['threshold']).to_numpy()
+    components = components.loc[keep, ['ticker', 'date', 'close', 'ATR_14', *score_columns]].reset_index(drop=True)
+    results = _map_jobs(_evaluate_strategy, strategies, components, open_prices, close_prices, workers)
+    return pd.DataFrame(results).set_index('strategy')
+
+
+# --- Walk-forward ---
+
+def walk_forward_windows(trading_days, train_years, test_years):
+    """
+    Các cửa sổ cuốn chiếu (train_start, test_start, test_end) trên trục ngày giao dịch:
+    train [train_start, test_start), test [test_start, test_end); mỗi cửa sổ dịch đi test_years năm.
+    """
+    first, last = trading_days[0], trading_days[-1]
+    windows = []
+    test_start = first + pd.DateOffset(years=train_years)
+    while test_start <= last:
+        test_end = test_start + pd.DateOffset(years=test_years)
+        windows.append((test_start - pd.DateOffset(years=train_years), test_start,
+                        min(test_end, last + pd.Timedelta(days=1))))
+        test_start = test_end
+    return windows
+
+
+def _simulate_period(signals_df, start, end, max_holding_period):
+    """Mô phỏng độc lập (vốn ban đầu mới) trên các phiên [start, end)."""
+    open_prices = _worker_data['open_prices']
+    close_prices = _worker_data['close_prices']
+    period = (close_prices.index >= start) & (close_prices.index < end)
+    if signals_df.empty or not period.any():
+        return None
+    return run_backtest(signals_df, open_prices[period], close_prices[period],
+                        max_holding_period=max_holding_period, start_year=start.year)
+
+
+def _evaluate_window(args):
+    """Một cửa sổ walk-forward: chọn ngưỡng tốt nhất (Sharpe) trên train rồi mô phỏng test với ngưỡng đó."""
+    train_start, test_start, test_end, thresholds, max_holding_period = args
+    components = _worker_data['components']
+
+    best_threshold, best_sharpe = thresholds[0], None
+    if len(thresholds) > 1:
+        for threshold in thresholds:
+            history = _simulate_period(signals_from_components(components, threshold), train_start, test_start,
+                                       max_holding_period)
+            metrics = performance_metrics(history) if history is not None else None
+            if metrics and (best_sharpe is None or metrics['sharpe_ratio'] > best_sharpe):
+                best_threshold, best_sharpe = threshold, metrics['sharpe_ratio']
+
+    history = _simulate_period(signals_from_components(components, best_threshold), test_start, test_end,
+                               max_holding_period)
+    row = {'train_start': train_start.date(), 'test_start': test_start.date(), 'test_end': test_end.date(),
+           'threshold': best_threshold, 'train_sharpe': best_sharpe}
+    metrics = performance_metrics(history) if history is not None else None
+    if metrics:
+        row.update({key: value for key, value in metrics.items() if key != 'cumulative_returns'})
+    return row, history
+
+
+def run_walk_forward(components, open_prices, close_prices, train_years=2, test_years=1, thresholds=None,
+                     max_holding_period=MAX_HOLDING_PERIOD, workers=1):
+    """
+    Walk-forward: mỗi cửa sổ chạy trong một process riêng. Trả về (DataFrame chỉ số từng cửa sổ,
+    chuỗi giá trị danh mục ghép nối các giai đoạn test, bắt đầu từ INITIAL_CAPITAL).
+    """
+    thresholds = list(thresholds or [FINAL_SCORE_THRESHOLD])
+    windows = walk_forward_windows(close_prices.index, train_years, test_years)
+    components = components[components['final_score'] >= min(thresholds)].reset_index(drop=True)
+    jobs = [(train_start, test_start, test_end, thresholds, max_holding_period)
+            for train_start, test_start, test_end in windows]
+    results = _map_jobs(_evaluate_window, jobs, components, open_prices, close_prices, workers)
+
+    # Ghép các đoạn test: mỗi đoạn bắt đầu lại từ vốn ban đầu, nối theo lợi nhuận tích luỹ
+    stitched, scale = [], 1.0
+    for _, history in results:
+        if history is None or history.empty:
+            continue
+        stitched.append(history * scale)
+        scale *= history.iloc[-1] / INITIAL_CAPITAL
+    equity = pd.concat(stitched) if stitched else pd.Series(dtype=float)
+    return pd.DataFrame([row for row, _ in results]), equity
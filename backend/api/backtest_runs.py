@@ -0,0 +1,285 @@
+# backend/api/backtest_runs.py
+"""
+Lưu kết quả backtest theo địa chỉ nội dung (model BacktestRun).
+
+Khoá của một lần chạy là SHA-256 của cấu hình đã chuẩn hoá + phiên bản dữ liệu giá (số dòng : ngày cuối của
+StockData, thêm mốc sửa dữ liệu gần nhất nếu có) + phiên bản chiến lược (bảng điểm, luật, trọng số trong
+analysis_config và ENGINE_VERSION), nên cùng cấu hình trên cùng dữ liệu và cùng chiến lược luôn trỏ về cùng một
+bản ghi và không phải mô phỏng lại.
+Đường vốn được lưu dạng mảng nhị phân nén (ngày int32 + giá trị float64), sổ lệnh dạng JSON nén.
+"""
+
+import decimal
+import hashlib
+import json
+import threading
+import zlib
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+from django.db import connection
+from django.utils import timezone
+
+from .analysis_config import (ATR_TARGET_MULTIPLIER, ATR_STOP_MULTIPLIER, FINAL_SCORE_THRESHOLD, MASTER_WEIGHTS,
+                              MIN_AVG_TRADE_VALUE, MIN_DATA_POINTS, SIGNAL_RULES, SIGNAL_SCORES)
+from .analysis_logic import compute_signal_components
+from .backtest_engine import (BACKTEST_START_YEAR, INITIAL_CAPITAL, MAX_HOLDING_PERIOD, POSITION_SIZE,
+                              load_backtest_data, performance_metrics, run_backtest, signals_from_components)
+from .coverage import price_revision
+from .models import BacktestRun
+from .price_panel import _database_fingerprint
+
+# Tăng khi đổi logic tính indicators / chấm điểm / mô phỏng trong code (phần không nằm trong analysis_config),
+# để các kết quả đã lưu không còn được dùng lại
+ENGINE_VERSION = 1
+
+# Worker đang chạy cập nhật BacktestRun.updated_at mỗi HEARTBEAT_INTERVAL giây; lần chạy RUNNING im lặng quá
+# STALE_HEARTBEATS nhịp (worker chết, task bị mất) hoặc PENDING quá PENDING_STALE_AFTER mới được giao lại
+HEARTBEAT_INTERVAL = 60
+STALE_HEARTBEATS = 3
+PENDING_STALE_AFTER = timedelta(minutes=30)
+
+DEFAULT_CONFIG = {
+    'threshold': FINAL_SCORE_THRESHOLD,
+    'target_multiplier': ATR_TARGET_MULTIPLIER,
+    'stop_multiplier': ATR_STOP_MULTIPLIER,
+    'max_holding_period': MAX_HOLDING_PERIOD,
+    'position_size': POSITION_SIZE,
+    'initial_capital': INITIAL_CAPITAL,
+    'start_year': BACKTEST_START_YEAR,
+    'consume_signals_once': False,
+}
+
+
+def _decimal_string(value):
+    # Hệ số ATR giữ dạng chuỗi Decimal chuẩn hoá: '2', '2.0' và 2 cho cùng một khoá
+    number = decimal.Decimal(str(value)).normalize()
+    return format(number, 'f')
+
+
+def _boolean(value):
+    # Dữ liệu form (QueryDict) gửi chuỗi: 'false' / '0' không được hiểu là True
+    if isinstance(value, str):
+        if value.strip().lower() in ('true', '1', 'yes', 'on'):
+            return True
+        if value.strip().lower() in ('false', '0', 'no', 'off', ''):
+            return False
+        raise ValueError(value)
+    return bool(value)
+
+
+_NORMALIZERS = {
+    'threshold': float,
+    'target_multiplier': _decimal_string,
+    'stop_multiplier': _decimal_string,
+    'max_holding_period': int,
+    'position_size': float,
+    'initial_capital': int,
+    'start_year': int,
+    'consume_signals_once': _boolean,
+}
+
+
+def normalize_config(config=None):
+    """Cấu hình đầy đủ (thiếu khoá thì lấy mặc định) với kiểu dữ liệu cố định; ValueError nếu khoá/giá trị sai."""
+    config = dict(config or {})
+    unknown = sorted(set(config) - set(DEFAULT_CONFIG))
+    if unknown:
+        raise ValueError(f"Tham số backtest không hợp lệ: {', '.join(unknown)}")
+    normalized = {}
+    for key, default in DEFAULT_CONFIG.items():
+        try:
+            normalized[key] = _NORMALIZERS[key](config.get(key, default))
+        except (TypeError, ValueError, decimal.InvalidOperation):
+            raise ValueError(f"Giá trị không hợp lệ cho '{key}': {config.get(key)!r}")
+    return normalized
+
+
+def data_version():
+    """
+    Dấu vân tay của dữ liệu giá hiện tại: 'số dòng:ngày cuối', thêm ':mốc sửa' khi lịch sử đã lưu từng bị sửa
+    (sửa giá không đổi số dòng / ngày cuối nhưng vẫn làm kết quả cũ hết hiệu lực).
+    """
+    row_count, last_date = _database_fingerprint()
+    revision = price_revision()
+    return f"{row_count}:{last_date}:{revision}" if revision else f"{row_count}:{last_date}"
+
+
+def strategy_version():
+    """Hash ngắn của ENGINE_VERSION và các tham số chiến lược trong analysis_config mà mô phỏng dùng tới."""
+    strategy = {
+        'engine': ENGINE_VERSION,
+        'master_weights': MASTER_WEIGHTS,
+        'signal_scores': SIGNAL_SCORES,
+        'signal_rules': SIGNAL_RULES,
+        'min_data_points': MIN_DATA_POINTS,
+        'min_avg_trade_value': MIN_AVG_TRADE_VALUE,
+        'defaults': DEFAULT_CONFIG,
+    }
+    payload = json.dumps(strategy, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def run_key(config, version, strategy=None):
+    """SHA-256 của cấu hình đã chuẩn hoá + phiên bản dữ liệu + phiên bản chiến lược (mặc định: hiện tại)."""
+    payload = json.dumps({'config': config, 'data_version': version, 'strategy': strategy or strategy_version()},
+                         sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+# --- Mã hoá kết quả ---
+
+def encode_equity_curve(history):
+    days = history.index.values.astype('datetime64[D]').astype('<i4')
+    return zlib.compress(days.tobytes() + history.to_numpy(dtype='<f8').tobytes())
+
+
+def decode_equity_curve(blob):
+    raw = zlib.decompress(bytes(blob))
+    n = len(raw) // 12
+    days = np.frombuffer(raw[:n * 4], dtype='<i4').astype('datetime64[D]').astype('datetime64[ns]')
+    return pd.Series(np.frombuffer(raw[n * 4:], dtype='<f8'), index=pd.DatetimeIndex(days))
+
+
+def _json_value(value):
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, (date, pd.Timestamp)):
+        return value.strftime('%Y-%m-%d')
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def encode_trades(trades):
+    rows = [{key: _json_value(value) for key, value in trade.items()} for trade in trades]
+    return zlib.compress(json.dumps(rows, separators=(',', ':')).encode())
+
+
+def decode_trades(blob):
+    return json.loads(zlib.decompress(bytes(blob))) if blob else []
+
+
+def _metrics_json(metrics):
+    if metrics is None:
+        return {}
+    return {key: float(value) for key, value in metrics.items() if key != 'cumulative_returns'}
+
+
+# --- Chạy và lưu ---
+
+def simulate(config, data=None, components=None):
+    """
+    (history, trades, metrics) cho một cấu hình đã chuẩn hoá.
+    data / components có thể truyền sẵn để dùng lại giữa nhiều cấu hình.
+    """
+    if data is None:
+        data = load_backtest_data()
+        if data is None:
+            raise ValueError("Không có dữ liệu để backtest.")
+    df_all, open_prices, close_prices = data
+    if components is None:
+        components = compute_signal_components(df_all)
+
+    signals_df = signals_from_components(components, config['threshold'], config['target_multiplier'],
+                                         config['stop_multiplier'])
+    trades = []
+    history = run_backtest(signals_df, open_prices, close_prices, config['max_holding_period'],
+                           config['initial_capital'], config['position_size'], config['start_year'],
+                           trades=trades, consume_signals_once=config['consume_signals_once'])
+    if history is None:
+        raise ValueError(f"Không có phiên giao dịch nào từ năm {config['start_year']}.")
+    return history, trades, performance_metrics(history, config['initial_capital'])
+
+
+def store_result(run, history, trades, metrics):
+    run.status = BacktestRun.StatusChoices.DONE
+    run.metrics = _metrics_json(metrics)
+    run.equity_curve = encode_equity_curve(history)
+    run.trades = encode_trades(trades)
+    run.trade_count = len(trades)
+    run.error = ''
+    run.completed_at = timezone.now()
+    run.save()
+    return run
+
+
+def get_or_create_run(config=None):
+    """(run, created) cho cấu hình trên dữ liệu hiện tại; bản ghi mới ở trạng thái PENDING."""
+    config = normalize_config(config)
+    version = data_version()
+    return BacktestRun.objects.get_or_create(key=run_key(config, version),
+                                             defaults={'config': config, 'data_version': version})
+
+
+def is_stale(run, now=None):
+    """Lần chạy PENDING/RUNNING đã mất worker: không có heartbeat (updated_at) trong khoảng cho phép."""
+    now = now or timezone.now()
+    if run.status == BacktestRun.StatusChoices.RUNNING:
+        return run.updated_at < now - timedelta(seconds=HEARTBEAT_INTERVAL * STALE_HEARTBEATS)
+    if run.status == BacktestRun.StatusChoices.PENDING:
+        return run.updated_at < now - PENDING_STALE_AFTER
+    return False
+
+
+@contextmanager
+def _heartbeat(run, interval=HEARTBEAT_INTERVAL):
+    """Cập nhật updated_at của lần chạy định kỳ từ một thread phụ trong lúc mô phỏng."""
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(interval):
+                BacktestRun.objects.filter(key=run.key, status=BacktestRun.StatusChoices.RUNNING).update(
+                    updated_at=timezone.now())
+        finally:
+            connection.close()  # kết nối DB riêng của thread
+
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def execute_run(run):
+    """Chạy mô phỏng cho một BacktestRun và lưu kết quả (hoặc lỗi) vào bản ghi."""
+    run.status = BacktestRun.StatusChoices.RUNNING
+    run.save(update_fields=['status', 'updated_at'])
+    try:
+        with _heartbeat(run):
+            history, trades, metrics = simulate(run.config)
+    except Exception as exc:
+        run.status = BacktestRun.StatusChoices.FAILED
+        run.error = str(exc)
+        run.completed_at = timezone.now()
+        run.save(update_fields=['status', 'error', 'completed_at', 'updated_at'])
+        raise
+    return store_result(run, history, trades, metrics)
+
+
+def run_payload(run):
+    """Dữ liệu đầy đủ của một lần chạy (cấu hình, chỉ số, đường vốn, sổ lệnh) để trả qua API."""
+    payload = {
+        'key': run.key,
+        'status': run.status,
+        'config': run.config,
+        'data_version': run.data_version,
+        'metrics': run.metrics,
+        'trade_count': run.trade_count,
+        'error': run.error,
+        'created_at': run.created_at.isoformat() if run.created_at else None,
+        'completed_at': run.completed_at.isoformat() if run.completed_at else None,
+        'equity_curve': [],
+        'trades': [],
+    }
+    if run.status == BacktestRun.StatusChoices.DONE:
+        history = decode_equity_curve(run.equity_curve)
+        payload['equity_curve'] = [{'date': day.strftime('%Y-%m-%d'), 'value': round(float(value), 2)}
+                                   for day, value in history.items()]
+        payload['trades'] = decode_trades(run.trades)
+    return payload
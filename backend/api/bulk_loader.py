@@ -0,0 +1,174 @@
+# backend/api/bulk_loader.py
+"""
+Nạp lịch sử giá (DataFrame của vnstock) thẳng vào bảng StockData, không dựng model Django.
+
+prepare_price_frame chuẩn hoá cả khung một lần (parse ngày, ép kiểu số, bỏ dòng lỗi / trùng ngày) bằng các
+phép toán theo cột; load_price_frame ghi khung đó bằng executemany (INSERT ... bỏ qua hoặc cập nhật dòng trùng
+khoá (stock, date)), hoặc bằng LOAD DATA LOCAL INFILE từ file CSV tạm trên MySQL. Cả hai cách đều idempotent:
+chạy lại cùng dữ liệu không tạo dòng trùng.
+
+Ở chế độ upsert, khung được so với các dòng đã lưu bằng hash OHLCV từng dòng (changed_rows) và chỉ dòng mới
+hoặc dòng có giá trị khác mới được ghi. Các dòng bị sửa được ghi nhận vào TickerCoverage.revised_at; sau khi
+transaction commit, tín hiệu api.signals.price_history_changed báo các khoảng ngày đã ghi / bị sửa của từng mã.
+"""
+
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+from django.db import connections, transaction
+
+from .coverage import record_revisions
+from .models import StockData
+from .signals import price_history_changed
+
+PRICE_COLUMNS = ['open', 'high', 'low', 'close']
+LOAD_COLUMNS = ['stock_id', 'date', 'open', 'high', 'low', 'close', 'volume']
+BATCH_SIZE = 20000
+
+
+def prepare_price_frame(df_history, ticker):
+    """
+    Khung chuẩn (cột LOAD_COLUMNS) từ kết quả Quote.history của một mã: ngày lấy từ cột 'time' (hoặc index),
+    giá làm tròn 2 chữ số như DecimalField, khối lượng int64; bỏ dòng thiếu/sai kiểu và ngày trùng.
+    ValueError nếu thiếu cột OHLCV.
+    """
+    missing = [column for column in PRICE_COLUMNS + ['volume'] if column not in df_history.columns]
+    if missing:
+        raise ValueError(f"Thiếu cột OHLCV: {', '.join(missing)}")
+
+    dates = df_history['time'] if 'time' in df_history.columns else df_history.index.to_series()
+    frame = pd.DataFrame({'date': pd.to_datetime(dates.to_numpy(), errors='coerce').normalize()})
+    for column in PRICE_COLUMNS + ['volume']:
+        frame[column] = pd.to_numeric(df_history[column].to_numpy(), errors='coerce')
+    frame = frame.dropna()
+
+    frame[PRICE_COLUMNS] = frame[PRICE_COLUMNS].astype(np.float64).round(2)
+    frame['volume'] = frame['volume'].astype(np.int64)
+    frame = frame.drop_duplicates('date', keep='first').sort_values('date', ignore_index=True)
+    frame.insert(0, 'stock_id', ticker)
+    return frame[LOAD_COLUMNS]
+
+
+def row_hashes(frame):
+    """Hash uint64 của OHLCV từng dòng (giá làm tròn 2 chữ số như DecimalField, khối lượng int64)."""
+    values = frame[PRICE_COLUMNS].astype(np.float64).round(2)
+    values['volume'] = frame['volume'].astype(np.int64)
+    return pd.util.hash_pandas_object(values, index=False).to_numpy()
+
+
+def _stored_frame(frame, using):
+    """Các dòng StockData đã lưu của những mã trong khung, giới hạn trong khoảng ngày của khung."""
+    rows = (StockData.objects.using(using)
+            .filter(stock_id__in=frame['stock_id'].unique().tolist(),
+                    date__range=(frame['date'].min().date(), frame['date'].max().date()))
+            .values_list(*LOAD_COLUMNS))
+    stored = pd.DataFrame(list(rows), columns=LOAD_COLUMNS)
+    stored['date'] = pd.to_datetime(stored['date'])
+    return stored
+
+
+def changed_rows(frame, using='default'):
+    """
+    So khung với StockData: trả về (các dòng cần ghi = dòng mới + dòng đã có nhưng OHLCV khác,
+    dict mã -> (ngày đầu, ngày cuối) của các dòng đã có bị sửa).
+    """
+    stored = _stored_frame(frame, using)
+    keys = ['stock_id', 'date']
+    existing = pd.MultiIndex.from_frame(frame[keys]).isin(pd.MultiIndex.from_frame(stored[keys]))
+    unchanged = pd.MultiIndex.from_arrays([frame['stock_id'], frame['date'], row_hashes(frame)]).isin(
+        pd.MultiIndex.from_arrays([stored['stock_id'], stored['date'], row_hashes(stored)]))
+    return frame[~unchanged], date_ranges(frame[existing & ~unchanged])
+
+
+def date_ranges(frame):
+    """dict mã -> (ngày đầu, ngày cuối) của các dòng trong khung."""
+    ranges = frame.groupby('stock_id')['date'].agg(['min', 'max'])
+    return {ticker: (first.date(), last.date()) for ticker, first, last in ranges.itertuples()}
+
+
+def _table():
+    meta = StockData._meta
+    columns = [meta.get_field(name.removesuffix('_id')).column for name in LOAD_COLUMNS]
+    return meta.db_table, columns
+
+
+def insert_sql(vendor, upsert=False):
+    """Câu INSERT theo loại database: bỏ qua dòng trùng khoá, hoặc cập nhật OHLCV nếu upsert=True."""
+    table, columns = _table()
+    placeholders = ', '.join(['%s'] * len(columns))
+    column_list = ', '.join(columns)
+    updated = columns[2:]
+    if vendor == 'mysql':
+        if not upsert:
+            return f"INSERT IGNORE INTO {table} ({column_list}) VALUES ({placeholders})"
+        assignments = ', '.join(f"{column} = VALUES({column})" for column in updated)
+        return f"INSERT INTO {table} ({column_list}) VALUES ({placeholders}) ON DUPLICATE KEY UPDATE {assignments}"
+    # SQLite / PostgreSQL
+    conflict = f"ON CONFLICT ({columns[0]}, {columns[1]})"
+    if not upsert:
+        return f"INSERT INTO {table} ({column_list}) VALUES ({placeholders}) {conflict} DO NOTHING"
+    assignments = ', '.join(f"{column} = excluded.{column}" for column in updated)
+    return f"INSERT INTO {table} ({column_list}) VALUES ({placeholders}) {conflict} DO UPDATE SET {assignments}"
+
+
+def _rows(frame):
+    # Kiểu Python thuần theo từng cột (tolist) thay vì duyệt từng dòng
+    columns = [frame['stock_id'].tolist(), frame['date'].dt.strftime('%Y-%m-%d').tolist()]
+    columns += [frame[column].tolist() for column in LOAD_COLUMNS[2:]]
+    return list(zip(*columns))
+
+
+def _load_infile(cursor, frame, upsert):
+    table, columns = _table()
+    with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, newline='') as f:
+        frame.to_csv(f, columns=LOAD_COLUMNS, header=False, index=False, date_format='%Y-%m-%d',
+                     float_format='%.2f', lineterminator='\n')
+        path = f.name
+    try:
+        # REPLACE xoá dòng trùng khoá rồi ghi dòng mới; IGNORE giữ dòng cũ
+        cursor.execute(
+            f"LOAD DATA LOCAL INFILE %s {'REPLACE' if upsert else 'IGNORE'} INTO TABLE {table} "
+            f"FIELDS TERMINATED BY ',' LINES TERMINATED BY '\\n' ({', '.join(columns)})",
+            [path],
+        )
+    finally:
+        os.unlink(path)
+
+
+def load_price_frame(frame, upsert=False, infile=False, batch_size=BATCH_SIZE, using='default'):
+    """
+    Ghi khung từ prepare_price_frame (có thể nối nhiều mã) vào StockData; trả về số dòng đã gửi.
+    - upsert: chỉ ghi dòng mới và dòng có OHLCV khác bản đã lưu (changed_rows), ghi đè giá trị cũ; số trả về
+      là số dòng thực sự ghi. Mặc định bỏ qua dòng trùng như bulk_create(ignore_conflicts=True).
+    Cả hai cách đều phát price_history_changed: dữ liệu nạp bổ sung phía trước (seed/import lịch sử cũ hơn) cũng
+    làm trạng thái indicators hết hiệu lực. Không upsert thì `written` là khoảng ngày của cả khung (kể cả dòng
+    đã có bị bỏ qua) và `changes` rỗng.
+    - infile: dùng LOAD DATA LOCAL INFILE (chỉ MySQL, cần OPTIONS 'local_infile' ở cả client và server).
+    """
+    if frame is None or frame.empty:
+        return 0
+    connection = connections[using]
+    if infile and connection.vendor != 'mysql':
+        raise ValueError("LOAD DATA LOCAL INFILE chỉ dùng được với MySQL.")
+    changes = {}
+    if upsert:
+        frame, changes = changed_rows(frame, using)
+        if frame.empty:
+            return 0
+
+    with connection.cursor() as cursor:
+        if infile:
+            _load_infile(cursor, frame, upsert)
+        else:
+            sql = insert_sql(connection.vendor, upsert)
+            for start in range(0, len(frame), batch_size):
+                cursor.executemany(sql, _rows(frame.iloc[start:start + batch_size]))
+    if upsert:
+        record_revisions(changes)
+    written = date_ranges(frame)
+    # Gửi sau khi commit để các receiver đọc được giá đã ghi (gửi ngay nếu không nằm trong transaction)
+    transaction.on_commit(
+        lambda: price_history_changed.send(sender=StockData, changes=changes, written=written), using=using)
+    return len(frame)
@@ -0,0 +1,109 @@
+# backend/api/coverage.py
+"""
+Độ phủ dữ liệu giá theo mã (model TickerCoverage).
+
+Mỗi mã giữ khoảng ngày liên tục [first_date, last_date] đã nạp vào StockData. Các lệnh nạp dữ liệu chỉ gọi API
+cho phần nằm ngoài khoảng đó (missing_ranges) và ghi nhận kết quả ngay sau khi dữ liệu được lưu, nên dừng giữa
+chừng rồi chạy lại sẽ tiếp tục đúng chỗ còn thiếu, không cần tải lại lịch sử đã có. Phần thiếu được thu về
+các phiên giao dịch (api.trading_calendar), nên khoảng chỉ gồm cuối tuần / ngày nghỉ lễ không bị gọi API.
+Mã chưa có bản ghi được khởi tạo từ ngày nhỏ nhất / lớn nhất của mã đó trong StockData.
+revised_at ghi lại lần gần nhất lịch sử đã lưu của mã bị sửa (upsert của api.bulk_loader); price_revision()
+đưa mốc đó vào khoá của các kết quả tính từ dữ liệu giá (backtest, danh sách mã thanh khoản).
+"""
+
+from datetime import timedelta
+
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .models import StockData, TickerCoverage
+from .trading_calendar import get_calendar
+
+
+def missing_ranges(first_date, last_date, start, end):
+    """Các khoảng (từ, đến) trong [start, end] chưa nằm trong [first_date, last_date]."""
+    if start > end:
+        return []
+    if first_date is None or last_date is None:
+        return [(start, end)]
+    ranges = []
+    if start < first_date:
+        ranges.append((start, min(end, first_date - timedelta(days=1))))
+    if end > last_date:
+        ranges.append((max(start, last_date + timedelta(days=1)), end))
+    return ranges
+
+
+def coverage_map(tickers):
+    """dict mã -> TickerCoverage cho các mã; mã chưa có bản ghi được khởi tạo từ StockData."""
+    tickers = list(tickers)
+    coverages = {coverage.stock_id: coverage for coverage in TickerCoverage.objects.filter(stock_id__in=tickers)}
+    missing = [ticker for ticker in tickers if ticker not in coverages]
+    if missing:
+        bounds = {row['stock_id']: row for row in StockData.objects.filter(stock_id__in=missing)
+                  .values('stock_id').annotate(first=Min('date'), last=Max('date'))}
+        created = [TickerCoverage(stock_id=ticker, first_date=bounds.get(ticker, {}).get('first'),
+                                  last_date=bounds.get(ticker, {}).get('last'))
+                   for ticker in missing]
+        TickerCoverage.objects.bulk_create(created, ignore_conflicts=True)
+        coverages.update({coverage.stock_id: coverage for coverage in created})
+    return coverages
+
+
+def plan_fetches(tickers, start, end):
+    """
+    dict mã -> danh sách khoảng (phiên đầu, phiên cuối) cần lấy trong [start, end]; mã đã đủ dữ liệu
+    (hoặc chỉ thiếu những ngày không có phiên) không có trong kết quả.
+    """
+    calendar = get_calendar()
+    plan = {}
+    for ticker, coverage in coverage_map(tickers).items():
+        ranges = [session_range for date_range in missing_ranges(coverage.first_date, coverage.last_date, start, end)
+                  if (session_range := calendar.session_range(*date_range)) is not None]
+        if ranges:
+            plan[ticker] = ranges
+    return plan
+
+
+def record_fetches(outcomes):
+    """
+    Ghi kết quả lấy dữ liệu: mỗi phần tử là (mã, trạng thái, ngày đầu đã yêu cầu, ngày cuối có dữ liệu, lỗi).
+    OK / EMPTY nới khoảng phủ: về trước tới ngày đầu đã yêu cầu (trước đó mã chưa có dữ liệu), về sau tới ngày
+    cuối thực sự nhận được (phiên chưa công bố sẽ được yêu cầu lại lần sau). Gọi sau khi đã lưu dữ liệu,
+    trong cùng transaction nếu có thể.
+    """
+    outcomes = list(outcomes)
+    if not outcomes:
+        return
+    coverages = coverage_map(outcome[0] for outcome in outcomes)
+    now = timezone.now()
+    for ticker, status, requested_start, data_last, error in outcomes:
+        coverage = coverages[ticker]
+        if status in (TickerCoverage.StatusChoices.OK, TickerCoverage.StatusChoices.EMPTY):
+            if requested_start is not None and (coverage.first_date is None or requested_start < coverage.first_date):
+                coverage.first_date = requested_start
+            if data_last is not None and (coverage.last_date is None or data_last > coverage.last_date):
+                coverage.last_date = data_last
+        coverage.last_status = status
+        coverage.last_error = str(error or '')[:1000]
+        coverage.last_fetched_at = now
+    TickerCoverage.objects.bulk_update(coverages.values(),
+                                       ['first_date', 'last_date', 'last_status', 'last_error', 'last_fetched_at'])
+
+
+def record_fetch(ticker, status, requested_start=None, data_last=None, error=''):
+    record_fetches([(ticker, status, requested_start, data_last, error)])
+
+
+def record_revisions(tickers):
+    """Đánh dấu các mã vừa có dòng StockData bị sửa giá trị (revised_at = bây giờ)."""
+    tickers = list(tickers)
+    if tickers:
+        coverage_map(tickers)
+        TickerCoverage.objects.filter(stock_id__in=tickers).update(revised_at=timezone.now())
+
+
+def price_revision():
+    """Mốc (micro giây epoch) lần sửa dữ liệu giá gần nhất của mọi mã; 0 nếu chưa từng sửa."""
+    revised_at = TickerCoverage.objects.aggregate(revised_at=Max('revised_at'))['revised_at']
+    return int(revised_at.timestamp() * 1_000_000) if revised_at else 0
@@ -0,0 +1,159 @@
+# backend/api/data_loader.py
+"""
+Tải dữ liệu OHLCV theo cửa sổ giới hạn cho chế độ phân tích ngày cuối.
+
+Thay vì StockData.objects.all().values(...) (dựng toàn bộ bảng thành list các dict), chỉ lấy N phiên
+gần nhất, đọc bằng server-side cursor và đổ trực tiếp vào các mảng NumPy theo từng lô. load_analysis_window
+ưu tiên price panel đã có trên đĩa và chỉ rơi về đọc database khi chưa có panel hoặc panel chưa tới ngày cuối.
+"""
+
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import F, FloatField, Max, Min, Window
+from django.db.models.functions import Cast, RowNumber
+
+from .analysis_config import ANALYSIS_WINDOW_BARS, MIN_AVG_TRADE_VALUE
+from .coverage import price_revision
+from .models import StockData
+from .price_panel import get_price_panel
+from .trading_calendar import get_calendar
+
+OHLCV_FIELDS = ('open', 'high', 'low', 'close', 'volume')
+STREAM_CHUNK_SIZE = 50_000
+LIQUIDITY_WINDOW = 20
+LIQUIDITY_CACHE_TIMEOUT = 60 * 60 * 24
+# Bộ lọc trước chỉ loại mã chắc chắn không đạt; phép kiểm tra chính xác (float32) vẫn chạy trong _analyze_ticker
+LIQUIDITY_TOLERANCE = 1e-6
+
+
+def window_start_date(bars=ANALYSIS_WINDOW_BARS):
+    """
+    Ngày bắt đầu của cửa sổ `bars` phiên giao dịch tính tới ngày dữ liệu cuối cùng (None nếu lịch sử ngắn
+    hơn cửa sổ). Đếm phiên theo lịch giao dịch thay vì quét các ngày distinct của cả bảng StockData.
+    """
+    bounds = StockData.objects.aggregate(first=Min('date'), last=Max('date'))
+    if bounds['last'] is None:
+        return None
+    start = get_calendar().window_start(bounds['last'], bars)
+    return start if start >= bounds['first'] else None
+
+
+def liquid_tickers(window_start=None, min_avg_trade_value=MIN_AVG_TRADE_VALUE, use_cache=True):
+    """
+    Danh sách mã có giá trị giao dịch trung bình 20 phiên gần nhất (close * 1000 * volume) đạt ngưỡng,
+    tính bằng một truy vấn gộp trước khi tải dữ liệu và tính indicators.
+
+    Kết quả được cache theo ngày dữ liệu cuối cùng (và mốc sửa dữ liệu gần nhất), nên các lần chạy lặp lại
+    trong ngày bỏ qua bước này.
+    - window_start: chỉ xét các dòng từ ngày này (thường là đầu cửa sổ phân tích) để giới hạn phạm vi quét.
+    """
+    last_date = StockData.objects.aggregate(last_date=Max('date'))['last_date']
+    if last_date is None:
+        return []
+    cache_key = f'liquid_tickers:{last_date}:{price_revision()}:{window_start}:{min_avg_trade_value}'
+    if use_cache:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    queryset = StockData.objects.all()
+    if window_start is not None:
+        queryset = queryset.filter(date__gte=window_start)
+    # 20 dòng gần nhất của từng mã (giống rolling(20) trên lịch sử của chính mã đó, kể cả khi có phiên bị thiếu)
+    recent = queryset.annotate(
+        row_number=Window(RowNumber(), partition_by=[F('stock_id')], order_by=F('date').desc()),
+        trade_value=Cast(F('close') * F('volume'), FloatField()),
+    ).filter(row_number__lte=LIQUIDITY_WINDOW).values_list('stock_id', 'trade_value')
+
+    frame = pd.DataFrame(list(recent), columns=['stock_id', 'trade_value'])
+    summary = frame.groupby('stock_id')['trade_value'].agg(['count', 'mean'])
+    summary['mean'] *= 1000  # Nhân với 1000 để quy đổi đơn vị giá cho đúng
+    eligible = summary[(summary['count'] == LIQUIDITY_WINDOW)
+                       & (summary['mean'] >= min_avg_trade_value * (1 - LIQUIDITY_TOLERANCE))]
+    tickers = sorted(eligible.index)
+
+    if use_cache:
+        cache.set(cache_key, tickers, LIQUIDITY_CACHE_TIMEOUT)
+    return tickers
+
+
+def _stream_rows(queryset, chunk_size):
+    """Duyệt kết quả truy vấn bằng server-side cursor, trả về từng lô tuple."""
+    if connection.vendor == 'mysql':
+        # mysqlclient mặc định tải toàn bộ kết quả về client; SSCursor mới thực sự stream từng dòng
+        from MySQLdb.cursors import SSCursor
+
+        sql, params = queryset.query.sql_with_params()
+        connection.ensure_connection()
+        cursor = connection.connection.cursor(SSCursor)
+        try:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+        return
+
+    rows = queryset.iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        yield chunk
+
+
+def load_recent_bars(bars=ANALYSIS_WINDOW_BARS, tickers=None, start_date=None, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    DataFrame (stock_id, date, open, high, low, close, volume) chỉ gồm `bars` phiên gần nhất,
+    sắp theo mã rồi theo ngày. Các cột số là float32 như khi đọc toàn bảng với pd.to_numeric(downcast='float').
+    - tickers: chỉ tải các mã này (None = tất cả).
+    - start_date: ngày bắt đầu cửa sổ nếu đã tính sẵn (mặc định tính từ `bars`).
+    """
+    queryset = StockData.objects.all()
+    start_date = window_start_date(bars) if start_date is None else start_date
+    if start_date is not None:
+        queryset = queryset.filter(date__gte=start_date)
+    if tickers is not None:
+        queryset = queryset.filter(stock_id__in=list(tickers))
+    queryset = queryset.annotate(
+        **{f'{field}_f': Cast(field, FloatField()) for field in OHLCV_FIELDS}
+    ).order_by('stock_id', 'date').values_list('stock_id', 'date', *[f'{field}_f' for field in OHLCV_FIELDS])
+
+    ticker_chunks, date_chunks, value_chunks = [], [], []
+    for rows in _stream_rows(queryset, chunk_size):
+        stock_ids, dates, *values = zip(*rows)
+        ticker_chunks.append(np.array(stock_ids, dtype=object))
+        date_chunks.append(np.array(dates, dtype='datetime64[ns]'))
+        value_chunks.append(np.array(values, dtype=np.float64).astype(np.float32))
+
+    if not ticker_chunks:
+        return pd.DataFrame(columns=['stock_id', 'date', *OHLCV_FIELDS])
+
+    values = np.concatenate(value_chunks, axis=1)
+    df = pd.DataFrame({
+        'stock_id': np.concatenate(ticker_chunks),
+        'date': np.concatenate(date_chunks),
+        **{field: values[n] for n, field in enumerate(OHLCV_FIELDS)},
+    })
+    return df.dropna(subset=list(OHLCV_FIELDS)).reset_index(drop=True)
+
+
+def load_analysis_window(bars=ANALYSIS_WINDOW_BARS, tickers=None, start_date=None):
+    """
+    Cùng kết quả với load_recent_bars, nhưng cắt từ price panel trên đĩa nếu panel đã có dữ liệu tới ngày cuối
+    cùng của StockData. Không kiểm tra số dòng / dựng lại panel ở đây (quét toàn bảng): panel thiếu hoặc cũ thì
+    đọc database theo cửa sổ giới hạn.
+    """
+    panel = get_price_panel(validate=False, build=False)
+    last_date = StockData.objects.aggregate(last_date=Max('date'))['last_date']
+    if panel is not None and last_date is not None and panel.meta.get('last_date') == str(last_date):
+        start_date = window_start_date(bars) if start_date is None else start_date
+        return panel.to_long_frame(tickers, start_date)
+    return load_recent_bars(bars, tickers=tickers, start_date=start_date)
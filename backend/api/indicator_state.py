@@ -0,0 +1,331 @@
+# backend/api/indicator_state.py
+"""
+Trạng thái indicators tăng dần (incremental) cho từng mã.
+
+Thay vì tính lại SMA150, RSI14, MACD, ATR14, CMF20 và đỉnh 52 tuần trên toàn bộ lịch sử mỗi ngày,
+mỗi mã giữ một trạng thái nhỏ (tổng trượt cho SMA, trạng thái Wilder cho RSI/ATR, trạng thái EMA cho MACD,
+deque đơn điệu cho đỉnh 52 tuần) và chỉ cần tiến thêm một phiên với chi phí O(1).
+
+RSI/ATR/MACD theo công thức của TA-Lib (khởi tạo bằng SMA rồi làm mượt), nên sau giai đoạn khởi động
+giá trị trùng với pandas_ta đến sai số dấu phẩy động.
+"""
+
+import math
+from collections import deque
+
+import pandas as pd
+from django.db import connection
+from django.db.models import Exists, OuterRef
+
+from .analysis_config import MIN_DATA_POINTS, MIN_AVG_TRADE_VALUE
+from .analysis_logic import _score_rows_vectorized
+from .models import IndicatorState, Stock, StockData
+
+SMA_LENGTHS = (20, 50, 150)
+VOLUME_SMA_LENGTH = 50
+RSI_LENGTH = 14
+ATR_LENGTH = 14
+MACD_FAST, MACD_SLOW, MACD_SIGNAL = 12, 26, 9
+CMF_LENGTH = 20
+HIGH_WINDOW = 252
+TAIL_LENGTH = 20  # đủ cho phân kỳ RSI (20 phiên), MACD crossover (3) và Golden Cross (5)
+
+OHLCV_FIELDS = ('open', 'high', 'low', 'close', 'volume')
+STATE_QUERY_BATCH = 500  # số mã tối đa trong một truy vấn IN khi đọc phiên mới
+
+
+def _nan_to_none(value):
+    return None if value is None or (isinstance(value, float) and math.isnan(value)) else value
+
+
+def _none_to_nan(value):
+    return float('nan') if value is None else value
+
+
+class _Ema:
+    """EMA kiểu TA-Lib: giá trị đầu là SMA của `length` phần tử đầu tiên."""
+
+    def __init__(self, length, count=0, seed_sum=0.0, value=None):
+        self.length = length
+        self.k = 2 / (length + 1)
+        self.count = count
+        self.seed_sum = seed_sum
+        self.value = value
+
+    def update(self, x):
+        self.count += 1
+        if self.count < self.length:
+            self.seed_sum += x
+        elif self.count == self.length:
+            self.value = (self.seed_sum + x) / self.length
+        else:
+            self.value = (x - self.value) * self.k + self.value
+        return self.value
+
+    def to_dict(self):
+        return {'count': self.count, 'seed_sum': self.seed_sum, 'value': self.value}
+
+
+class _Wilder:
+    """Trung bình trượt Wilder kiểu TA-Lib (khởi tạo bằng trung bình cộng `length` giá trị đầu)."""
+
+    def __init__(self, length, count=0, seed_sum=0.0, value=None):
+        self.length = length
+        self.count = count
+        self.seed_sum = seed_sum
+        self.value = value
+
+    def update(self, x):
+        self.count += 1
+        if self.count < self.length:
+            self.seed_sum += x
+        elif self.count == self.length:
+            self.value = (self.seed_sum + x) / self.length
+        else:
+            self.value = (self.value * (self.length - 1) + x) / self.length
+        return self.value
+
+    def to_dict(self):
+        return {'count': self.count, 'seed_sum': self.seed_sum, 'value': self.value}
+
+
+class IncrementalIndicators:
+    """Trạng thái indicators của một mã; `update()` tiến thêm một phiên với chi phí O(1)."""
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.bar_count = data.get('bar_count', 0)
+        self.last_date = data.get('last_date')
+        self.prev_open = data.get('prev_open')
+        self.prev_close = data.get('prev_close')
+        self.closes = deque(data.get('closes', []), maxlen=max(SMA_LENGTHS))
+        self.volumes = deque(data.get('volumes', []), maxlen=VOLUME_SMA_LENGTH)
+        self.mfv = deque(data.get('mfv', []), maxlen=CMF_LENGTH)
+        # Tính lại tổng trượt khi nạp để sai số cộng/trừ không tích luỹ qua các ngày
+        closes = list(self.closes)
+        self.close_sums = {n: math.fsum(closes[-n:]) for n in SMA_LENGTHS}
+        self.volume_sum = math.fsum(self.volumes)
+        self.cmf_volume_sum = math.fsum(list(self.volumes)[-CMF_LENGTH:])
+        self.mfv_sum = math.fsum(self.mfv)
+        self.gain = _Wilder(RSI_LENGTH, **data.get('gain', {}))
+        self.loss = _Wilder(RSI_LENGTH, **data.get('loss', {}))
+        self.atr = _Wilder(ATR_LENGTH, **data.get('atr', {}))
+        self.ema_fast = _Ema(MACD_FAST, **data.get('ema_fast', {}))
+        self.ema_slow = _Ema(MACD_SLOW, **data.get('ema_slow', {}))
+        self.macd_signal = _Ema(MACD_SIGNAL, **data.get('macd_signal', {}))
+        # Deque đơn điệu giảm các cặp [chỉ số phiên, high] cho đỉnh 52 tuần
+        self.highs = deque(data.get('highs', []))
+        self.tail = deque(({k: _none_to_nan(v) for k, v in row.items()} for row in data.get('tail', [])),
+                          maxlen=TAIL_LENGTH)
+
+    @classmethod
+    def from_history(cls, df_stock):
+        """Dựng lại trạng thái từ toàn bộ lịch sử (đã sắp xếp theo ngày) của một mã."""
+        state = cls()
+        for row in df_stock[['date', *OHLCV_FIELDS]].itertuples(index=False):
+            state.update(row.date, row.open, row.high, row.low, row.close, row.volume)
+        return state
+
+    def update(self, date, open_, high, low, close, volume):
+        """Tiến trạng thái thêm một phiên và ghi lại các indicators của phiên đó vào `tail`."""
+        open_, high, low, close, volume = float(open_), float(high), float(low), float(close), float(volume)
+        index = self.bar_count
+        row = {'date': pd.Timestamp(date).isoformat(), 'open': open_, 'high': high, 'low': low,
+               'close': close, 'volume': volume}
+
+        # --- SMA giá: tổng trượt ---
+        for n in SMA_LENGTHS:
+            if len(self.closes) >= n:
+                self.close_sums[n] -= self.closes[-n]
+            self.close_sums[n] += close
+        self.closes.append(close)
+        for n in SMA_LENGTHS:
+            row[f'SMA{n}'] = self.close_sums[n] / n if index + 1 >= n else math.nan
+
+        # --- SMA khối lượng, RVOL và CMF ---
+        if len(self.volumes) >= CMF_LENGTH:
+            self.cmf_volume_sum -= self.volumes[-CMF_LENGTH]
+        if len(self.volumes) == VOLUME_SMA_LENGTH:
+            self.volume_sum -= self.volumes[0]
+        self.volumes.append(volume)
+        self.volume_sum += volume
+        self.cmf_volume_sum += volume
+        volume_sma = self.volume_sum / VOLUME_SMA_LENGTH if index + 1 >= VOLUME_SMA_LENGTH else math.nan
+        row['Volume_SMA_50'] = volume_sma
+        row['RVOL'] = volume / volume_sma if volume_sma else math.nan
+
+        hl_range = high - low
+        mfv = ((close - low) - (high - close)) / hl_range * volume if hl_range else 0.0
+        if len(self.mfv) == CMF_LENGTH:
+            self.mfv_sum -= self.mfv[0]
+        self.mfv.append(mfv)
+        self.mfv_sum += mfv
+        row['CMF_20'] = (self.mfv_sum / self.cmf_volume_sum
+                         if index + 1 >= CMF_LENGTH and self.cmf_volume_sum else math.nan)
+
+        # --- RSI và ATR: trạng thái Wilder ---
+        if self.prev_close is not None:
+            change = close - self.prev_close
+            avg_gain = self.gain.update(max(change, 0.0))
+            avg_loss = self.loss.update(max(-change, 0.0))
+            true_range = max(hl_range, abs(high - self.prev_close), abs(low - self.prev_close))
+            atr = self.atr.update(true_range)
+        else:
+            avg_gain = avg_loss = atr = None
+        if avg_gain is None:
+            row['RSI_14'] = math.nan
+        else:
+            total = avg_gain + avg_loss
+            row['RSI_14'] = 100 * avg_gain / total if total else 0.0
+        row['ATR_14'] = math.nan if atr is None else atr
+
+        # --- MACD: trạng thái EMA ---
+        fast = self.ema_fast.update(close)
+        slow = self.ema_slow.update(close)
+        if fast is not None and slow is not None:
+            macd = fast - slow
+            signal = self.macd_signal.update(macd)
+            row['MACD'] = macd
+            row['MACDs'] = math.nan if signal is None else signal
+        else:
+            row['MACD'] = row['MACDs'] = math.nan
+
+        # --- Đỉnh 52 tuần: deque đơn điệu ---
+        while self.highs and self.highs[-1][1] <= high:
+            self.highs.pop()
+        self.highs.append([index, high])
+        while self.highs[0][0] <= index - HIGH_WINDOW:
+            self.highs.popleft()
+        row['52_Week_High'] = self.highs[0][1] if index + 1 >= HIGH_WINDOW else math.nan
+
+        # --- Nến nhấn chìm (quy tắc CDLENGULFING của TA-Lib, chỉ cần dấu) ---
+        row['CDL_ENGULFING'] = self._engulfing(open_, close) if self.prev_close is not None else 0.0
+
+        self.prev_open, self.prev_close = open_, close
+        self.bar_count += 1
+        self.last_date = pd.Timestamp(date).date().isoformat()
+        self.tail.append(row)
+
+    def _engulfing(self, open_, close):
+        prev_open, prev_close = self.prev_open, self.prev_close
+        color = 1 if close >= open_ else -1
+        prev_color = 1 if prev_close >= prev_open else -1
+        bullish = color == 1 and prev_color == -1 and (
+                (close >= prev_open and open_ < prev_close) or (close > prev_open and open_ <= prev_close))
+        bearish = color == -1 and prev_color == 1 and (
+                (open_ >= prev_close and close < prev_open) or (open_ > prev_close and close <= prev_open))
+        if not (bullish or bearish):
+            return 0.0
+        return color * (100.0 if open_ != prev_close and close != prev_open else 80.0)
+
+    def tail_frame(self):
+        """Các phiên gần nhất kèm indicators, cùng định dạng cột với _compute_indicators."""
+        df = pd.DataFrame(list(self.tail))
+        df['date'] = pd.to_datetime(df['date'])
+        return df
+
+    def score(self, ticker):
+        """Chấm điểm phiên mới nhất; trả về dict tín hiệu hoặc None."""
+        if self.bar_count < MIN_DATA_POINTS or len(self.tail) < CMF_LENGTH:
+            return None
+        df_tail = self.tail_frame()
+        avg_trade_value_20d = (df_tail['close'] * 1000 * df_tail['volume']).iloc[-CMF_LENGTH:].mean()
+        if pd.isna(avg_trade_value_20d) or avg_trade_value_20d < MIN_AVG_TRADE_VALUE:
+            return None
+        signals = _score_rows_vectorized(ticker, df_tail, len(df_tail) - 1)
+        return signals[0] if signals else None
+
+    def to_dict(self):
+        return {
+            'bar_count': self.bar_count, 'last_date': self.last_date,
+            'prev_open': self.prev_open, 'prev_close': self.prev_close,
+            'closes': list(self.closes), 'volumes': list(self.volumes), 'mfv': list(self.mfv),
+            'gain': self.gain.to_dict(), 'loss': self.loss.to_dict(), 'atr': self.atr.to_dict(),
+            'ema_fast': self.ema_fast.to_dict(), 'ema_slow': self.ema_slow.to_dict(),
+            'macd_signal': self.macd_signal.to_dict(),
+            'highs': list(self.highs),
+            'tail': [{k: _nan_to_none(v) for k, v in row.items()} for row in self.tail],
+        }
+
+
+def _history_frame(stock_id):
+    rows = list(StockData.objects.filter(stock_id=stock_id).order_by('date').values_list('date', *OHLCV_FIELDS))
+    return pd.DataFrame(rows, columns=['date', *OHLCV_FIELDS])
+
+
+def _upsert_options(unique_fields, update_fields):
+    """Tham số bulk_create(update_conflicts=True); MySQL không nhận unique_fields."""
+    options = {'update_conflicts': True, 'update_fields': update_fields}
+    if connection.features.supports_update_conflicts_with_target:
+        options['unique_fields'] = unique_fields
+    return options
+
+
+def _rows_since(stock_ids, last_date):
+    """Các phiên từ `last_date` (kể cả phiên đó, để đối chiếu giá) của một nhóm mã, gom theo mã."""
+    rows = {}
+    for stock_id, date, *values in (StockData.objects.filter(stock_id__in=stock_ids, date__gte=last_date)
+                                    .order_by('stock_id', 'date')
+                                    .values_list('stock_id', 'date', *OHLCV_FIELDS).iterator()):
+        rows.setdefault(stock_id, []).append((date, *values))
+    return rows
+
+
+def advance_indicator_states(log=None):
+    """
+    Tiến trạng thái indicators của mọi mã tới phiên mới nhất trong StockData và chấm điểm phiên đó.
+
+    Mỗi mã chỉ đọc các phiên từ `last_date` của chính nó (gom các mã cùng `last_date` vào một truy vấn).
+    Lịch sử bị sửa/bổ sung phía trước `last_date` được phát hiện khi ghi: receiver của price_history_changed
+    xoá trạng thái của mã đó, nên mã chưa có trạng thái (hoặc có giá đóng cửa phiên cuối không khớp) được dựng lại
+    toàn bộ. Trả về danh sách tín hiệu như run_analysis_on_data.
+    """
+    log = log or (lambda message: None)
+    states = {s.stock_id: s for s in IndicatorState.objects.all()}
+
+    # Sau mỗi phiên hầu hết các mã có cùng last_date, nên thường chỉ có một nhóm
+    groups = {}
+    for record in states.values():
+        groups.setdefault(record.last_date, []).append(record.stock_id)
+    new_rows = {}
+    for last_date, stock_ids in groups.items():
+        for start in range(0, len(stock_ids), STATE_QUERY_BATCH):
+            new_rows.update(_rows_since(stock_ids[start:start + STATE_QUERY_BATCH], last_date))
+
+    # Mã có dữ liệu giá nhưng chưa có trạng thái (mới niêm yết, hoặc trạng thái vừa bị xoá do lịch sử bị sửa)
+    unbuilt = Stock.objects.filter(indicator_state__isnull=True).filter(
+        Exists(StockData.objects.filter(stock_id=OuterRef('pk')))).values_list('ticker', flat=True)
+
+    signals, to_save, rebuilt = [], [], 0
+    for stock_id in sorted({*states, *unbuilt}):
+        record = states.get(stock_id)
+        state = None
+        if record is not None:
+            rows = new_rows.get(stock_id, [])
+            fresh = [r for r in rows if r[0] > record.last_date]
+            anchor = rows[0] if rows and rows[0][0] == record.last_date else None
+            state = IncrementalIndicators(record.state)
+            unchanged = anchor is not None and float(anchor[4]) == state.prev_close
+            if unchanged:
+                for date, open_, high, low, close, volume in fresh:
+                    state.update(date, open_, high, low, close, volume)
+            else:
+                state = None
+
+        if state is None:
+            state = IncrementalIndicators.from_history(_history_frame(stock_id))
+            rebuilt += 1
+            if not state.bar_count:
+                continue
+
+        signal = state.score(stock_id)
+        if signal:
+            signals.append(signal)
+        to_save.append(IndicatorState(stock_id=stock_id, last_date=state.last_date,
+                                      bar_count=state.bar_count, state=state.to_dict()))
+
+    IndicatorState.objects.bulk_create(
+        to_save, batch_size=500,
+        **_upsert_options(['stock'], ['last_date', 'bar_count', 'state', 'updated_at']))
+    log(f"Cập nhật trạng thái cho {len(to_save)} mã ({rebuilt} mã dựng lại toàn bộ).")
+    return signals
@@ -1,174 +1,167 @@
-import pandas as pd
-import numpy as np
-import decimal
 import matplotlib.pyplot as plt
 from django.core.management.base import BaseCommand
 from django.db import transaction
-from api.models import Stock, StockData
 # === SỬA LỖI QUAN TRỌNG: IMPORT TRỰC TIẾP HÀM LOGIC, KHÔNG IMPORT COMMAND NỮA ===
-from api.analysis_logic import run_analysis_on_data
-
-# --- Cấu hình Backtest ---
-INITIAL_CAPITAL = 100_000_000
-MAX_HOLDING_PERIOD = 60
-POSITION_SIZE = 0.10
-BACKTEST_START_YEAR = 2021
+from api.analysis_config import FINAL_SCORE_THRESHOLD
+from api.analysis_logic import run_analysis_on_data, compute_signal_components
+from api.backtest_engine import (
+    INITIAL_CAPITAL, BACKTEST_START_YEAR, load_backtest_data, signals_to_frame, run_backtest, performance_metrics,
+    run_walk_forward, POSITION_SIZE
+)
+from api.backtest_runs import get_or_create_run, store_result
+from api.monte_carlo import run_monte_carlo, confidence_bands
 
 
 class Command(BaseCommand):
     help = 'Runs a value-based portfolio backtest on the ADMRS algorithm.'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of worker processes used to generate signals in parallel (default: 1).')
+        parser.add_argument('--consume-signals-once', action='store_true',
+                            help='Act on each signal date only on the first session after it, instead of '
+                                 're-evaluating the latest stale signal set every day.')
+        parser.add_argument('--monte-carlo', type=int, default=0, metavar='N',
+                            help='Bootstrap the trade ledger N times and report confidence bands (e.g. 10000).')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for the Monte Carlo report.')
+        parser.add_argument('--walk-forward', action='store_true',
+                            help='Run rolling train/test windows in parallel (one process per window).')
+        parser.add_argument('--train-years', type=int, default=2, help='Walk-forward training window (years).')
+        parser.add_argument('--test-years', type=int, default=1, help='Walk-forward test window (years).')
+        parser.add_argument('--thresholds', default=str(FINAL_SCORE_THRESHOLD),
+                            help='Comma-separated score thresholds; the best one on each training window '
+                                 '(by Sharpe) is used for its test window.')
+        parser.add_argument('--save', action='store_true',
+                            help='Persist the result as a BacktestRun (served by the /api/backtests/ endpoint).')
+
     @transaction.atomic
     def handle(self, *args, **options):
         self.stdout.write(self.style.SUCCESS("=== Bắt đầu Backtest Mô phỏng Danh mục Dựa trên Giá trị ==="))
 
         # --- Bước 1: Chuẩn bị Dữ liệu ---
         self.stdout.write("-> Bước 1: Đang tải dữ liệu...")
-        all_data = StockData.objects.all().values('stock_id', 'date', 'open', 'high', 'low', 'close', 'volume')
-        if not all_data.exists():
+        data = load_backtest_data()
+        if data is None:
             self.stdout.write(self.style.WARNING("Không có dữ liệu để backtest."))
             return
+        df_all, open_prices, close_prices = data
 
-        df_all = pd.DataFrame(list(all_data))
-        df_all['date'] = pd.to_datetime(df_all['date'])
-
-        numeric_cols = ['open', 'high', 'low', 'close', 'volume']
-        for col in numeric_cols:
-            df_all[col] = pd.to_numeric(df_all[col], errors='coerce', downcast='float')
-        df_all = df_all.dropna(subset=numeric_cols)
-
-        open_prices = df_all.pivot(index='date', columns='stock_id', values='open').ffill()
-        close_prices = df_all.pivot(index='date', columns='stock_id', values='close').ffill()
+        if options['walk_forward']:
+            self._run_walk_forward(df_all, open_prices, close_prices, options)
+            return
 
         # --- Bước 2: Chạy Phân tích để lấy Tín hiệu ---
         self.stdout.write("-> Bước 2: Đang chạy ADMRS trên toàn bộ lịch sử để tạo tín hiệu...")
 
         # === SỬA LỖI QUAN TRỌNG: GỌI TRỰC TIẾP HÀM LOGIC ===
-        signals_list = run_analysis_on_data(df_all, scan_full_history=True)
+        signals_list = run_analysis_on_data(df_all, scan_full_history=True, workers=options['workers'])
 
         if not signals_list:
             self.stdout.write(self.style.ERROR("Thuật toán ADMRS không tạo ra bất kỳ tín hiệu nào."))
             return
 
-        signals_df = pd.DataFrame(signals_list).rename(columns={'stock_id': 'ticker'})
-        signals_df['analysis_date'] = pd.to_datetime(signals_df['analysis_date'])
-        signals_df.set_index('analysis_date', inplace=True)
+        signals_df = signals_to_frame(signals_list)
         self.stdout.write(self.style.SUCCESS(f"-> Đã tạo thành công {len(signals_df)} tín hiệu mua tiềm năng."))
 
         # --- Bước 3: Khởi tạo Danh mục và Vòng lặp Backtest ---
         self.stdout.write("-> Bước 3: Đang khởi tạo danh mục và bắt đầu mô phỏng...")
 
-        portfolio = {'cash': decimal.Decimal(str(INITIAL_CAPITAL)), 'holdings': {}}
-
         trading_days = close_prices[close_prices.index.year >= BACKTEST_START_YEAR].index
         if trading_days.empty:
             self.stdout.write(self.style.ERROR(f"Không có dữ liệu giao dịch từ năm {BACKTEST_START_YEAR} trở đi."))
             return
         self.stdout.write(f"Chu kỳ Backtest: từ {trading_days[0].date()} đến {trading_days[-1].date()}")
 
-        portfolio_history = pd.Series(index=trading_days, dtype=float)
-
-        for i in range(len(trading_days)):
-            date = trading_days[i]
-
-            current_holdings_value = sum(
-                decimal.Decimal(str(data['shares'])) * decimal.Decimal(str(close_prices.loc[date, ticker]))
-                for ticker, data in portfolio['holdings'].items()
-                if ticker in close_prices.columns and not pd.isna(close_prices.loc[date, ticker])
-            )
-            total_value = portfolio['cash'] + current_holdings_value
-
-            tickers_to_sell = []
-            for ticker, trade_info in portfolio['holdings'].items():
-                days_held = (date - trade_info['entry_date']).days
-                current_price = decimal.Decimal(str(close_prices.loc[date, ticker]))
-
-                exit_signal = False
-                if current_price < trade_info['stop_loss']: exit_signal = True
-                if current_price > trade_info['target_price']: exit_signal = True
-                if days_held > MAX_HOLDING_PERIOD * 1.4: exit_signal = True
-
-                if exit_signal and i + 1 < len(trading_days):
-                    next_day_open_price = decimal.Decimal(str(open_prices.loc[trading_days[i + 1], ticker]))
-                    if not pd.isna(next_day_open_price) and next_day_open_price > 0:
-                        cash_received = trade_info['shares'] * next_day_open_price
-                        portfolio['cash'] += cash_received
-                        tickers_to_sell.append(ticker)
-
-            for ticker in tickers_to_sell:
-                if ticker in portfolio['holdings']: del portfolio['holdings'][ticker]
-
-            last_signal_date = signals_df.index[signals_df.index < date].max()
-
-            if pd.notna(last_signal_date):
-                signals_to_act_on = signals_df.loc[last_signal_date]
-                if isinstance(signals_to_act_on, pd.Series):
-                    signals_to_act_on = pd.DataFrame([signals_to_act_on])
-
-                amount_per_position = total_value * decimal.Decimal(str(POSITION_SIZE))
-
-                for _, signal in signals_to_act_on.iterrows():
-                    ticker = signal['ticker']
-                    if ticker not in portfolio['holdings']:
-                        buy_price = decimal.Decimal(str(open_prices.loc[date, ticker]))
-                        if not pd.isna(buy_price) and buy_price > 0 and portfolio['cash'] >= amount_per_position:
-                            shares_to_buy = amount_per_position // buy_price
-                            if shares_to_buy > 0:
-                                cost = shares_to_buy * buy_price
-                                portfolio['cash'] -= cost
-                                portfolio['holdings'][ticker] = {
-                                    'shares': shares_to_buy, 'buy_price': buy_price, 'entry_date': date,
-                                    'stop_loss': signal['stop_loss'], 'target_price': signal['target_price']
-                                }
-                                self.stdout.write(self.style.SUCCESS(
-                                    f"\n  -> {date.date()}: MUA {shares_to_buy} {ticker} @ {buy_price}"))
-
-            final_holdings_value = sum(
-                decimal.Decimal(str(data['shares'])) * decimal.Decimal(str(close_prices.loc[date, ticker]))
-                for ticker, data in portfolio['holdings'].items()
-                if ticker in close_prices.columns and not pd.isna(close_prices.loc[date, ticker])
-            )
-            portfolio_history.loc[date] = float(portfolio['cash'] + final_holdings_value)
+        def log_buy(date, ticker, shares, price):
+            self.stdout.write(self.style.SUCCESS(f"\n  -> {date.date()}: MUA {shares} {ticker} @ {price}"))
+
+        trades = []
+        portfolio_history = run_backtest(signals_df, open_prices, close_prices, on_buy=log_buy, trades=trades,
+                                         consume_signals_once=options['consume_signals_once'])
 
         # --- 4. Tính toán và In các Chỉ số Hiệu suất Nâng cao ---
         self.stdout.write("\n" + "=" * 50)
         self.stdout.write(self.style.SUCCESS("KẾT QUẢ BACKTEST HOÀN TẤT"))
         self.stdout.write("=" * 50)
 
-        portfolio_history = portfolio_history[portfolio_history > 0].dropna()
-        if portfolio_history.empty:
+        metrics = performance_metrics(portfolio_history)
+        if metrics is None:
             self.stdout.write(
                 self.style.WARNING("Không có giao dịch nào được thực hiện, không thể tính toán hiệu suất."))
             return
 
-        daily_returns = portfolio_history.pct_change()
-        cumulative_returns = portfolio_history / INITIAL_CAPITAL
-
-        total_days = len(portfolio_history)
-        annualized_return = (cumulative_returns.iloc[-1] ** (252 / total_days) - 1) * 100
-        annualized_volatility = daily_returns.std() * np.sqrt(252) * 100
-        sharpe_ratio = (annualized_return / annualized_volatility) if annualized_volatility != 0 else 0
-
-        rolling_max = cumulative_returns.cummax()
-        drawdown = (cumulative_returns - rolling_max) / rolling_max
-        max_drawdown = drawdown.min() * 100
-
-        calmar_ratio = (annualized_return / abs(max_drawdown)) if max_drawdown != 0 else 0
-
         self.stdout.write(f"Vốn ban đầu: {INITIAL_CAPITAL:,.0f} VNĐ")
-        self.stdout.write(f"Giá trị cuối cùng: {portfolio_history.iloc[-1]:,.0f} VNĐ")
-        self.stdout.write(f"Tổng lợi nhuận: {((cumulative_returns.iloc[-1] - 1) * 100):.2f}%")
-        self.stdout.write(f"Lợi nhuận Trung bình Năm: {annualized_return:.2f}%")
-        self.stdout.write(f"Độ biến động Trung bình Năm: {annualized_volatility:.2f}%")
-        self.stdout.write(self.style.SUCCESS(f"Tỷ lệ Sharpe (Sharpe Ratio): {sharpe_ratio:.2f}"))
-        self.stdout.write(self.style.WARNING(f"Mức sụt giảm Tối đa (Max Drawdown): {max_drawdown:.2f}%"))
-        self.stdout.write(f"Tỷ lệ Calmar (Calmar Ratio): {calmar_ratio:.2f}")
+        self.stdout.write(f"Giá trị cuối cùng: {metrics['final_value']:,.0f} VNĐ")
+        self.stdout.write(f"Tổng lợi nhuận: {metrics['total_return']:.2f}%")
+        self.stdout.write(f"Lợi nhuận Trung bình Năm: {metrics['annualized_return']:.2f}%")
+        self.stdout.write(f"Độ biến động Trung bình Năm: {metrics['annualized_volatility']:.2f}%")
+        self.stdout.write(self.style.SUCCESS(f"Tỷ lệ Sharpe (Sharpe Ratio): {metrics['sharpe_ratio']:.2f}"))
+        self.stdout.write(self.style.WARNING(f"Mức sụt giảm Tối đa (Max Drawdown): {metrics['max_drawdown']:.2f}%"))
+        self.stdout.write(f"Tỷ lệ Calmar (Calmar Ratio): {metrics['calmar_ratio']:.2f}")
+        closed_trades = [t for t in trades if t['exit_price'] is not None]
+        winning_trades = sum(1 for t in closed_trades if t['exit_price'] > t['entry_price'])
+        self.stdout.write(f"Số giao dịch đã đóng: {len(closed_trades)} "
+                          f"(thắng {winning_trades}, còn mở {len(trades) - len(closed_trades)})")
+
+        if options['save']:
+            run, _ = get_or_create_run({'consume_signals_once': options['consume_signals_once']})
+            store_result(run, portfolio_history, trades, metrics)
+            self.stdout.write(self.style.SUCCESS(f"Đã lưu kết quả backtest: {run.key}"))
+
+        if options['monte_carlo'] > 0:
+            self._report_monte_carlo(trades, options['monte_carlo'], options['seed'])
 
         # --- 5. Vẽ Biểu đồ ---
         self.stdout.write("-> Đang vẽ biểu đồ tăng trưởng vốn (Equity Curve)...")
         plt.figure(figsize=(12, 6))
-        cumulative_returns.plot(title='ADMRS - Portfolio Equity Curve', grid=True)
+        metrics['cumulative_returns'].plot(title='ADMRS - Portfolio Equity Curve', grid=True)
         plt.xlabel('Date')
         plt.ylabel('Cumulative Returns (1 = Vốn ban đầu)')
         plt.savefig('equity_curve.png')
-        self.stdout.write(self.style.SUCCESS("Đã lưu biểu đồ vào file 'equity_curve.png'."))
\ No newline at end of file
+        self.stdout.write(self.style.SUCCESS("Đã lưu biểu đồ vào file 'equity_curve.png'."))
+
+    def _report_monte_carlo(self, trades, n_paths, seed):
+        """In dải tin cậy của CAGR / Sharpe / Max Drawdown từ Monte Carlo trên sổ lệnh."""
+        self.stdout.write(f"\n-> Monte Carlo: {n_paths:,} đường từ sổ lệnh...")
+        for method, title in [('permute', 'Đảo thứ tự giao dịch'), ('resample', 'Bootstrap lợi nhuận giao dịch')]:
+            simulation = run_monte_carlo(trades, n_paths, POSITION_SIZE, method=method, seed=seed)
+            if simulation is None:
+                self.stdout.write(self.style.WARNING("Chưa có giao dịch nào đóng, bỏ qua Monte Carlo."))
+                return
+            self.stdout.write(self.style.SUCCESS(f"{title}:"))
+            self.stdout.write(confidence_bands(simulation).to_string(float_format='%.2f'))
+
+    def _run_walk_forward(self, df_all, open_prices, close_prices, options):
+        """Walk-forward: tính thành phần tín hiệu một lần, mỗi cửa sổ train/test chạy trong một process."""
+        self.stdout.write("-> Bước 2: Đang tính indicators và điểm ADMRS trên toàn bộ lịch sử...")
+        components = compute_signal_components(df_all, workers=options['workers'])
+        if components.empty:
+            self.stdout.write(self.style.ERROR("Thuật toán ADMRS không tạo ra bất kỳ tín hiệu nào."))
+            return
+
+        thresholds = [float(v) for v in options['thresholds'].split(',') if v.strip()]
+        self.stdout.write(f"-> Bước 3: Walk-forward {options['train_years']} năm train / "
+                          f"{options['test_years']} năm test với {options['workers']} worker...")
+        windows, equity = run_walk_forward(components, open_prices, close_prices, options['train_years'],
+                                           options['test_years'], thresholds, workers=options['workers'])
+        if windows.empty:
+            self.stdout.write(self.style.ERROR("Lịch sử quá ngắn để tạo cửa sổ walk-forward."))
+            return
+
+        self.stdout.write("\n" + "=" * 50)
+        self.stdout.write(self.style.SUCCESS("KẾT QUẢ WALK-FORWARD"))
+        self.stdout.write("=" * 50)
+        columns = [c for c in ['train_start', 'test_start', 'test_end', 'threshold', 'train_sharpe', 'total_return',
+                               'sharpe_ratio', 'max_drawdown', 'calmar_ratio'] if c in windows.columns]
+        self.stdout.write(windows[columns].to_string(index=False, float_format='%.2f'))
+
+        metrics = performance_metrics(equity) if not equity.empty else None
+        if metrics is None:
+            self.stdout.write(self.style.WARNING("Không có giao dịch nào được thực hiện trong các giai đoạn test."))
+            return
+        self.stdout.write("\nTổng hợp các giai đoạn test (ghép nối):")
+        self.stdout.write(f"Tổng lợi nhuận: {metrics['total_return']:.2f}%")
+        self.stdout.write(f"Lợi nhuận Trung bình Năm: {metrics['annualized_return']:.2f}%")
+        self.stdout.write(self.style.SUCCESS(f"Tỷ lệ Sharpe (Sharpe Ratio): {metrics['sharpe_ratio']:.2f}"))
+        self.stdout.write(self.style.WARNING(f"Mức sụt giảm Tối đa (Max Drawdown): {metrics['max_drawdown']:.2f}%"))
+        self.stdout.write(f"Tỷ lệ Calmar (Calmar Ratio): {metrics['calmar_ratio']:.2f}")
@@ -0,0 +1,114 @@
+# backend/api/management/commands/backtest_batch.py
+
+import json
+
+import pandas as pd
+from django.core.management.base import BaseCommand
+from api.analysis_config import SIGNAL_SCORES, MASTER_WEIGHTS
+from api.analysis_logic import compute_signal_components
+from api.backtest_engine import load_backtest_data, run_strategy_batch
+from api.backtest_runs import normalize_config
+
+WEIGHT_KEYS = {'SIGNAL_SCORES': SIGNAL_SCORES, 'MASTER_WEIGHTS': MASTER_WEIGHTS}
+
+TABLE_ROWS = [
+    # (cột, nhãn, định dạng)
+    ('signals', 'Số tín hiệu', '{:,.0f}'),
+    ('closed_trades', 'Giao dịch đã đóng', '{:,.0f}'),
+    ('win_rate', 'Tỷ lệ thắng (%)', '{:.2f}'),
+    ('final_value', 'Giá trị cuối (VNĐ)', '{:,.0f}'),
+    ('total_return', 'Tổng lợi nhuận (%)', '{:.2f}'),
+    ('annualized_return', 'Lợi nhuận năm (%)', '{:.2f}'),
+    ('annualized_volatility', 'Biến động năm (%)', '{:.2f}'),
+    ('sharpe_ratio', 'Sharpe', '{:.2f}'),
+    ('max_drawdown', 'Max Drawdown (%)', '{:.2f}'),
+    ('calmar_ratio', 'Calmar', '{:.2f}'),
+]
+
+
+def load_strategies(path):
+    """
+    Đọc file JSON chiến lược: danh sách object, mỗi object có 'name' và tuỳ chọn
+    - tham số backtest (threshold, target_multiplier, stop_multiplier, max_holding_period, position_size,
+      initial_capital, start_year, consume_signals_once), thiếu thì lấy mặc định;
+    - 'SIGNAL_SCORES' / 'MASTER_WEIGHTS': ghi đè một phần bảng điểm / trọng số nhóm.
+    Trả về (danh sách chiến lược cho run_strategy_batch, dict tên -> bộ trọng số cần chấm thêm).
+    """
+    with open(path, encoding='utf-8') as f:
+        definitions = json.load(f)
+    if not isinstance(definitions, list) or not definitions:
+        raise ValueError("File chiến lược phải là một danh sách JSON không rỗng.")
+
+    strategies, weight_sets = [], {}
+    for n, definition in enumerate(definitions, start=1):
+        definition = dict(definition)
+        name = str(definition.pop('name', f'strategy_{n}'))
+        if any(strategy['name'] == name for strategy in strategies):
+            raise ValueError(f"Tên chiến lược bị trùng: {name}")
+
+        weights = {}
+        for key, defaults in WEIGHT_KEYS.items():
+            overrides = definition.pop(key, None)
+            if overrides:
+                unknown = sorted(set(overrides) - set(defaults))
+                if unknown:
+                    raise ValueError(f"{name}: khoá {key} không hợp lệ: {', '.join(unknown)}")
+                weights[key] = {**defaults, **overrides}
+
+        strategy = {'name': name, **normalize_config(definition)}
+        if weights:
+            weight_sets[name] = weights
+            strategy['score_column'] = f'final_score_{name}'
+        else:
+            strategy['score_column'] = 'final_score'
+        strategies.append(strategy)
+    return strategies, weight_sets
+
+
+class Command(BaseCommand):
+    help = ('Backtests several ADMRS strategy variants (weights, thresholds, exits, position sizes) over one '
+            'shared data load and one indicator pass, and prints a side-by-side comparison.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('strategies', help='Path to a JSON file with the list of strategy definitions.')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of worker processes (indicator computation and strategy simulation).')
+        parser.add_argument('--output', default=None, help='Optional path of a CSV file with the comparison.')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS("=== Bắt đầu Backtest Nhiều Chiến lược ADMRS ==="))
+        try:
+            strategies, weight_sets = load_strategies(options['strategies'])
+        except (OSError, ValueError) as e:
+            self.stdout.write(self.style.ERROR(f"Không đọc được file chiến lược: {e}"))
+            return
+
+        self.stdout.write("-> Bước 1: Đang tải dữ liệu (một lần cho mọi chiến lược)...")
+        data = load_backtest_data()
+        if data is None:
+            self.stdout.write(self.style.WARNING("Không có dữ liệu để backtest."))
+            return
+        df_all, open_prices, close_prices = data
+
+        self.stdout.write(f"-> Bước 2: Đang tính indicators và chấm điểm {len(weight_sets) + 1} bộ trọng số...")
+        components = compute_signal_components(df_all, workers=options['workers'], weight_sets=weight_sets)
+        if components.empty:
+            self.stdout.write(self.style.ERROR("Không có mã nào đủ dữ liệu để tạo tín hiệu."))
+            return
+
+        self.stdout.write(f"-> Bước 3: Đang mô phỏng {len(strategies)} chiến lược với {options['workers']} worker...")
+        results = run_strategy_batch(components, open_prices, close_prices, strategies, workers=options['workers'])
+        if options['output']:
+            results.to_csv(options['output'], float_format='%.4f')
+            self.stdout.write(self.style.SUCCESS(f"Đã ghi bảng so sánh vào '{options['output']}'."))
+
+        table = {}
+        for column, label, fmt in TABLE_ROWS:
+            values = results[column] if column in results.columns else [None] * len(results)
+            table[label] = ['-' if value is None or value != value else fmt.format(value) for value in values]
+        self.stdout.write("\n" + "=" * 50)
+        self.stdout.write(self.style.SUCCESS("SO SÁNH CÁC CHIẾN LƯỢC"))
+        self.stdout.write("=" * 50)
+        comparison = pd.DataFrame(table, index=results.index).T
+        comparison.columns.name = None
+        self.stdout.write(comparison.to_string())
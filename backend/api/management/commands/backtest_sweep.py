@@ -0,0 +1,81 @@
+# backend/api/management/commands/backtest_sweep.py
+
+from django.core.management.base import BaseCommand
+from api.analysis_config import FINAL_SCORE_THRESHOLD, ATR_TARGET_MULTIPLIER, ATR_STOP_MULTIPLIER
+from api.analysis_logic import compute_signal_components
+from api.backtest_engine import MAX_HOLDING_PERIOD, load_backtest_data, run_parameter_sweep
+
+SORT_COLUMNS = {
+    # cột -> sắp giảm dần? (max_drawdown là số âm, càng gần 0 càng tốt)
+    'sharpe_ratio': True,
+    'calmar_ratio': True,
+    'max_drawdown': True,
+}
+
+
+def _float_list(value):
+    return [float(v) for v in value.split(',') if v.strip()]
+
+
+def _str_list(value):
+    # Hệ số ATR giữ dạng chuỗi để sang Decimal chính xác như cấu hình
+    return [v.strip() for v in value.split(',') if v.strip()]
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+class Command(BaseCommand):
+    help = 'Sweeps ADMRS backtest parameters, computing indicators only once, and writes a ranked CSV.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--thresholds', type=_float_list, default=[55, 60, FINAL_SCORE_THRESHOLD, 70, 75],
+                            help='Comma-separated FINAL_SCORE_THRESHOLD values.')
+        parser.add_argument('--target-multipliers', type=_str_list, default=['1.5', ATR_TARGET_MULTIPLIER, '3'],
+                            help='Comma-separated ATR multipliers for the target price.')
+        parser.add_argument('--stop-multipliers', type=_str_list, default=['1', ATR_STOP_MULTIPLIER, '2'],
+                            help='Comma-separated ATR multipliers for the stop loss.')
+        parser.add_argument('--holding-periods', type=_int_list, default=[40, MAX_HOLDING_PERIOD, 90],
+                            help='Comma-separated MAX_HOLDING_PERIOD values.')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of worker processes (indicator computation and grid evaluation).')
+        parser.add_argument('--sort-by', choices=sorted(SORT_COLUMNS), default='sharpe_ratio',
+                            help='Metric used to rank parameter combinations (default: sharpe_ratio).')
+        parser.add_argument('--output', default='backtest_sweep.csv', help='Path of the ranked CSV file.')
+        parser.add_argument('--top', type=int, default=10, help='Number of best combinations to print.')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS("=== Bắt đầu Quét Tham số Backtest ADMRS ==="))
+
+        self.stdout.write("-> Bước 1: Đang tải dữ liệu...")
+        data = load_backtest_data()
+        if data is None:
+            self.stdout.write(self.style.WARNING("Không có dữ liệu để backtest."))
+            return
+        df_all, open_prices, close_prices = data
+
+        self.stdout.write("-> Bước 2: Đang tính indicators và điểm ADMRS (một lần cho mọi tổ hợp)...")
+        components = compute_signal_components(df_all, workers=options['workers'])
+        if components.empty:
+            self.stdout.write(self.style.ERROR("Không có mã nào đủ dữ liệu để tạo tín hiệu."))
+            return
+
+        grid = [options['thresholds'], options['target_multipliers'], options['stop_multipliers'],
+                options['holding_periods']]
+        total = len(grid[0]) * len(grid[1]) * len(grid[2]) * len(grid[3])
+        self.stdout.write(f"-> Bước 3: Đang chạy {total} tổ hợp tham số với {options['workers']} worker...")
+        results = run_parameter_sweep(components, open_prices, close_prices, *grid, workers=options['workers'])
+
+        sort_by = options['sort_by']
+        if sort_by not in results.columns:
+            self.stdout.write(self.style.ERROR("Không có tổ hợp nào tạo ra giao dịch."))
+            return
+        results = results.sort_values(sort_by, ascending=not SORT_COLUMNS[sort_by], na_position='last')
+        results.insert(0, 'rank', range(1, len(results) + 1))
+        results.to_csv(options['output'], index=False, float_format='%.4f')
+
+        self.stdout.write(self.style.SUCCESS(f"HOÀN TẤT: Đã ghi {len(results)} tổ hợp vào '{options['output']}'."))
+        columns = ['rank', 'threshold', 'target_multiplier', 'stop_multiplier', 'max_holding_period',
+                   'sharpe_ratio', 'calmar_ratio', 'max_drawdown', 'total_return']
+        self.stdout.write(results[columns].head(options['top']).to_string(index=False, float_format='%.2f'))
@@ -0,0 +1,18 @@
+# backend/api/management/commands/build_price_panel.py
+
+from django.core.management.base import BaseCommand
+from api.price_panel import get_price_panel
+
+
+class Command(BaseCommand):
+    help = 'Builds (or validates) the shared columnar OHLCV price panel from StockData.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Rebuild the panel even if it is up to date.')
+
+    def handle(self, *args, **options):
+        self.stdout.write("-> Đang dựng price panel từ StockData...")
+        panel = get_price_panel(rebuild=options['rebuild'])
+        self.stdout.write(self.style.SUCCESS(
+            f"HOÀN TẤT: {len(panel.tickers)} mã × {len(panel.dates)} ngày ({panel.row_count} dòng), "
+            f"ngày cuối {panel.meta.get('last_date')}."))
@@ -5,21 +5,21 @@ from datetime import datetime, timedelta
 import pandas as pd
 from django.core.management.base import BaseCommand
 from django.db import transaction
-from api.models import Stock, StockData
-from vnstock import Listing, Quote
+from api.bulk_loader import load_price_frame, prepare_price_frame
+from api.coverage import plan_fetches, record_fetch, record_fetches
+from api.models import Stock, StockData, TickerCoverage
+from api.rate_limit import get_limiter, is_rate_limit_error, retry_after_seconds
+from api.vnstock_fetcher import listing, quote_history
 
 # --- CẤU HÌNH ---
-BATCH_SIZE = 10000
-INITIAL_DELAY = 2.0
+BATCH_SIZE = 200000
 START_DATE = '2000-01-01'
 
 MAX_GENERAL_RETRIES = 3
 MAX_RATE_LIMIT_RETRIES = 30
 RETRY_DELAY = 5
-RATE_LIMIT_BASE_WAIT = 30
 
 TEST_MODE = False
-RESUME_FROM_TICKER = None
 
 
 class Command(BaseCommand):
@@ -28,6 +28,8 @@ class Command(BaseCommand):
     @transaction.atomic
     def add_arguments(self, parser):
         parser.add_argument('--clean', action='store_true', help='Clean old data before seeding.')
+        parser.add_argument('--upsert', action='store_true',
+                            help='Overwrite stored rows whose OHLCV changed (default: keep existing rows).')
 
     def handle(self, *args, **options):
         if options['clean']:
@@ -42,12 +44,11 @@ class Command(BaseCommand):
         self.stdout.write(self.style.NOTICE("\n[Giai đoạn 1/2] Lấy danh sách, tên công ty, sàn và ngành..."))
 
         try:
-            listing_client = Listing()
             self.stdout.write("    -> Lấy danh sách theo sàn...")
-            df_full_list = listing_client.symbols_by_exchange()
+            df_full_list = listing('symbols_by_exchange')
 
             self.stdout.write("    -> Lấy danh sách theo ngành...")
-            df_industries = listing_client.symbols_by_industries()
+            df_industries = listing('symbols_by_industries')
 
             self.stdout.write("    -> Trộn dữ liệu sàn và ngành...")
             industry_col = next(
@@ -105,25 +106,22 @@ class Command(BaseCommand):
             self.stdout.write(
                 self.style.WARNING(f"  -> CHẾ ĐỘ TEST: Chỉ xử lý {len(tickers_in_db)} mã đầu tiên sau lọc."))
 
-        if RESUME_FROM_TICKER:
-            try:
-                start_index = tickers_in_db.index(RESUME_FROM_TICKER)
-                tickers_in_db = tickers_in_db[start_index:]
-                self.stdout.write(
-                    self.style.WARNING(f"  -> TIẾP TỤC từ mã {RESUME_FROM_TICKER} (còn lại {len(tickers_in_db)} mã)."))
-            except ValueError:
-                self.stdout.write(self.style.ERROR(f"  -> Không tìm thấy mã {RESUME_FROM_TICKER}."))
-                return
+        # Chỉ lấy các khoảng ngày còn thiếu theo TickerCoverage (chạy lại là tiếp tục từ chỗ dừng)
+        plan = plan_fetches(tickers_in_db, datetime.strptime(START_DATE, '%Y-%m-%d').date(), datetime.now().date())
+        self.stdout.write(self.style.SUCCESS(
+            f"  -> {len(tickers_in_db) - len(plan)} mã đã đủ dữ liệu, còn {len(plan)} mã cần lấy phần thiếu."))
+        tickers_in_db = [ticker for ticker in tickers_in_db if ticker in plan]
 
         # --- GIAI ĐOẠN 2: LẤY DỮ LIỆU LỊCH SỬ (SỬA LỖI DATE) ---
         self.stdout.write(self.style.NOTICE("\n[Giai đoạn 2/2] Lấy dữ liệu giá lịch sử..."))
-        stock_data_to_create = []
-        today_str = datetime.now().strftime('%Y-%m-%d')
+        frames, outcomes, buffered_rows = [], [], 0
 
         success_count = 0
         error_count = 0
         low_data_count = 0
         start_time = datetime.now()
+        # Giới hạn tốc độ dùng chung với task Celery và các lệnh nạp dữ liệu khác (thay cho sleep cố định)
+        limiter = get_limiter('vnstock')
 
         i = 0
         while i < len(tickers_in_db):
@@ -138,74 +136,37 @@ class Command(BaseCommand):
                     self.stdout.write(
                         f"  -> Đang xử lý mã {i + 1}/{len(tickers_in_db)}: {ticker} (Retry: G{general_retry_count}/{MAX_GENERAL_RETRIES}, RL{rate_limit_retry_count}/{MAX_RATE_LIMIT_RETRIES})")
 
-                    quote_client = Quote(symbol=ticker)
-                    df_history = quote_client.history(start=START_DATE, end=today_str, interval='1D')
+                    histories = []
+                    for range_start, range_end in plan[ticker]:
+                        # Qua provider cache: chỉ lấy token của limiter khi thực sự gọi vnstock
+                        histories.append(quote_history(ticker, range_start, range_end, limiter=limiter))
+                        limiter.on_success()
+                    histories = [df for df in histories if df is not None and not df.empty]
 
-                    if df_history is None or df_history.empty:
+                    if not histories:
                         self.stdout.write(self.style.WARNING(f"    -> Mã {ticker} không có dữ liệu. Bỏ qua."))
+                        record_fetch(ticker, TickerCoverage.StatusChoices.EMPTY, plan[ticker][0][0])
                         error_count += 1
                         ticker_processed = True
                         continue
 
-                    # SỬA LỖI DATE: Ưu tiên cột 'time' nếu có (thông dụng trong vnstock)
-                    date_col = 'time' if 'time' in df_history.columns else None
-                    if date_col:
-                        df_history[date_col] = pd.to_datetime(df_history[date_col], format='%Y-%m-%d', errors='coerce')
-                        self.stdout.write(f"    -> Sử dụng cột '{date_col}' cho date.")
-                    else:
-                        # Fallback: Convert index nếu là datetime-like
-                        if not isinstance(df_history.index, pd.DatetimeIndex):
-                            df_history.index = pd.to_datetime(df_history.index, format='%Y-%m-%d', errors='coerce')
-                        self.stdout.write(f"    -> Sử dụng index cho date.")
-
-                    required_columns = ['open', 'high', 'low', 'close', 'volume']
-                    if not all(col in df_history.columns for col in required_columns):
+                    # SỬA LỖI DATE: Ưu tiên cột 'time' nếu có (thông dụng trong vnstock), không thì dùng index
+                    df_history = pd.concat(histories)
+                    self.stdout.write(f"    -> Sử dụng {'cột time' if 'time' in df_history.columns else 'index'} cho date.")
+                    try:
+                        frame = prepare_price_frame(df_history, ticker)
+                    except ValueError as e:
                         self.stdout.write(self.style.WARNING(f"    -> Thiếu cột dữ liệu cho {ticker}. Bỏ qua."))
+                        record_fetch(ticker, TickerCoverage.StatusChoices.ERROR, error=e)
                         error_count += 1
                         ticker_processed = True
                         continue
 
-                    df_history.dropna(subset=required_columns + ([date_col] if date_col else []), inplace=True)
-                    if df_history.empty:
-                        self.stdout.write(self.style.WARNING(f"    -> Dữ liệu {ticker} rỗng sau lọc. Bỏ qua."))
-                        error_count += 1
+                    if ticker not in all_stocks_map:
                         ticker_processed = True
                         continue
 
-                    stock_instance = all_stocks_map.get(ticker)
-                    if not stock_instance:
-                        ticker_processed = True
-                        continue
-
-                    rows_added = 0
-                    for _, row in df_history.iterrows():
-                        try:
-                            if date_col:
-                                index_date = row[date_col]
-                            else:
-                                index_date = df_history.index[rows_added]  # Hoặc row.name nếu multiindex
-
-                            if pd.isna(index_date):
-                                self.stdout.write(self.style.WARNING(f"    -> Skip row với date NaT cho {ticker}."))
-                                continue
-
-                            date_obj = index_date.date()
-                            stock_data_to_create.append(
-                                StockData(
-                                    stock=stock_instance,
-                                    date=date_obj,
-                                    open=float(row['open']),
-                                    high=float(row['high']),
-                                    low=float(row['low']),
-                                    close=float(row['close']),
-                                    volume=int(row['volume'])
-                                )
-                            )
-                            rows_added += 1
-                        except (ValueError, TypeError) as row_err:
-                            self.stdout.write(self.style.WARNING(f"    -> Skip row lỗi date cho {ticker}: {row_err}"))
-                            continue  # Skip row này, không bỏ ticker
-
+                    rows_added = len(frame)
                     if rows_added == 0:
                         self.stdout.write(self.style.WARNING(f"    -> Không thêm được row nào cho {ticker}. Bỏ qua."))
                         error_count += 1
@@ -217,27 +178,31 @@ class Command(BaseCommand):
                         self.stdout.write(self.style.WARNING(f"    -> Data ít cho {ticker}: chỉ {rows_added} rows."))
 
                     self.stdout.write(f"    -> Thêm {rows_added} rows cho {ticker}.")
+                    frames.append(frame)
+                    outcomes.append((ticker, TickerCoverage.StatusChoices.OK, plan[ticker][0][0],
+                                     frame['date'].iloc[-1].date(), ''))
+                    buffered_rows += rows_added
 
-                    if len(stock_data_to_create) >= BATCH_SIZE:
-                        self.stdout.write(f"    -> Lưu batch {len(stock_data_to_create)} bản ghi...")
-                        StockData.objects.bulk_create(stock_data_to_create, ignore_conflicts=True)
-                        stock_data_to_create = []
+                    if buffered_rows >= BATCH_SIZE:
+                        self.stdout.write(f"    -> Lưu batch {buffered_rows} bản ghi...")
+                        self._flush(frames, outcomes, options['upsert'])
+                        frames, outcomes, buffered_rows = [], [], 0
 
                     success_count += 1
                     ticker_processed = True
 
                 except Exception as e:
                     error_msg = str(e)
-                    is_rate_limit = "Rate limit exceeded" in error_msg or "quá nhiều request" in error_msg or "429" in error_msg
 
-                    if is_rate_limit:
+                    if is_rate_limit_error(e):
                         rate_limit_retry_count += 1
-                        wait_time = min(RATE_LIMIT_BASE_WAIT * (2 ** (rate_limit_retry_count - 1)), 300)  # Cap 5 phút
+                        # Cooldown dùng chung: limiter.acquire() ở lần thử sau sẽ chờ hết thời gian này
+                        wait_time = limiter.on_rate_limited(retry_after_seconds(e))
                         self.stdout.write(self.style.WARNING(
-                            f"⚠️ Rate limit {ticker}. Chờ {wait_time}s (lần {rate_limit_retry_count})."))
-                        time.sleep(wait_time)
+                            f"⚠️ Rate limit {ticker}. Chờ {wait_time:.0f}s (lần {rate_limit_retry_count})."))
                         if rate_limit_retry_count >= MAX_RATE_LIMIT_RETRIES:
                             self.stdout.write(self.style.ERROR(f"    -> Bỏ qua {ticker} sau max rate limit retries."))
+                            record_fetch(ticker, TickerCoverage.StatusChoices.RATE_LIMITED, error=e)
                             error_count += 1
                             ticker_processed = True
                     else:
@@ -248,11 +213,11 @@ class Command(BaseCommand):
                             time.sleep(RETRY_DELAY)
                         else:
                             self.stdout.write(self.style.ERROR(f"    -> Lỗi cố định {ticker}: {error_msg}"))
+                            record_fetch(ticker, TickerCoverage.StatusChoices.ERROR, error=error_msg)
                             error_count += 1
                             ticker_processed = True
 
             if ticker_processed:
-                time.sleep(INITIAL_DELAY)
                 i += 1
 
             elapsed = (datetime.now() - start_time).total_seconds()
@@ -266,9 +231,9 @@ class Command(BaseCommand):
             ))
 
         # Lưu batch cuối
-        if stock_data_to_create:
-            self.stdout.write(self.style.SUCCESS(f"    -> Lưu {len(stock_data_to_create)} bản ghi cuối..."))
-            StockData.objects.bulk_create(stock_data_to_create, ignore_conflicts=True)
+        if frames:
+            self.stdout.write(self.style.SUCCESS(f"    -> Lưu {buffered_rows} bản ghi cuối..."))
+            self._flush(frames, outcomes, options['upsert'])
 
         # Verify tổng data
         total_records = StockData.objects.count()
@@ -277,4 +242,10 @@ class Command(BaseCommand):
             f"Thống kê: {success_count} ticker thành công, {error_count} lỗi, {low_data_count} ticker data ít."))
         self.stdout.write(self.style.SUCCESS(f"Tổng records trong DB: {total_records} (nên ~3-5M cho lịch sử đầy đủ)."))
         total_time = (datetime.now() - start_time).total_seconds()
-        self.stdout.write(self.style.SUCCESS(f"Thời gian chạy: {total_time / 60:.1f} phút."))
\ No newline at end of file
+        self.stdout.write(self.style.SUCCESS(f"Thời gian chạy: {total_time / 60:.1f} phút."))
+
+    def _flush(self, frames, outcomes, upsert):
+        """Lưu batch và cập nhật độ phủ của các mã trong batch cùng một transaction."""
+        with transaction.atomic():
+            load_price_frame(pd.concat(frames, ignore_index=True), upsert=upsert)
+            record_fetches(outcomes)
@@ -1,30 +1,32 @@
 # backend/api/management/commands/run_stock_analysis.py
 
-import pandas as pd
 from django.core.management.base import BaseCommand
 from django.db import transaction
-from api.models import Stock, StockData, PotentialStock
+from api.models import Stock, PotentialStock
 from api.analysis_logic import run_analysis_on_data
+from api.indicator_state import advance_indicator_states
+from api.analysis_config import ANALYSIS_WINDOW_BARS
+from api.data_loader import liquid_tickers, load_analysis_window, window_start_date
 
 class Command(BaseCommand):
     help = 'Analyzes stocks for the LATEST DAY using the ADMRS.'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of worker processes used to analyse tickers in parallel (default: 1).')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Advance the persisted per-ticker indicator state by the newest bars only.')
+
     @transaction.atomic
     def handle(self, *args, **options):
         self.stdout.write(self.style.SUCCESS("=== Bắt đầu ADMRS cho ngày gần nhất ==="))
 
-        all_data = StockData.objects.all().values('stock_id', 'date', 'open', 'high', 'low', 'close', 'volume')
-        if not all_data.exists(): return
-
-        df_all = pd.DataFrame(list(all_data))
-        # Chuyển đổi kiểu dữ liệu ngay từ đầu
-        numeric_cols = ['open', 'high', 'low', 'close', 'volume']
-        for col in numeric_cols:
-            df_all[col] = pd.to_numeric(df_all[col], errors='coerce', downcast='float')
-        df_all = df_all.dropna(subset=numeric_cols)
-
-        self.stdout.write("-> Đang gọi bộ não phân tích...")
-        potential_stocks_data = run_analysis_on_data(df_all, scan_full_history=False)
+        if options['incremental']:
+            self.stdout.write("-> Đang cập nhật trạng thái indicators tăng dần...")
+            potential_stocks_data = advance_indicator_states(log=self.stdout.write)
+        else:
+            potential_stocks_data = self._run_full_analysis(options['workers'])
+            if potential_stocks_data is None: return
 
         if not potential_stocks_data:
             self.stdout.write(self.style.SUCCESS("Hoàn tất. Không tìm thấy cổ phiếu nào."))
@@ -46,4 +48,16 @@ class Command(BaseCommand):
                 final_objects.append(PotentialStock(**obj_data))
 
         PotentialStock.objects.bulk_create(final_objects)
-        self.stdout.write(self.style.SUCCESS(f"HOÀN TẤT: Đã lưu {len(final_objects)} cổ phiếu tiềm năng."))
\ No newline at end of file
+        self.stdout.write(self.style.SUCCESS(f"HOÀN TẤT: Đã lưu {len(final_objects)} cổ phiếu tiềm năng."))
+
+    def _run_full_analysis(self, workers):
+        """Tải cửa sổ ANALYSIS_WINDOW_BARS phiên gần nhất và tính lại indicators từ đầu cho mọi mã."""
+        start_date = window_start_date(ANALYSIS_WINDOW_BARS)
+        tickers = liquid_tickers(window_start=start_date)
+        if not tickers: return None
+        self.stdout.write(f"-> {len(tickers)} mã đạt ngưỡng thanh khoản. Đang tải {ANALYSIS_WINDOW_BARS} phiên gần nhất...")
+        df_all = load_analysis_window(ANALYSIS_WINDOW_BARS, tickers=tickers, start_date=start_date)
+        if df_all.empty: return None
+
+        self.stdout.write("-> Đang gọi bộ não phân tích...")
+        return run_analysis_on_data(df_all, scan_full_history=False, workers=workers)
@@ -1,26 +1,27 @@
 # backend/api/management/commands/seed_stock_data.py
 
-import time
 from datetime import datetime, timedelta
 import pandas as pd
 from django.core.management.base import BaseCommand
 from django.db import transaction
-from api.models import Stock, StockData
-from vnstock import Listing, Quote
+from api.bulk_loader import load_price_frame, prepare_price_frame
+from api.coverage import plan_fetches, record_fetch, record_fetches
+from api.models import Stock, StockData, TickerCoverage
+from api.rate_limit import get_limiter, is_rate_limit_error
+from api.vnstock_fetcher import fetch_many, listing, quote_history
 
-BATCH_SIZE = 20000
-INITIAL_DELAY = 1.5
+BATCH_SIZE = 200000
 DEFAULT_START_DATE = '2020-01-01'
 
+DEFAULT_WORKERS = 4
+
 # Retry
 MAX_GENERAL_RETRIES = 3
 MAX_RATE_LIMIT_RETRIES = 30
 RETRY_DELAY = 5
-RATE_LIMIT_BASE_WAIT = 30
 
 # Chế độ
 TEST_MODE = False
-RESUME_FROM_TICKER = None
 
 class Command(BaseCommand):
     help = 'Seed stocks & OHLCV data from 2020 (optimized for vnstock==3.2.6, full TA ready).'
@@ -30,8 +31,13 @@ class Command(BaseCommand):
         parser.add_argument('--start-date', type=str, default=DEFAULT_START_DATE,
                             help='Start date (default: 2020-01-01).')
         parser.add_argument('--verify', action='store_true', help='Only verify existing data (no seeding).')
+        parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                            help=f'Number of concurrent vnstock requests (default: {DEFAULT_WORKERS}).')
+        parser.add_argument('--upsert', action='store_true',
+                            help='Overwrite stored rows whose OHLCV changed (default: keep existing rows).')
+        parser.add_argument('--infile', action='store_true',
+                            help='Load batches with LOAD DATA LOCAL INFILE (MySQL with local_infile enabled).')
 
-    @transaction.atomic
     def handle(self, *args, **options):
         start_date = options['start_date']
         verify_only = options['verify']
@@ -49,9 +55,8 @@ class Command(BaseCommand):
         # --- GIAI ĐOẠN 1: METADATA (giữ nguyên, ổn định) ---
         self.stdout.write(self.style.NOTICE("\n[Giai đoạn 1/2] Lấy metadata..."))
         try:
-            listing_client = Listing()
-            df_full_list = listing_client.symbols_by_exchange()
-            df_industries = listing_client.symbols_by_industries()
+            df_full_list = listing('symbols_by_exchange')
+            df_industries = listing('symbols_by_industries')
 
             industry_col = next((col for col in ['icb_name4', 'icb_name3', 'icb_name2'] if col in df_industries.columns), None)
             if industry_col:
@@ -97,153 +102,71 @@ class Command(BaseCommand):
             tickers_in_db = tickers_in_db[:50]
             self.stdout.write(self.style.WARNING(f"  -> TEST MODE: Chỉ {len(tickers_in_db)} mã."))
 
-        if RESUME_FROM_TICKER:
-            try:
-                start_index = tickers_in_db.index(RESUME_FROM_TICKER)
-                tickers_in_db = tickers_in_db[start_index:]
-                self.stdout.write(self.style.WARNING(f"  -> Resume từ {RESUME_FROM_TICKER}: {len(tickers_in_db)} mã."))
-            except ValueError:
-                self.stdout.write(self.style.ERROR(f"  -> Không tìm thấy {RESUME_FROM_TICKER}."))
-                return
+        # Chỉ lấy phần còn thiếu so với độ phủ đã ghi nhận (TickerCoverage): chạy lại là tiếp tục từ chỗ dừng
+        today = datetime.now().date()
+        plan = plan_fetches(tickers_in_db, datetime.strptime(start_date, '%Y-%m-%d').date(), today)
+        self.stdout.write(self.style.SUCCESS(
+            f"  -> {len(tickers_in_db) - len(plan)} mã đã đủ dữ liệu, còn {len(plan)} mã cần lấy phần thiếu."))
+        tickers_in_db = [ticker for ticker in tickers_in_db if ticker in plan]
+        if not tickers_in_db:
+            self._verify_data()
+            return
 
-        # --- GIAI ĐOẠN 2: SEED DATA (tối ưu date handling từ test) ---
-        self.stdout.write(self.style.NOTICE(f"\n[Giai đoạn 2/2] Lấy OHLCV từ {start_date}..."))
-        stock_data_to_create = []
-        today_str = datetime.now().strftime('%Y-%m-%d')  # 2025-09-09
+        # --- GIAI ĐOẠN 2: SEED DATA (song song, tốc độ do bộ giới hạn dùng chung điều khiển) ---
+        self.stdout.write(self.style.NOTICE(f"\n[Giai đoạn 2/2] Lấy OHLCV từ {start_date} với {options['workers']} luồng..."))
+        frames, outcomes, buffered_rows = [], [], 0
+        load_options = {'upsert': options['upsert'], 'infile': options['infile']}
 
         success_count = 0
         error_count = 0
         low_data_count = 0
         start_time = datetime.now()
 
-        i = 0
-        while i < len(tickers_in_db):
-            ticker = tickers_in_db[i]
-            general_retry_count = 0
-            rate_limit_retry_count = 0
-            ticker_processed = False
-
-            while (general_retry_count < MAX_GENERAL_RETRIES or rate_limit_retry_count < MAX_RATE_LIMIT_RETRIES) and not ticker_processed:
-                try:
-                    self.stdout.write(f"  -> {i + 1}/{len(tickers_in_db)}: {ticker} (G{general_retry_count}, RL{rate_limit_retry_count})")
-
-                    quote_client = Quote(symbol=ticker)
-                    df_history = quote_client.history(start=start_date, end=today_str, interval='1D')
-
-                    if df_history is None or df_history.empty:
-                        self.stdout.write(self.style.WARNING(f"    -> Không data cho {ticker} (mã mới?)."))
-                        error_count += 1
-                        ticker_processed = True
-                        continue
-
-                    # Date handling: Ưu tiên cột 'time' (như test)
-                    if 'time' in df_history.columns:
-                        df_history['time'] = pd.to_datetime(df_history['time'], format='%Y-%m-%d', errors='coerce')
-                        date_source = 'time'
-                    else:
-                        # Fallback index (hiếm, nhưng an toàn)
-                        df_history.index = pd.to_datetime(df_history.index, errors='coerce')
-                        date_source = 'index'
-
-                    required_columns = ['open', 'high', 'low', 'close', 'volume']
-                    if not all(col in df_history.columns for col in required_columns):
-                        raise ValueError(f"Thiếu cột OHLCV")
-
-                    df_history.dropna(subset=required_columns + (['time'] if date_source == 'time' else []), inplace=True)
-                    if df_history.empty:
-                        raise ValueError("Data rỗng sau dropna")
-
-                    stock_instance = all_stocks_map.get(ticker)
-                    if not stock_instance:
-                        ticker_processed = True
-                        continue
-
-                    rows_added = 0
-                    min_date = None
-                    max_date = None
-                    dates_set = set()  # Tránh duplicate date
-
-                    for idx, row in df_history.iterrows():
-                        try:
-                            if date_source == 'time':
-                                index_date = row['time']
-                            else:
-                                index_date = idx
-
-                            if pd.isna(index_date):
-                                continue
-
-                            date_obj = index_date.date()
-                            if date_obj in dates_set:
-                                continue  # Skip duplicate (nếu có)
-                            dates_set.add(date_obj)
-
-                            if min_date is None or date_obj < min_date:
-                                min_date = date_obj
-                            if max_date is None or date_obj > max_date:
-                                max_date = date_obj
-
-                            stock_data_to_create.append(
-                                StockData(
-                                    stock=stock_instance,
-                                    date=date_obj,
-                                    open=float(row['open']),
-                                    high=float(row['high']),
-                                    low=float(row['low']),
-                                    close=float(row['close']),
-                                    volume=int(row['volume'])
-                                )
-                            )
-                            rows_added += 1
-                        except (ValueError, TypeError, KeyError):
-                            continue  # Skip row lỗi
-
-                    if rows_added == 0:
-                        raise ValueError("Không thêm row nào")
-
-                    if rows_added < 200:
-                        low_data_count += 1
-                        self.stdout.write(self.style.WARNING(f"    -> Data ít: {rows_added} rows cho {ticker}."))
-
-                    self.stdout.write(f"    -> Thêm {rows_added} rows ({date_source}) cho {ticker} (từ {min_date} đến {max_date}).")
-
-                    if len(stock_data_to_create) >= BATCH_SIZE:
-                        self.stdout.write(f"    -> Lưu batch {len(stock_data_to_create)}...")
-                        StockData.objects.bulk_create(stock_data_to_create, ignore_conflicts=True)
-                        stock_data_to_create = []
-
-                    success_count += 1
-                    ticker_processed = True
-
-                except Exception as e:
-                    error_msg = str(e).lower()
-                    is_rate_limit = any(phrase in error_msg for phrase in ["rate limit", "quá nhiều", "429", "throttled"])
-
-                    if is_rate_limit:
-                        rate_limit_retry_count += 1
-                        wait_time = min(RATE_LIMIT_BASE_WAIT * (2 ** (rate_limit_retry_count - 1)), 300)
-                        self.stdout.write(self.style.WARNING(f"⚠️ Rate limit {ticker}. Chờ {wait_time}s (lần {rate_limit_retry_count})."))
-                        time.sleep(wait_time)
-                        if rate_limit_retry_count >= MAX_RATE_LIMIT_RETRIES:
-                            self.stdout.write(self.style.ERROR(f"    -> Bỏ {ticker} sau max RL."))
-                            error_count += 1
-                            ticker_processed = True
-                    else:
-                        general_retry_count += 1
-                        if general_retry_count < MAX_GENERAL_RETRIES:
-                            self.stdout.write(self.style.WARNING(f"    -> Lỗi tạm {ticker}: {str(e)[:50]}... Retry {RETRY_DELAY}s."))
-                            time.sleep(RETRY_DELAY)
-                        else:
-                            self.stdout.write(self.style.ERROR(f"    -> Lỗi cố định {ticker}: {e}"))
-                            error_count += 1
-                            ticker_processed = True
-
-            time.sleep(INITIAL_DELAY)
-            i += 1
+        limiter = get_limiter('vnstock')
+
+        def fetch_one(ticker):
+            histories = [quote_history(ticker, range_start, range_end, limiter=limiter)
+                         for range_start, range_end in plan[ticker]]
+            histories = [df for df in histories if df is not None and not df.empty]
+            if not histories:
+                return None
+            df_history = pd.concat(histories)
+            # Lỗi dữ liệu (ValueError) được fetch_many thử lại như lỗi tạm thời
+            return self._frame_from_history(df_history, ticker)
+
+        results = fetch_many(tickers_in_db, fetch_one, limiter=limiter, workers=options['workers'],
+                             max_general_retries=MAX_GENERAL_RETRIES, max_rate_limit_retries=MAX_RATE_LIMIT_RETRIES,
+                             retry_delay=RETRY_DELAY, acquire=False)
+        for processed, (ticker, result, error) in enumerate(results, 1):
+            requested_start = plan[ticker][0][0]
+            if error is not None:
+                self.stdout.write(self.style.ERROR(f"    -> Lỗi cố định {ticker}: {error}"))
+                status = (TickerCoverage.StatusChoices.RATE_LIMITED if is_rate_limit_error(error)
+                          else TickerCoverage.StatusChoices.ERROR)
+                record_fetch(ticker, status, error=error)
+                error_count += 1
+            elif result is None:
+                self.stdout.write(self.style.WARNING(f"    -> Không data cho {ticker} (mã mới?)."))
+                record_fetch(ticker, TickerCoverage.StatusChoices.EMPTY, requested_start)
+                error_count += 1
+            else:
+                frame, date_source, min_date, max_date = result
+                if len(frame) < 200:
+                    low_data_count += 1
+                    self.stdout.write(self.style.WARNING(f"    -> Data ít: {len(frame)} rows cho {ticker}."))
+                self.stdout.write(f"    -> Thêm {len(frame)} rows ({date_source}) cho {ticker} (từ {min_date} đến {max_date}).")
+                frames.append(frame)
+                outcomes.append((ticker, TickerCoverage.StatusChoices.OK, requested_start, max_date, ''))
+                buffered_rows += len(frame)
+                success_count += 1
+
+                if buffered_rows >= BATCH_SIZE:
+                    self.stdout.write(f"    -> Lưu batch {buffered_rows}...")
+                    self._flush(frames, outcomes, load_options)
+                    frames, outcomes, buffered_rows = [], [], 0
 
             # Progress (cải thiện ETA)
             elapsed = (datetime.now() - start_time).total_seconds()
-            processed = i
             avg_time = elapsed / processed if processed > 0 else 0
             remaining = (len(tickers_in_db) - processed) * avg_time
             eta = datetime.now() + timedelta(seconds=remaining)
@@ -251,9 +174,9 @@ class Command(BaseCommand):
                 f"    -> {processed}/{len(tickers_in_db)} | Success: {success_count} | Errors: {error_count} | Low: {low_data_count} | ETA: {remaining/60:.1f} min (~{eta.strftime('%H:%M')})"
             ))
 
-        if stock_data_to_create:
-            self.stdout.write(self.style.SUCCESS(f"    -> Lưu batch cuối {len(stock_data_to_create)}..."))
-            StockData.objects.bulk_create(stock_data_to_create, ignore_conflicts=True)
+        if frames:
+            self.stdout.write(self.style.SUCCESS(f"    -> Lưu batch cuối {buffered_rows}..."))
+            self._flush(frames, outcomes, load_options)
 
         # Verify tổng quát & ví dụ
         self._verify_data()
@@ -261,9 +184,24 @@ class Command(BaseCommand):
         total_time = (datetime.now() - start_time).total_seconds()
         self.stdout.write(self.style.SUCCESS(f"\n=== HOÀN TẤT LẦN CUỐI! ==="))
         self.stdout.write(self.style.SUCCESS(f"Thống kê: {success_count} success, {error_count} errors ({error_count/len(tickers_in_db)*100:.1f}%), {low_data_count} low data."))
-        self.stdout.write(self.style.SUCCESS(f"Tổng records: {total_records} (~{total_records/success_count:.0f} rows/ticker trung bình)."))
+        self.stdout.write(self.style.SUCCESS(f"Tổng records: {total_records} (~{total_records/max(success_count, 1):.0f} rows/ticker trung bình)."))
         self.stdout.write(self.style.SUCCESS(f"Thời gian: {total_time/60:.1f} phút. Data sẵn sàng cho TA!"))
 
+    def _flush(self, frames, outcomes, load_options):
+        """Lưu batch và cập nhật độ phủ của các mã trong batch cùng một transaction."""
+        with transaction.atomic():
+            load_price_frame(pd.concat(frames, ignore_index=True), **load_options)
+            record_fetches(outcomes)
+
+    def _frame_from_history(self, df_history, ticker):
+        """(khung giá chuẩn của bulk_loader, nguồn ngày, ngày đầu, ngày cuối) từ kết quả Quote.history của một mã."""
+        # Date handling: Ưu tiên cột 'time' (như test), fallback index
+        date_source = 'time' if 'time' in df_history.columns else 'index'
+        frame = prepare_price_frame(df_history, ticker)
+        if frame.empty:
+            raise ValueError("Không thêm row nào")
+        return frame, date_source, frame['date'].iloc[0].date(), frame['date'].iloc[-1].date()
+
     def _verify_data(self):
         """Verify DB: Tổng records, ví dụ 5 ticker đầu với date range."""
         self.stdout.write(self.style.NOTICE("\n--- VERIFY DB ---"))
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_potentialstock_stop_loss'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndicatorState',
+            fields=[
+                ('stock', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='indicator_state', serialize=False, to='api.stock')),
+                ('last_date', models.DateField(help_text='Phiên cuối cùng đã được đưa vào trạng thái')),
+                ('bar_count', models.PositiveIntegerField(default=0, help_text='Số phiên đã xử lý')),
+                ('state', models.JSONField(default=dict, help_text='Trạng thái đã tuần tự hoá (xem api.indicator_state)')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Trạng thái indicators',
+                'verbose_name_plural': 'Trạng thái indicators',
+            },
+        ),
+    ]
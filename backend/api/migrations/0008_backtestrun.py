@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_indicatorstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BacktestRun',
+            fields=[
+                ('key', models.CharField(help_text='SHA-256 của cấu hình + phiên bản dữ liệu', max_length=64, primary_key=True, serialize=False)),
+                ('config', models.JSONField(help_text='Cấu hình backtest đã chuẩn hoá')),
+                ('data_version', models.CharField(help_text='Dấu vân tay dữ liệu giá lúc chạy', max_length=64)),
+                ('status', models.CharField(choices=[('PENDING', 'Đang chờ'), ('RUNNING', 'Đang chạy'), ('DONE', 'Hoàn tất'), ('FAILED', 'Lỗi')], default='PENDING', max_length=10)),
+                ('metrics', models.JSONField(blank=True, default=dict)),
+                ('equity_curve', models.BinaryField(blank=True, help_text='Ngày + giá trị danh mục (nén)', null=True)),
+                ('trades', models.BinaryField(blank=True, help_text='Sổ lệnh (JSON nén)', null=True)),
+                ('trade_count', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Kết quả backtest',
+                'verbose_name_plural': 'Kết quả backtest',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_backtestrun'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TickerCoverage',
+            fields=[
+                ('stock', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='coverage', serialize=False, to='api.stock')),
+                ('first_date', models.DateField(blank=True, help_text='Ngày đầu của khoảng đã lấy', null=True)),
+                ('last_date', models.DateField(blank=True, help_text='Ngày cuối của khoảng đã lấy', null=True)),
+                ('last_status', models.CharField(blank=True, choices=[('OK', 'Thành công'), ('EMPTY', 'Không có dữ liệu'), ('ERROR', 'Lỗi'), ('RATE_LIMITED', 'Bị giới hạn tốc độ')], max_length=12)),
+                ('last_error', models.TextField(blank=True)),
+                ('last_fetched_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Độ phủ dữ liệu giá',
+                'verbose_name_plural': 'Độ phủ dữ liệu giá',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 05:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_tickercoverage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tickercoverage',
+            name='revised_at',
+            field=models.DateTimeField(blank=True, help_text='Lần gần nhất dữ liệu đã lưu của mã bị sửa bởi upsert', null=True),
+        ),
+    ]
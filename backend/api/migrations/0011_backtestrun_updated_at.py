@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 06:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_tickercoverage_revised_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backtestrun',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, help_text='Lần đổi trạng thái / heartbeat gần nhất của worker'),
+        ),
+    ]
@@ -235,3 +235,97 @@ class Article(models.Model):
 
     def __str__(self):
         return self.title
+
+
+# ==============================================================================
+# 8. IndicatorState - Trạng thái indicators tăng dần cho phân tích hằng ngày
+# ==============================================================================
+
+class IndicatorState(models.Model):
+    """
+    Trạng thái indicators (tổng trượt SMA, Wilder RSI/ATR, EMA MACD, đỉnh 52 tuần...) của một mã.
+    Phân tích hằng ngày chỉ cần tiến trạng thái thêm phiên mới thay vì tính lại toàn bộ lịch sử.
+    """
+    stock = models.OneToOneField(Stock, on_delete=models.CASCADE, primary_key=True,
+                                 related_name='indicator_state')
+    last_date = models.DateField(help_text="Phiên cuối cùng đã được đưa vào trạng thái")
+    bar_count = models.PositiveIntegerField(default=0, help_text="Số phiên đã xử lý")
+    state = models.JSONField(default=dict, help_text="Trạng thái đã tuần tự hoá (xem api.indicator_state)")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Trạng thái indicators"
+        verbose_name_plural = "Trạng thái indicators"
+
+    def __str__(self):
+        return f"{self.stock_id} @ {self.last_date}"
+
+
+# ==============================================================================
+# 9. BacktestRun - Kết quả backtest lưu theo địa chỉ nội dung
+# ==============================================================================
+
+class BacktestRun(models.Model):
+    """
+    Một lần chạy backtest, định danh bằng SHA-256 của cấu hình + phiên bản dữ liệu.
+    Cùng cấu hình trên dữ liệu chưa đổi sẽ dùng lại kết quả đã lưu thay vì mô phỏng lại.
+    Đường vốn và sổ lệnh được nén (xem api.backtest_runs).
+    """
+    class StatusChoices(models.TextChoices):
+        PENDING = 'PENDING', 'Đang chờ'
+        RUNNING = 'RUNNING', 'Đang chạy'
+        DONE = 'DONE', 'Hoàn tất'
+        FAILED = 'FAILED', 'Lỗi'
+
+    key = models.CharField(max_length=64, primary_key=True, help_text="SHA-256 của cấu hình + phiên bản dữ liệu")
+    config = models.JSONField(help_text="Cấu hình backtest đã chuẩn hoá")
+    data_version = models.CharField(max_length=64, help_text="Dấu vân tay dữ liệu giá lúc chạy")
+    status = models.CharField(max_length=10, choices=StatusChoices.choices, default=StatusChoices.PENDING)
+    metrics = models.JSONField(default=dict, blank=True)
+    equity_curve = models.BinaryField(null=True, blank=True, help_text="Ngày + giá trị danh mục (nén)")
+    trades = models.BinaryField(null=True, blank=True, help_text="Sổ lệnh (JSON nén)")
+    trade_count = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, help_text="Lần đổi trạng thái / heartbeat gần nhất của worker")
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = "Kết quả backtest"
+        verbose_name_plural = "Kết quả backtest"
+
+    def __str__(self):
+        return f"{self.key[:12]} ({self.status})"
+
+
+# ==============================================================================
+# 10. TickerCoverage - Khoảng dữ liệu giá đã lấy cho từng mã
+# ==============================================================================
+
+class TickerCoverage(models.Model):
+    """
+    Khoảng ngày liên tục [first_date, last_date] đã có trong StockData của một mã, cùng kết quả lần lấy gần nhất.
+    Các lệnh nạp dữ liệu chỉ gọi API cho phần còn thiếu (xem api.coverage) và có thể dừng / chạy lại bất cứ lúc nào.
+    """
+    class StatusChoices(models.TextChoices):
+        OK = 'OK', 'Thành công'
+        EMPTY = 'EMPTY', 'Không có dữ liệu'
+        ERROR = 'ERROR', 'Lỗi'
+        RATE_LIMITED = 'RATE_LIMITED', 'Bị giới hạn tốc độ'
+
+    stock = models.OneToOneField(Stock, on_delete=models.CASCADE, primary_key=True, related_name='coverage')
+    first_date = models.DateField(null=True, blank=True, help_text="Ngày đầu của khoảng đã lấy")
+    last_date = models.DateField(null=True, blank=True, help_text="Ngày cuối của khoảng đã lấy")
+    last_status = models.CharField(max_length=12, choices=StatusChoices.choices, blank=True)
+    last_error = models.TextField(blank=True)
+    last_fetched_at = models.DateTimeField(null=True, blank=True)
+    revised_at = models.DateTimeField(null=True, blank=True,
+                                      help_text="Lần gần nhất dữ liệu đã lưu của mã bị sửa bởi upsert")
+
+    class Meta:
+        verbose_name = "Độ phủ dữ liệu giá"
+        verbose_name_plural = "Độ phủ dữ liệu giá"
+
+    def __str__(self):
+        return f"{self.stock_id}: {self.first_date} → {self.last_date} ({self.last_status})"
@@ -0,0 +1,76 @@
+# backend/api/monte_carlo.py
+"""
+Đánh giá độ bền của kết quả backtest bằng Monte Carlo trên sổ lệnh.
+
+Từ lợi nhuận của từng giao dịch đã đóng, tạo hàng nghìn đường vốn giả lập bằng hai cách:
+- 'permute': giữ nguyên tập giao dịch, chỉ đảo thứ tự (lợi nhuận cuối như nhau, drawdown thay đổi);
+- 'resample': bootstrap có hoàn lại (thay đổi cả lợi nhuận lẫn drawdown).
+Mọi đường được tính cùng lúc theo lô bằng mảng NumPy (số đường × số giao dịch), không lặp Python theo từng đường.
+"""
+
+import numpy as np
+import pandas as pd
+
+PERCENTILES = (5, 25, 50, 75, 95)
+BATCH_SIZE = 2_000
+
+
+def trade_returns(trades):
+    """Lợi nhuận (tỷ lệ) và ngày đóng của các giao dịch đã đóng trong sổ lệnh, theo thứ tự đóng lệnh."""
+    closed = sorted((t for t in trades if t['exit_price'] is not None), key=lambda t: t['exit_date'])
+    returns = np.array([float(t['exit_price'] / t['entry_price']) - 1 for t in closed], dtype=np.float64)
+    return returns, [t['exit_date'] for t in closed], [t['entry_date'] for t in closed]
+
+
+def _path_metrics(growth, years, trades_per_year):
+    """CAGR, Sharpe (theo giao dịch, quy năm) và max drawdown (%) cho từng đường (mỗi hàng một đường)."""
+    equity = np.cumprod(growth, axis=1)
+    cagr = (equity[:, -1] ** (1 / years) - 1) * 100
+
+    step_returns = growth - 1
+    std = step_returns.std(axis=1, ddof=1) if growth.shape[1] > 1 else np.zeros(len(growth))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = np.where(std > 0, step_returns.mean(axis=1) / std * np.sqrt(trades_per_year), 0.0)
+
+    # Đỉnh tính cả vốn ban đầu (1.0) để giao dịch lỗ đầu tiên cũng là drawdown
+    peaks = np.maximum(np.maximum.accumulate(equity, axis=1), 1.0)
+    max_drawdown = ((equity - peaks) / peaks).min(axis=1) * 100
+    return cagr, sharpe, max_drawdown
+
+
+def run_monte_carlo(trades, n_paths=10_000, position_size=0.10, method='resample', seed=None):
+    """
+    Mô phỏng n_paths đường vốn từ sổ lệnh. Mỗi giao dịch tác động lên vốn theo tỷ trọng position_size:
+    vốn *= 1 + position_size * lợi nhuận giao dịch.
+    Trả về dict các mảng 'cagr', 'sharpe', 'max_drawdown' (mỗi mảng n_paths phần tử); None nếu chưa có giao dịch.
+    """
+    returns, exit_dates, entry_dates = trade_returns(trades)
+    if len(returns) == 0:
+        return None
+
+    span_days = max((max(exit_dates) - min(entry_dates)).days, 1)
+    years = span_days / 365.25
+    trades_per_year = len(returns) / years
+    rng = np.random.default_rng(seed)
+    step_growth = 1 + position_size * returns
+
+    results = {'cagr': [], 'sharpe': [], 'max_drawdown': []}
+    for start in range(0, n_paths, BATCH_SIZE):
+        batch = min(BATCH_SIZE, n_paths - start)
+        if method == 'permute':
+            growth = rng.permuted(np.broadcast_to(step_growth, (batch, len(returns))), axis=1)
+        elif method == 'resample':
+            growth = step_growth[rng.integers(0, len(returns), size=(batch, len(returns)))]
+        else:
+            raise ValueError(f"Phương pháp Monte Carlo không hợp lệ: {method!r}")
+        for key, values in zip(results, _path_metrics(growth, years, trades_per_year)):
+            results[key].append(values)
+    return {key: np.concatenate(values) for key, values in results.items()}
+
+
+def confidence_bands(simulation, percentiles=PERCENTILES):
+    """Bảng phân vị (hàng: chỉ số, cột: phân vị) từ kết quả run_monte_carlo."""
+    return pd.DataFrame({
+        f'P{p}': [np.percentile(simulation[key], p) for key in ('cagr', 'sharpe', 'max_drawdown')]
+        for p in percentiles
+    }, index=['CAGR (%)', 'Sharpe', 'Max Drawdown (%)'])
@@ -0,0 +1,363 @@
+# backend/api/price_panel.py
+"""
+Price panel: kho OHLCV dạng cột dùng chung cho phân tích, backtest và API biểu đồ.
+
+Dữ liệu được tổ chức thành các mảng 2 chiều (ngày × mã) cho từng trường, dựng một lần từ StockData
+bằng values_list (ép kiểu float ngay trong SQL, không qua Decimal) rồi lưu xuống đĩa dưới dạng file nhị phân
+thô để các process khác mở bằng np.memmap. Dữ liệu EOD mới được ghi nối thêm (append) thay vì dựng lại.
+
+Giá lưu float32; khối lượng lưu float64 vì khối lượng > 2^24 cổ phiếu không biểu diễn chính xác bằng float32.
+"""
+
+import fcntl
+import json
+import logging
+import os
+from contextlib import contextmanager
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db.models import Count, FloatField, Max
+from django.db.models.functions import Cast
+
+from .models import StockData
+
+logger = logging.getLogger(__name__)
+
+PANEL_FIELDS = ('open', 'high', 'low', 'close', 'volume')
+PANEL_DTYPES = {'open': np.float32, 'high': np.float32, 'low': np.float32, 'close': np.float32,
+                'volume': np.float64}
+META_FILE = 'meta.json'
+LOCK_FILE = 'panel.lock'
+DB_CHUNK_SIZE = 100_000
+
+_loaded_panel = None  # (mtime của meta.json, PricePanel) — cache trong process
+
+
+def _panel_dir():
+    return Path(getattr(settings, 'PRICE_PANEL_DIR', Path(settings.BASE_DIR) / 'var' / 'price_panel'))
+
+
+@contextmanager
+def _write_lock(directory):
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / LOCK_FILE, 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class PricePanel:
+    """Các mảng OHLCV (ngày × mã) kèm trục ngày (datetime64[D]) và chỉ mục mã."""
+
+    def __init__(self, dates, tickers, arrays, meta=None):
+        self.dates = np.asarray(dates, dtype='datetime64[D]')
+        self.tickers = list(tickers)
+        self.ticker_index = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self.arrays = arrays
+        self.meta = meta or {}
+
+    def __getitem__(self, field):
+        return self.arrays[field]
+
+    @property
+    def row_count(self):
+        """Số ô (ngày, mã) có dữ liệu — tương ứng số dòng StockData."""
+        return int(np.count_nonzero(~np.isnan(self.arrays['close'])))
+
+    # ------------------------------------------------------------------ dựng / lưu / nạp
+
+    @classmethod
+    def from_database(cls, chunk_size=DB_CHUNK_SIZE):
+        """Dựng panel từ toàn bộ StockData, đọc theo từng lô để không giữ hàng triệu đối tượng Python."""
+        queryset = StockData.objects.annotate(
+            **{f'{field}_f': Cast(field, FloatField()) for field in PANEL_FIELDS}
+        ).values_list('stock_id', 'date', *[f'{field}_f' for field in PANEL_FIELDS])
+
+        codes, ticker_codes, date_chunks, value_chunks = {}, [], [], []
+        rows = queryset.iterator(chunk_size=chunk_size)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            stock_ids, dates, *values = zip(*chunk)
+            ticker_codes.append(np.fromiter((codes.setdefault(t, len(codes)) for t in stock_ids),
+                                            dtype=np.int64, count=len(chunk)))
+            date_chunks.append(np.array(dates, dtype='datetime64[D]'))
+            value_chunks.append(np.array(values, dtype=np.float64))
+
+        if not date_chunks:
+            return cls(np.array([], dtype='datetime64[D]'), [],
+                       {f: np.empty((0, 0), dtype=PANEL_DTYPES[f]) for f in PANEL_FIELDS})
+
+        all_dates = np.concatenate(date_chunks)
+        all_codes = np.concatenate(ticker_codes)
+        all_values = np.concatenate(value_chunks, axis=1)
+
+        tickers = sorted(codes)
+        code_to_column = np.empty(len(codes), dtype=np.int64)
+        for ticker, code in codes.items():
+            code_to_column[code] = tickers.index(ticker)
+        dates, date_rows = np.unique(all_dates, return_inverse=True)
+        columns = code_to_column[all_codes]
+
+        arrays = {}
+        for n, field in enumerate(PANEL_FIELDS):
+            array = np.full((len(dates), len(tickers)), np.nan, dtype=PANEL_DTYPES[field])
+            array[date_rows, columns] = all_values[n]
+            arrays[field] = array
+        return cls(dates, tickers, arrays)
+
+    def save(self, directory=None):
+        """Ghi toàn bộ panel xuống đĩa (ghi file tạm rồi đổi tên để tiến trình đọc không thấy file dở)."""
+        directory = Path(directory or _panel_dir())
+        with _write_lock(directory):
+            self._write_all(directory)
+
+    def _write_all(self, directory):
+        for field in PANEL_FIELDS:
+            tmp_path = directory / f'{field}.bin.tmp'
+            np.ascontiguousarray(self.arrays[field], dtype=PANEL_DTYPES[field]).tofile(tmp_path)
+            os.replace(tmp_path, directory / f'{field}.bin')
+        self.meta = {
+            'dates': [str(d) for d in self.dates],
+            'tickers': self.tickers,
+            'row_count': self.row_count,
+            'last_date': str(self.dates[-1]) if len(self.dates) else None,
+            'revision': self.meta.get('revision', 0) + 1,
+        }
+        tmp_meta = directory / f'{META_FILE}.tmp'
+        tmp_meta.write_text(json.dumps(self.meta))
+        os.replace(tmp_meta, directory / META_FILE)
+
+    @classmethod
+    def load(cls, directory=None, mmap=True):
+        """Nạp panel từ đĩa; mặc định các mảng là np.memmap chỉ đọc. Trả về None nếu chưa có panel."""
+        directory = Path(directory or _panel_dir())
+        meta_path = directory / META_FILE
+        if not meta_path.exists():
+            return None
+        meta = json.loads(meta_path.read_text())
+        shape = (len(meta['dates']), len(meta['tickers']))
+        arrays = {}
+        for field in PANEL_FIELDS:
+            path = directory / f'{field}.bin'
+            if mmap and shape[0] and shape[1]:
+                # Chỉ map đúng phần ứng với meta hiện tại; phần được append sau đó sẽ bị bỏ qua
+                arrays[field] = np.memmap(path, dtype=PANEL_DTYPES[field], mode='r', shape=shape)
+            else:
+                arrays[field] = np.fromfile(path, dtype=PANEL_DTYPES[field],
+                                            count=shape[0] * shape[1]).reshape(shape)
+        return cls(np.array(meta['dates'], dtype='datetime64[D]'), meta['tickers'], arrays, meta)
+
+    # ------------------------------------------------------------------ ghi tăng dần
+
+    def append_rows(self, rows, overwrite=False, directory=None):
+        """
+        Ghi các dòng EOD mới (ticker, date, open, high, low, close, volume) vào panel trên đĩa.
+
+        - Ngày mới nằm sau ngày cuối cùng và không có mã mới: chỉ ghi các dòng ngày mới vào cuối file và các ô
+          bị chạm tới qua memmap r+, không đọc / ghi lại phần còn lại của panel.
+        - Ô đã tồn tại: bỏ qua ô đã có dữ liệu trừ khi overwrite=True
+          (giống bulk_create(ignore_conflicts=True) phía database).
+        - Mã mới hoặc ngày chen vào giữa lịch sử: dựng lại file từ bản trong bộ nhớ.
+        """
+        rows = list(rows)
+        if not rows:
+            return self
+        directory = Path(directory or _panel_dir())
+        with _write_lock(directory):
+            current = PricePanel.load(directory) or self
+            return current._apply_rows(rows, overwrite, directory)
+
+    def _apply_rows(self, rows, overwrite, directory):
+        frame = pd.DataFrame(rows, columns=['ticker', 'date', *PANEL_FIELDS])
+        frame['date'] = pd.to_datetime(frame['date']).values.astype('datetime64[D]')
+        frame = frame.drop_duplicates(subset=['ticker', 'date'], keep='last')
+        new_tickers = sorted(set(frame['ticker']) - set(self.ticker_index))
+        new_dates = np.setdiff1d(frame['date'].to_numpy(dtype='datetime64[D]'), self.dates)
+        on_disk = len(self.dates) and len(self.tickers) and 'row_count' in self.meta
+        if on_disk and not new_tickers and (new_dates > self.dates[-1]).all():
+            return self._write_cells(frame, new_dates, overwrite, directory)
+        return self._rebuild_with(frame, new_tickers, new_dates, overwrite, directory)
+
+    def _write_cells(self, frame, new_dates, overwrite, directory):
+        """Nối các ngày mới vào cuối file và ghi tại chỗ các ô thuộc ngày đã có (memmap r+)."""
+        n_old, n_cols = len(self.dates), len(self.tickers)
+        dates = np.concatenate([self.dates, new_dates])
+        row_idx = np.searchsorted(dates, frame['date'].to_numpy(dtype='datetime64[D]'))
+        col_idx = frame['ticker'].map(self.ticker_index).to_numpy(dtype=np.int64)
+        new_close = frame['close'].to_numpy(dtype=np.float64)
+        in_new = row_idx >= n_old
+        old_rows, old_cols = row_idx[~in_new], col_idx[~in_new]
+
+        writable = np.zeros(len(old_rows), dtype=bool)
+        row_count = self.meta['row_count'] + int(np.count_nonzero(~np.isnan(new_close[in_new])))
+        if len(old_rows):
+            # Chỉ đọc các ô bị chạm tới để biết ô nào đang trống
+            was_empty = np.isnan(np.asarray(self.arrays['close'][old_rows, old_cols]))
+            writable = np.ones(len(old_rows), dtype=bool) if overwrite else was_empty
+            filled = ~np.isnan(new_close[~in_new])
+            row_count += int(np.count_nonzero(writable & was_empty & filled)
+                             - np.count_nonzero(writable & ~was_empty & ~filled))
+
+        for field in PANEL_FIELDS:
+            path = directory / f'{field}.bin'
+            values = frame[field].to_numpy(dtype=np.float64)
+            if writable.any():
+                existing = np.memmap(path, dtype=PANEL_DTYPES[field], mode='r+', shape=(n_old, n_cols))
+                existing[old_rows[writable], old_cols[writable]] = values[~in_new][writable]
+                existing.flush()
+                del existing
+            if len(new_dates):
+                block = np.full((len(new_dates), n_cols), np.nan, dtype=PANEL_DTYPES[field])
+                block[row_idx[in_new] - n_old, col_idx[in_new]] = values[in_new]
+                with open(path, 'r+b') as f:
+                    # Ghi ngay sau phần ứng với meta (bỏ phần thừa nếu lần ghi trước dừng giữa chừng)
+                    f.seek(n_old * n_cols * np.dtype(PANEL_DTYPES[field]).itemsize)
+                    block.tofile(f)
+                    f.truncate()
+
+        meta = dict(self.meta, dates=[str(d) for d in dates], row_count=row_count, last_date=str(dates[-1]),
+                    revision=self.meta.get('revision', 0) + 1)
+        tmp_meta = directory / f'{META_FILE}.tmp'
+        tmp_meta.write_text(json.dumps(meta))
+        os.replace(tmp_meta, directory / META_FILE)
+        return PricePanel.load(directory)
+
+    def _rebuild_with(self, frame, new_tickers, new_dates, overwrite, directory):
+        """Dựng lại toàn bộ mảng trong bộ nhớ (mã mới / ngày chen giữa / panel chưa có trên đĩa) rồi ghi lại file."""
+        tickers = sorted(self.tickers + new_tickers) if new_tickers else self.tickers
+        dates = np.union1d(self.dates, new_dates) if len(new_dates) else self.dates
+        old_rows = np.searchsorted(dates, self.dates)
+        old_cols = np.array([tickers.index(t) for t in self.tickers], dtype=np.int64)
+        arrays = {}
+        for field in PANEL_FIELDS:
+            array = np.full((len(dates), len(tickers)), np.nan, dtype=PANEL_DTYPES[field])
+            if len(old_rows) and len(old_cols):
+                array[np.ix_(old_rows, old_cols)] = self.arrays[field]
+            arrays[field] = array
+
+        panel = PricePanel(dates, tickers, arrays, self.meta)
+        row_idx = np.searchsorted(dates, frame['date'].to_numpy(dtype='datetime64[D]'))
+        col_idx = frame['ticker'].map(panel.ticker_index).to_numpy(dtype=np.int64)
+        writable = np.ones(len(frame), dtype=bool) if overwrite else np.isnan(arrays['close'][row_idx, col_idx])
+        for field in PANEL_FIELDS:
+            arrays[field][row_idx[writable], col_idx[writable]] = frame[field].to_numpy(dtype=np.float64)[writable]
+        panel._write_all(directory)
+        return panel
+
+    # ------------------------------------------------------------------ truy xuất cho các consumer
+
+    def frame(self, field):
+        """DataFrame rộng (index ngày, cột mã) của một trường — thay cho df.pivot(...)."""
+        return pd.DataFrame(np.asarray(self.arrays[field]), index=pd.DatetimeIndex(self.dates, name='date'),
+                            columns=pd.Index(self.tickers, name='stock_id'))
+
+    def to_long_frame(self, tickers=None, start_date=None):
+        """
+        DataFrame dạng dài (stock_id, date, open, high, low, close, volume) cho run_analysis_on_data.
+        Các cột số là float32 như khi đọc từ database với pd.to_numeric(downcast='float').
+        """
+        columns = np.arange(len(self.tickers)) if tickers is None else np.array(
+            [self.ticker_index[t] for t in tickers if t in self.ticker_index], dtype=np.int64)
+        first_row = 0 if start_date is None else int(np.searchsorted(self.dates, np.datetime64(start_date, 'D')))
+        close = np.asarray(self.arrays['close'][first_row:, columns])
+        # Duyệt theo từng mã (cột) để kết quả đã nhóm sẵn theo mã và sắp theo ngày
+        rows, cols = np.nonzero(~np.isnan(close.T))
+        data = {
+            'stock_id': np.array(self.tickers, dtype=object)[columns][rows],
+            'date': pd.to_datetime(self.dates[first_row:][cols]).astype('datetime64[ns]'),
+        }
+        for field in PANEL_FIELDS:
+            data[field] = np.asarray(self.arrays[field][first_row:, columns]).T[rows, cols].astype(np.float32)
+        return pd.DataFrame(data)
+
+    def ticker_frame(self, ticker):
+        """Lịch sử OHLCV của một mã (date, open, high, low, close, volume); None nếu mã không có trong panel."""
+        column = self.ticker_index.get(ticker)
+        if column is None:
+            return None
+        close = np.asarray(self.arrays['close'][:, column])
+        present = ~np.isnan(close)
+        data = {'date': self.dates[present]}
+        for field in PANEL_FIELDS:
+            data[field] = np.asarray(self.arrays[field][:, column], dtype=np.float64)[present]
+        return pd.DataFrame(data)
+
+
+def _database_fingerprint():
+    summary = StockData.objects.aggregate(row_count=Count('id'), last_date=Max('date'))
+    return summary['row_count'], str(summary['last_date']) if summary['last_date'] else None
+
+
+def get_price_panel(validate=True, rebuild=False, build=True):
+    """
+    Panel dùng chung, cache theo process và trên đĩa.
+    validate=True đối chiếu số dòng / ngày cuối với StockData và dựng lại nếu lệch
+    (ví dụ sau khi seed/import ghi thẳng vào database).
+    build=False: không dựng panel từ StockData (quét toàn bảng) mà trả về None nếu trên đĩa chưa có panel
+    hoặc panel đã lệch — dùng trong request HTTP.
+    """
+    global _loaded_panel
+    directory = _panel_dir()
+    meta_path = directory / META_FILE
+    panel = None
+    if not rebuild and meta_path.exists():
+        mtime = meta_path.stat().st_mtime
+        if _loaded_panel and _loaded_panel[0] == mtime:
+            panel = _loaded_panel[1]
+        else:
+            panel = PricePanel.load(directory)
+            _loaded_panel = (mtime, panel)
+
+    if panel is not None and validate:
+        if (panel.meta.get('row_count'), panel.meta.get('last_date')) != _database_fingerprint():
+            logger.info("Price panel lệch với StockData, đang dựng lại...")
+            panel = None
+
+    if panel is None:
+        if not build:
+            return None
+        panel = PricePanel.from_database()
+        panel.save(directory)
+        _loaded_panel = (meta_path.stat().st_mtime, panel)
+    return panel
+
+
+def panel_exists():
+    """Panel đã được dựng trên đĩa hay chưa."""
+    return (_panel_dir() / META_FILE).exists()
+
+
+def append_to_price_panel(stock_data_objects, overwrite=False):
+    """
+    Hook cho các luồng ingest: ghi các StockData vừa lưu vào panel trên đĩa (nếu panel đã được dựng).
+    Lỗi chỉ được ghi log, không làm hỏng luồng ingest.
+    """
+    if not (_panel_dir() / META_FILE).exists():
+        return
+    rows = [(obj.stock_id, obj.date, float(obj.open), float(obj.high), float(obj.low), float(obj.close),
+             float(obj.volume)) for obj in stock_data_objects]
+    _append_rows(rows, overwrite)
+
+
+def append_frame_to_price_panel(frame, overwrite=False):
+    """Như append_to_price_panel cho khung của api.bulk_loader (cột stock_id, date, OHLCV)."""
+    if frame is None or frame.empty or not (_panel_dir() / META_FILE).exists():
+        return
+    rows = zip(frame['stock_id'].tolist(), frame['date'].dt.date.tolist(),
+               *(frame[field].astype(float).tolist() for field in PANEL_FIELDS))
+    _append_rows(rows, overwrite)
+
+
+def _append_rows(rows, overwrite):
+    try:
+        PricePanel.load().append_rows(rows, overwrite=overwrite)
+    except Exception as e:
+        logger.warning(f"Không thể cập nhật price panel: {e}")
@@ -0,0 +1,200 @@
+# backend/api/provider_cache.py
+"""
+Cache phản hồi thô của nhà cung cấp dữ liệu (vnstock, SSI, Firecrawl) trên đĩa, cho phép chạy lại offline.
+
+Mỗi lời gọi được định danh bằng (nhà cung cấp, tham số yêu cầu). Phản hồi được pickle, nén zlib và lưu theo
+SHA-256 nội dung (objects/ab/abcd...z), nên các yêu cầu trả về cùng nội dung dùng chung một file; file chỉ mục
+entries/<khoá yêu cầu>.json trỏ tới hash nội dung kèm thời điểm lưu để áp TTL.
+
+Chế độ (settings.PROVIDER_CACHE['MODE']):
+- 'off': gọi thẳng nhà cung cấp (mặc định).
+- 'read-write': trả phản hồi đã lưu còn hạn, không thì gọi và lưu lại.
+- 'replay': chỉ đọc từ cache, không gọi mạng; thiếu bản ghi thì ném ProviderCacheMiss.
+Khi tổng dung lượng vượt MAX_BYTES, các object ít được dùng gần đây nhất bị xoá trước.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+import zlib
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+MODES = ('off', 'read-write', 'replay')
+DEFAULT_TTL = 7 * 24 * 3600
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+EVICT_TARGET = 0.9  # xoá tới khi còn 90% MAX_BYTES
+
+
+class ProviderCacheMiss(Exception):
+    """Chế độ replay nhưng chưa có phản hồi nào được lưu cho yêu cầu này."""
+
+
+def has_data(value):
+    """cacheable mặc định cho DataFrame / list: chỉ lưu phản hồi có dữ liệu."""
+    if value is None:
+        return False
+    if hasattr(value, 'empty'):
+        return not value.empty
+    return bool(value) if isinstance(value, (list, dict)) else True
+
+
+def _canonical(params):
+    return json.dumps(params, sort_keys=True, separators=(',', ':'), default=str)
+
+
+def request_key(provider, params):
+    """SHA-256 của nhà cung cấp + tham số yêu cầu đã chuẩn hoá."""
+    return hashlib.sha256(f"{provider}:{_canonical(params)}".encode()).hexdigest()
+
+
+def _write_atomic(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as f:
+        f.write(data)
+    os.replace(f.name, path)
+
+
+class ProviderCache:
+    def __init__(self, directory, mode='off', ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES):
+        if mode not in MODES:
+            raise ValueError(f"PROVIDER_CACHE MODE không hợp lệ: {mode!r} (chọn một trong {', '.join(MODES)})")
+        self.directory = Path(directory)
+        self.mode = mode
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None  # tổng dung lượng object, tính lười lần đầu ghi
+
+    @property
+    def offline(self):
+        return self.mode == 'replay'
+
+    def _entry_path(self, key):
+        return self.directory / 'entries' / f'{key}.json'
+
+    def _object_path(self, digest):
+        return self.directory / 'objects' / digest[:2] / f'{digest}.z'
+
+    def get(self, provider, params, ttl=None):
+        """(True, phản hồi) nếu có bản lưu dùng được (replay bỏ qua TTL), ngược lại (False, None)."""
+        try:
+            entry = json.loads(self._entry_path(request_key(provider, params)).read_text())
+            ttl = self.ttl if ttl is None else ttl
+            if not self.offline and time.time() - entry['stored_at'] >= ttl:
+                return False, None
+            path = self._object_path(entry['sha256'])
+            value = pickle.loads(zlib.decompress(path.read_bytes()))
+        except (OSError, ValueError, KeyError, zlib.error, pickle.UnpicklingError):
+            return False, None
+        os.utime(path)  # đánh dấu vừa dùng cho việc dọn theo LRU
+        return True, value
+
+    def put(self, provider, params, value):
+        blob = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        digest = hashlib.sha256(blob).hexdigest()
+        path = self._object_path(digest)
+        added = 0
+        if not path.exists():
+            _write_atomic(path, blob)
+            added = len(blob)
+        entry = {'provider': provider, 'params': json.loads(_canonical(params)), 'sha256': digest,
+                 'stored_at': time.time()}
+        _write_atomic(self._entry_path(request_key(provider, params)), json.dumps(entry).encode())
+        if added:
+            self._account(added)
+
+    def fetch(self, provider, params, func, *args, limiter=None, ttl=None, cacheable=None, **kwargs):
+        """
+        func(*args, **kwargs) qua cache. limiter (nếu có) chỉ được lấy token khi thực sự gọi nhà cung cấp.
+        cacheable(phản hồi) -> bool quyết định có lưu hay không (mặc định: khác None).
+        """
+        if self.mode != 'off':
+            hit, value = self.get(provider, params, ttl)
+            if hit:
+                return value
+            if self.offline:
+                raise ProviderCacheMiss(f"Không có phản hồi {provider} đã lưu cho {_canonical(params)}")
+        if limiter is not None:
+            limiter.acquire()
+        value = func(*args, **kwargs)
+        if self.mode == 'read-write' and (value is not None if cacheable is None else cacheable(value)):
+            try:
+                self.put(provider, params, value)
+            except (OSError, pickle.PicklingError, TypeError, AttributeError) as e:
+                logger.warning(f"Không thể lưu phản hồi {provider} vào cache: {e}")
+        return value
+
+    # --- Dọn dẹp theo dung lượng ---
+
+    def _objects(self):
+        return list((self.directory / 'objects').glob('*/*.z'))
+
+    def _account(self, added):
+        with self._lock:
+            if self._size is None:
+                self._size = sum(path.stat().st_size for path in self._objects())
+            else:
+                self._size += added
+            if self._size > self.max_bytes:
+                self._size = self._evict()
+
+    def _evict(self):
+        """Xoá object dùng lâu nhất cho tới khi tổng dung lượng <= EVICT_TARGET * MAX_BYTES; trả về dung lượng còn lại."""
+        objects = []
+        for path in self._objects():
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            objects.append((stat.st_mtime, stat.st_size, path))
+        objects.sort()
+        total = sum(size for _, size, _ in objects)
+        target = self.max_bytes * EVICT_TARGET
+        removed = 0
+        for _, size, path in objects:
+            if total <= target:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+        # Entry trỏ tới object đã xoá được coi là chưa có khi đọc (get)
+        logger.info(f"Provider cache: đã xoá {removed} object, còn {total / 1024 ** 2:.1f} MB.")
+        return total
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_provider_cache():
+    """ProviderCache theo settings.PROVIDER_CACHE (dùng chung trong process)."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            options = getattr(settings, 'PROVIDER_CACHE', {})
+            directory = options.get('DIR') or Path(settings.BASE_DIR) / 'var' / 'provider_cache'
+            _cache = ProviderCache(directory, mode=options.get('MODE', 'off'),
+                                   ttl=options.get('TTL', DEFAULT_TTL),
+                                   max_bytes=options.get('MAX_BYTES', DEFAULT_MAX_BYTES))
+        return _cache
+
+
+def reset_provider_cache():
+    """Bỏ ProviderCache đã tạo (dùng trong test khi đổi settings)."""
+    global _cache
+    with _cache_lock:
+        _cache = None
+
+
+def cached_call(provider, params, func, *args, **kwargs):
+    """get_provider_cache().fetch(...): gọi nhà cung cấp qua cache dùng chung."""
+    return get_provider_cache().fetch(provider, params, func, *args, **kwargs)
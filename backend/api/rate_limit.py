@@ -0,0 +1,284 @@
+# backend/api/rate_limit.py
+"""
+Giới hạn tốc độ gọi API nhà cung cấp dữ liệu (vnstock, SSI).
+
+TokenBucket cho phép gọi dồn (burst) tới `capacity` yêu cầu rồi giữ tốc độ trung bình `rate` yêu cầu/giây.
+Tốc độ tự điều chỉnh theo phản hồi (AIMD): mỗi lần gọi thành công tăng nhẹ, mỗi lần bị 429 giảm một nửa
+và tạm dừng toàn bộ bucket trong thời gian chờ — thay cho các lệnh time.sleep cố định giữa từng mã.
+
+RedisRateLimiter áp dụng cùng giới hạn cho mọi process / worker (GCRA trong Redis), để tổng tốc độ gọi của
+task Celery, lệnh seed/import và SSI gap-fill cùng nằm ngay dưới giới hạn của nhà cung cấp.
+get_limiter(tên) trả về bộ giới hạn dùng chung theo PROVIDER_RATE_LIMITS trong settings; khi không có Redis
+thì dùng TokenBucket trong bộ nhớ.
+"""
+
+import logging
+import threading
+import time
+
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_PHRASES = ("rate limit", "quá nhiều", "429", "throttled", "too many requests")
+
+
+def is_rate_limit_error(exc):
+    """Lỗi có phải do nhà cung cấp giới hạn tốc độ (HTTP 429 / thông báo tương đương) hay không."""
+    response = getattr(exc, 'response', None)
+    if getattr(response, 'status_code', None) == 429:
+        return True
+    error_msg = str(exc).lower()
+    return any(phrase in error_msg for phrase in RATE_LIMIT_PHRASES)
+
+
+def retry_after_seconds(exc):
+    """Giá trị header Retry-After (giây) nếu lỗi có kèm response, ngược lại None."""
+    response = getattr(exc, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    try:
+        value = headers.get('Retry-After')
+        return float(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Token bucket an toàn đa luồng với tốc độ thích ứng.
+    - rate: số yêu cầu/giây ban đầu; min_rate / max_rate: biên điều chỉnh.
+    - capacity: số yêu cầu được gọi dồn tối đa.
+    - increase: lượng tăng tốc độ sau mỗi lần gọi thành công; decrease: hệ số nhân khi bị 429.
+    """
+
+    def __init__(self, rate, capacity=1, min_rate=None, max_rate=None, increase=0.05, decrease=0.5,
+                 base_cooldown=30, max_cooldown=600, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.min_rate = float(min_rate) if min_rate is not None else self.rate / 8
+        self.max_rate = float(max_rate) if max_rate is not None else self.rate
+        self.increase = increase
+        self.decrease = decrease
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._consecutive_limits = 0
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self):
+        """Lấy một token nếu có ngay; trả về 0 khi thành công, ngược lại số giây cần chờ."""
+        with self._lock:
+            now = self._clock()
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """Chờ tới khi lấy được một token."""
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return
+            self._sleep(wait)
+
+    def cooldown_remaining(self):
+        """Số giây tạm dừng còn lại (0 nếu không tạm dừng)."""
+        with self._lock:
+            return max(0.0, self._paused_until - self._clock())
+
+    def pause(self, seconds):
+        """Tạm dừng mọi yêu cầu trong `seconds` giây (ví dụ cooldown do worker khác đặt)."""
+        with self._lock:
+            now = self._clock()
+            self._paused_until = max(self._paused_until, now + seconds)
+            self._tokens = 0.0
+            self._updated = max(self._updated, self._paused_until)
+
+    def on_success(self):
+        with self._lock:
+            self._consecutive_limits = 0
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def on_rate_limited(self, retry_after=None):
+        """Giảm tốc độ và tạm dừng bucket; trả về số giây tạm dừng (Retry-After nếu có, không thì backoff mũ)."""
+        with self._lock:
+            now = self._clock()
+            if now < self._paused_until:
+                # Các luồng khác cùng bị 429 trong đợt gọi dồn trước khi bucket dừng: không giảm tốc độ lần nữa
+                return self._paused_until - now
+            self._consecutive_limits += 1
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            wait = retry_after
+            if wait is None:
+                wait = min(self.base_cooldown * (2 ** (self._consecutive_limits - 1)), self.max_cooldown)
+        self.pause(wait)
+        return wait
+
+
+# GCRA: KEYS[1] lưu "thời điểm đến lý thuyết" (TAT, ms), KEYS[2] là khoá cooldown dùng chung.
+# Trả về số ms cần chờ (0 = được phép gọi và đã ghi nhận yêu cầu). Dùng đồng hồ của Redis cho mọi máy.
+GCRA_SCRIPT = """
+local cooldown = redis.call('PTTL', KEYS[2])
+if cooldown > 0 then
+    return cooldown
+end
+local emission = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+if tat < now then
+    tat = now
+end
+local allow_at = tat - tolerance
+if now < allow_at then
+    -- Redis cắt phần thập phân khi trả số từ Lua: làm tròn lên để 0 luôn có nghĩa là "được phép"
+    return math.max(1, math.ceil(allow_at - now))
+end
+local new_tat = tat + emission
+redis.call('SET', KEYS[1], new_tat, 'PX', math.ceil(new_tat - now) + 1000)
+return 0
+"""
+
+
+class RedisRateLimiter:
+    """
+    Giới hạn tốc độ phân tán bằng GCRA trong Redis: `rate` yêu cầu/giây, cho phép dồn tới `burst` yêu cầu,
+    tính chung cho mọi process dùng cùng `name`. Khi bị 429, khoá f'{name}:rate_limit_cooldown' tạm dừng
+    tất cả. Mất kết nối Redis thì chuyển sang TokenBucket trong bộ nhớ thay vì làm hỏng việc nạp dữ liệu.
+    """
+
+    def __init__(self, name, rate, burst=1, client=None, base_cooldown=30, max_cooldown=600, sleep=time.sleep):
+        self.name = name
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self.client = client
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self.tat_key = f'{name}:rate_limit_tat'
+        self.cooldown_key = f'{name}:rate_limit_cooldown'
+        self.fallback = TokenBucket(rate, capacity=self.burst, max_rate=rate,
+                                    base_cooldown=base_cooldown, max_cooldown=max_cooldown, sleep=sleep)
+        self._sleep = sleep
+        self._script = client.register_script(GCRA_SCRIPT)
+        self._lock = threading.Lock()
+        self._consecutive_limits = 0
+
+    def try_acquire(self):
+        emission_ms = 1000.0 / self.rate
+        try:
+            wait_ms = self._script(keys=[self.tat_key, self.cooldown_key],
+                                   args=[emission_ms, emission_ms * (self.burst - 1)])
+        except redis.RedisError as e:
+            logger.warning(f"Rate limiter '{self.name}': Redis lỗi ({e}), dùng giới hạn trong bộ nhớ.")
+            return self.fallback.try_acquire()
+        return float(wait_ms) / 1000
+
+    def acquire(self):
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return
+            self._sleep(wait)
+
+    def cooldown_remaining(self):
+        try:
+            ttl_ms = self.client.pttl(self.cooldown_key)
+        except redis.RedisError:
+            return self.fallback.cooldown_remaining()
+        return ttl_ms / 1000 if ttl_ms and ttl_ms > 0 else 0.0
+
+    def pause(self, seconds):
+        try:
+            self.client.set(self.cooldown_key, '1', px=max(1, int(seconds * 1000)))
+        except redis.RedisError:
+            self.fallback.pause(seconds)
+
+    def on_success(self):
+        with self._lock:
+            self._consecutive_limits = 0
+
+    def on_rate_limited(self, retry_after=None):
+        """Đặt cooldown dùng chung (nếu chưa có process nào đặt); trả về số giây phải chờ."""
+        remaining = self.cooldown_remaining()
+        if remaining > 0:
+            return remaining
+        with self._lock:
+            self._consecutive_limits += 1
+            wait = retry_after
+            if wait is None:
+                wait = min(self.base_cooldown * (2 ** (self._consecutive_limits - 1)), self.max_cooldown)
+        try:
+            # NX: nhiều process cùng gặp 429 thì chỉ process đầu tiên đặt thời gian chờ
+            if not self.client.set(self.cooldown_key, '1', px=max(1, int(wait * 1000)), nx=True):
+                return self.cooldown_remaining() or wait
+        except redis.RedisError:
+            return self.fallback.on_rate_limited(retry_after)
+        return wait
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def _redis_client():
+    url = getattr(settings, 'RATE_LIMIT_REDIS_URL', None)
+    if not url or getattr(settings, 'RATE_LIMIT_BACKEND', 'redis') != 'redis':
+        return None
+    try:
+        client = redis.from_url(url)
+        client.ping()
+        return client
+    except redis.RedisError as e:
+        logger.warning(f"Không kết nối được Redis cho rate limiter ({e}), dùng giới hạn trong bộ nhớ.")
+        return None
+
+
+def get_limiter(name):
+    """Bộ giới hạn dùng chung (theo process) cho nhà cung cấp `name` ('vnstock', 'ssi'...)."""
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limits = getattr(settings, 'PROVIDER_RATE_LIMITS', {}).get(name, {})
+            rate, burst = limits.get('rate', 1.0), limits.get('burst', 1)
+            client = _redis_client()
+            if client is not None:
+                limiter = RedisRateLimiter(name, rate, burst, client=client)
+            else:
+                limiter = TokenBucket(rate, capacity=burst, max_rate=rate)
+            _limiters[name] = limiter
+        return limiter
+
+
+def reset_limiters():
+    """Xoá các bộ giới hạn đã tạo (dùng trong test khi đổi settings)."""
+    with _limiters_lock:
+        _limiters.clear()
+
+
+def call_limited(limiter, func, *args, **kwargs):
+    """Gọi func qua bộ giới hạn: chờ token trước khi gọi, báo 429 cho bộ giới hạn rồi ném lại lỗi."""
+    limiter.acquire()
+    try:
+        result = func(*args, **kwargs)
+    except Exception as e:
+        if is_rate_limit_error(e):
+            limiter.on_rate_limited(retry_after_seconds(e))
+        raise
+    limiter.on_success()
+    return result
@@ -0,0 +1,125 @@
+# backend/api/rule_engine.py
+"""
+Bộ máy luật ADMRS: biên dịch analysis_config.SIGNAL_RULES thành các phép tính trên mảng NumPy.
+
+Mỗi luật cho ra một mảng boolean trên toàn bộ các phiên (ma trận luật × phiên). Điểm của từng nhóm là tích
+ma trận trọng số × ma trận luật, nên nhiều bộ trọng số (SIGNAL_SCORES / MASTER_WEIGHTS) có thể được chấm
+trong cùng một lượt trên cùng một bộ indicators.
+"""
+
+import operator
+from functools import lru_cache
+
+import numpy as np
+
+from .analysis_config import SIGNAL_RULES, SIGNAL_SCORES, MASTER_WEIGHTS, MAX_SCORES, max_scores_for
+
+GROUPS = ('TREND', 'MOMENTUM', 'VOLUME', 'RISK')
+WEIGHTED_GROUPS = ('TREND', 'MOMENTUM', 'VOLUME')
+
+_COMPARISONS = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le}
+
+
+def _recent_any(mask, window):
+    """mask[i - window + 1 .. i] có phần tử True nào không, cho mọi i."""
+    out = mask.copy()
+    for k in range(1, window):
+        out[k:] |= mask[:-k]
+    return out
+
+
+def _compile_condition(when):
+    """Biến một bộ (trái, toán tử, phải[, tham số]) thành hàm columns -> mảng boolean."""
+    left, op, right, *param = when
+
+    def operand(columns):
+        return columns[right] if isinstance(right, str) else right
+
+    if op in _COMPARISONS:
+        compare = _COMPARISONS[op]
+        if param:
+            scale = param[0]
+            return lambda columns: compare(columns[left], operand(columns) * scale)
+        return lambda columns: compare(columns[left], operand(columns))
+    if op == 'crossed_within':
+        window = param[0]
+        return lambda columns: (_recent_any(columns[left] > operand(columns), window)
+                                & _recent_any(columns[left] <= operand(columns), window))
+    if op == 'is':
+        return lambda columns: np.asarray(columns[left], dtype=bool) == bool(right)
+    raise ValueError(f"Toán tử luật không hợp lệ: {op!r}")
+
+
+class CompiledRules:
+    """Danh sách luật đã biên dịch cùng ma trận nhóm dùng để cộng điểm."""
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.keys = [rule['key'] for rule in self.rules]
+        self.reasons = [rule['reason'] for rule in self.rules]
+        self.conditions = [_compile_condition(rule['when']) for rule in self.rules]
+        # group_matrix[g, r] = 1 nếu luật r cộng điểm vào nhóm g
+        self.group_matrix = np.array([[rule['group'] == group for rule in self.rules] for group in GROUPS],
+                                     dtype=np.int64)
+
+    @property
+    def columns(self):
+        """Các cột indicator mà bộ luật cần."""
+        names = []
+        for rule in self.rules:
+            left, _, right, *_ = rule['when']
+            names += [left] + ([right] if isinstance(right, str) else [])
+        return list(dict.fromkeys(names))
+
+    def evaluate(self, columns):
+        """Ma trận boolean (số luật × số phiên) từ dict tên cột -> mảng float64."""
+        return np.vstack([condition(columns) for condition in self.conditions])
+
+    def points(self, signal_scores=None):
+        """Vector điểm theo thứ tự luật cho một bảng SIGNAL_SCORES."""
+        signal_scores = SIGNAL_SCORES if signal_scores is None else signal_scores
+        return np.array([signal_scores[key] for key in self.keys])
+
+    def group_scores(self, masks, signal_scores=None):
+        """Điểm thô của từng nhóm (dict nhóm -> mảng theo phiên) cho một bảng điểm."""
+        scores = self.group_matrix * self.points(signal_scores)
+        totals = scores @ masks.astype(scores.dtype)
+        return dict(zip(GROUPS, totals))
+
+    def final_scores(self, group_scores, master_weights=None, max_scores=None):
+        """Điểm tổng hợp (0..100 + điểm rủi ro, chặn dưới 0) từ điểm thô các nhóm."""
+        master_weights = MASTER_WEIGHTS if master_weights is None else master_weights
+        max_scores = MAX_SCORES if max_scores is None else max_scores
+        n = len(group_scores['RISK'])
+        norm = {g: (group_scores[g] / max_scores[g]) if max_scores[g] > 0 else np.zeros(n) for g in WEIGHTED_GROUPS}
+        base_score = (norm['TREND'] * master_weights['TREND']) + (norm['MOMENTUM'] * master_weights['MOMENTUM']) + (
+                norm['VOLUME'] * master_weights['VOLUME'])
+        return np.maximum(0, base_score + group_scores['RISK'])
+
+    def score_weight_sets(self, masks, weight_sets):
+        """
+        Chấm nhiều bộ trọng số trên cùng ma trận luật; trả về mảng (số bộ trọng số × số phiên).
+        Mỗi bộ là dict có thể chứa 'SIGNAL_SCORES', 'MASTER_WEIGHTS', 'MAX_SCORES'; khoá thiếu lấy từ cấu hình.
+        Nếu đổi SIGNAL_SCORES mà không truyền MAX_SCORES, điểm tối đa được suy ra lại từ bảng điểm mới.
+        """
+        weight_sets = list(weight_sets)
+        tables = [ws.get('SIGNAL_SCORES', SIGNAL_SCORES) for ws in weight_sets]
+        points = np.array([self.points(table) for table in tables])  # (bộ × luật)
+        # (bộ × nhóm × luật) @ (luật × phiên) -> (bộ × nhóm × phiên)
+        totals = (points[:, None, :] * self.group_matrix[None, :, :]) @ masks.astype(points.dtype)
+
+        finals = np.empty((len(weight_sets), masks.shape[1]))
+        for k, (ws, table) in enumerate(zip(weight_sets, tables)):
+            finals[k] = self.final_scores(dict(zip(GROUPS, totals[k])), ws.get('MASTER_WEIGHTS'),
+                                          ws.get('MAX_SCORES', max_scores_for(table)))
+        return finals
+
+
+@lru_cache(maxsize=None)
+def _compiled_default():
+    return CompiledRules(SIGNAL_RULES)
+
+
+def compile_rules(rules=None):
+    """Biên dịch bộ luật; mặc định dùng SIGNAL_RULES (được cache cho cả process)."""
+    return _compiled_default() if rules is None else CompiledRules(rules)
@@ -1,6 +1,6 @@
 from django.contrib.auth.models import User
 from rest_framework import serializers, validators
-from .models import Stock, Watchlist, StockData, Alert, PotentialStock, Article
+from .models import Stock, Watchlist, StockData, Alert, PotentialStock, Article, BacktestRun
 
 class RegisterSerializer(serializers.ModelSerializer):
     class Meta:
@@ -108,4 +108,14 @@ class PotentialStockSerializer(serializers.ModelSerializer):
 class StockDataSerializer(serializers.ModelSerializer):
     class Meta:
         model = StockData
-        fields = ['date', 'open', 'high', 'low', 'close', 'volume']
\ No newline at end of file
+        fields = ['date', 'open', 'high', 'low', 'close', 'volume']
+
+
+class BacktestRunSerializer(serializers.ModelSerializer):
+    """
+    Thông tin tóm tắt của một lần backtest (không kèm đường vốn / sổ lệnh).
+    """
+    class Meta:
+        model = BacktestRun
+        fields = ['key', 'status', 'config', 'data_version', 'metrics', 'trade_count', 'error',
+                  'created_at', 'completed_at']
@@ -0,0 +1,58 @@
+# backend/api/signals.py
+"""
+Tín hiệu khi lịch sử giá đã lưu bị sửa.
+
+price_history_changed được api.bulk_loader gửi (sau khi transaction commit) mỗi khi load_price_frame ghi dữ liệu, kèm
+- written = {mã: (ngày đầu, ngày cuối)} của mọi dòng đã ghi (dòng mới lẫn dòng bị sửa; khi nạp không upsert là
+  cả khung, kể cả dòng đã có bị bỏ qua),
+- changes = {mã: (ngày đầu, ngày cuối)} chỉ của các dòng đã có bị sửa giá trị (rỗng nếu chỉ nối thêm).
+Các kết quả đóng khoá theo phiên bản dữ liệu (backtest, danh sách mã thanh khoản) hết hiệu lực qua
+TickerCoverage.revised_at (api.coverage.price_revision).
+"""
+
+import logging
+
+import pandas as pd
+from django.db.models import Q
+from django.dispatch import Signal, receiver
+
+from .models import IndicatorState, StockData
+from .price_panel import PANEL_FIELDS, append_frame_to_price_panel, panel_exists
+
+logger = logging.getLogger(__name__)
+
+price_history_changed = Signal()
+
+
+def _condition(changes, date_lookup):
+    condition = Q()
+    for ticker, date_range in changes.items():
+        condition |= Q(stock_id=ticker, **date_lookup(date_range))
+    return condition
+
+
+@receiver(price_history_changed)
+def invalidate_indicator_states(sender, written, **kwargs):
+    """
+    Xoá trạng thái indicators đã đi qua phiên vừa được ghi (giá bị sửa hoặc lịch sử bổ sung phía trước);
+    advance_indicator_states sẽ dựng lại riêng các mã đó. Phiên mới nối sau last_date không xoá gì.
+    """
+    if not written:
+        return
+    deleted, _ = IndicatorState.objects.filter(
+        _condition(written, lambda date_range: {'last_date__gte': date_range[0]})).delete()
+    if deleted:
+        logger.info(f"Đã xoá trạng thái indicators của {deleted} mã có lịch sử bị sửa.")
+
+
+@receiver(price_history_changed)
+def refresh_price_panel(sender, written, **kwargs):
+    """Ghi các dòng vừa ghi (kể cả giá đã sửa) vào price panel, đọc lại từ StockData theo khoảng ngày của mỗi mã."""
+    if not written or not panel_exists():
+        return
+    columns = ['stock_id', 'date', *PANEL_FIELDS]
+    rows = StockData.objects.filter(
+        _condition(written, lambda date_range: {'date__range': date_range})).values_list(*columns)
+    frame = pd.DataFrame(list(rows), columns=columns)
+    frame['date'] = pd.to_datetime(frame['date'])
+    append_frame_to_price_panel(frame, overwrite=True)
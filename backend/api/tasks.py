@@ -7,18 +7,24 @@ from dotenv import load_dotenv
 from datetime import datetime
 from urllib.parse import urljoin
 
-from celery import shared_task
+from celery import chord, group, shared_task
 from firecrawl import FirecrawlApp
 from bs4 import BeautifulSoup
+from django.core.management import call_command
 from django.utils import timezone
 from django.db import IntegrityError
 
-from vnstock import Listing, Quote
+from vnstock import Quote
+from .bulk_loader import load_price_frame, prepare_price_frame
 from .models import Article, NewsSource, Stock, StockData
+from .provider_cache import cached_call, get_provider_cache, has_data
+from .rate_limit import get_limiter, is_rate_limit_error
+from .trading_calendar import is_trading_day, market_today
+from .vnstock_fetcher import fetch_many, listing
 import requests
 from decouple import config
 import pandas as pd
-from datetime import datetime, timedelta
+from datetime import datetime
 
 # NEW imports
 import redis
@@ -54,10 +60,12 @@ MAX_GENERAL_RETRIES = 2
 MAX_RATE_LIMIT_RETRIES = 30
 RETRY_DELAY = 2
 RATE_LIMIT_BASE_WAIT = 30  # Giảm để nhanh
-INITIAL_DELAY = 2  # Giảm để nhanh
+# Số yêu cầu vnstock chờ phản hồi cùng lúc (tốc độ gọi do token bucket trong api.vnstock_fetcher quyết định)
+FETCH_WORKERS = 4
 
-# New: chunk size for DB writes and processed bookkeeping
-CHUNK_SIZE = 200
+# Số mã mỗi subtask EOD (mỗi chunk ghi DB và đánh dấu processed khi xong)
+CHUNK_SIZE = 100
+MAX_CHUNK_RETRIES = 5
 
 # Redis connection (used for cooldown locking and processed set)
 REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
@@ -261,7 +269,9 @@ def crawl_news_task():
     try:
         # Scrape main page (HTML format)
         logger.info(f"Scraping main page: {BASE_URL}")
-        main_page_data = app.scrape(url=BASE_URL, **get_main_scrape_options())
+        # ttl=0: trang chủ luôn lấy mới (vẫn được lưu để chạy lại offline)
+        main_page_data = cached_call('firecrawl', {'url': BASE_URL, **get_main_scrape_options()}, app.scrape,
+                                     url=BASE_URL, ttl=0, **get_main_scrape_options())
 
         if not hasattr(main_page_data, 'html') or not main_page_data.html:
             logger.error("Failed: Could not fetch main page HTML")
@@ -300,7 +310,8 @@ def crawl_news_task():
 
             try:
                 # Scrape article detail (default markdown)
-                detail_data = app.scrape(url=article_info['url'], **get_detail_scrape_options())
+                detail_data = cached_call('firecrawl', {'url': article_info['url'], **get_detail_scrape_options()},
+                                          app.scrape, url=article_info['url'], **get_detail_scrape_options())
 
                 if not hasattr(detail_data, 'markdown') or not detail_data.markdown:
                     logger.warning(f"    -> No content available for: {article_info['url']}")
@@ -325,8 +336,8 @@ def crawl_news_task():
                 logger.error(f"    -> Error processing {article_info['url']}: {e}")
                 continue
 
-            # Delay to avoid rate limiting (skip for last article)
-            if index < len(articles_to_process):
+            # Delay to avoid rate limiting (skip for last article and offline replay)
+            if index < len(articles_to_process) and not get_provider_cache().offline:
                 delay = calculate_delay(index, len(articles_to_process))
                 logger.info(f"    -> Waiting {delay:.1f}s to avoid rate limiting...")
                 time.sleep(delay)
@@ -343,258 +354,225 @@ def crawl_news_task():
 
 # ==================== Stock Data TASK (PATCHED) ====================
 
+def _daily_frame(ticker, df_history, today):
+    """Khung giá (api.bulk_loader) của phiên `today` từ kết quả Quote.history; (None, lý do) nếu không dùng được."""
+    if df_history is None or df_history.empty:
+        return None, f"Không có dữ liệu cho {ticker} ngày {today}."
+    try:
+        frame = prepare_price_frame(df_history, ticker)
+    except ValueError as e:
+        return None, f"Dữ liệu {ticker} không hợp lệ: {e}."
+
+    frame = frame[frame['date'].dt.date == today]
+    if frame.empty:
+        return None, f"Dữ liệu {ticker} không phải {today}."
+    if frame['volume'].iloc[-1] == 0:
+        return None, f"Volume=0 cho {ticker} ngày {today}."
+    return frame, None
+
+
+def _mark_processed(processed_set, tickers):
+    # Mark as processed in Redis so resume skips it
+    if redis_client and tickers:
+        try:
+            redis_client.sadd(processed_set, *tickers)
+        except Exception:
+            pass
+
+
+def _eod_universe(processed_set):
+    """Danh sách mã cần lấy EOD: mã hợp lệ trong Listing, có trong DB và chưa nằm trong processed set."""
+    logger.info("Đang lấy danh sách ticker từ Listing...")
+    df_all_symbols = listing('all_symbols')
+
+    all_tickers = df_all_symbols['symbol'].tolist()
+    original_count = len(all_tickers)
+    all_tickers = [
+        ticker for ticker in all_tickers
+        if 3 <= len(ticker) <= 5 and ticker.isalpha() and not any(c.isdigit() for c in ticker)
+    ]
+    skipped_count = original_count - len(all_tickers)
+    logger.info(f"Lọc thành công: {len(all_tickers)} ticker hợp lệ (bỏ qua {skipped_count}).")
+
+    # Only keep tickers that exist in DB
+    tickers_in_db = set(Stock.objects.values_list('ticker', flat=True))
+    all_tickers = [t for t in all_tickers if t in tickers_in_db]
+    logger.info(f"Sau khi khớp DB: {len(all_tickers)} ticker cần xử lý.")
+
+    # If Redis processed set exists, filter out already processed tickers
+    if redis_client:
+        try:
+            processed_members = redis_client.smembers(processed_set) or set()
+            if processed_members:
+                before = len(all_tickers)
+                all_tickers = [t for t in all_tickers if t not in processed_members]
+                logger.info(f"Đã lọc {before - len(all_tickers)} tickers đã xử lý trước đó.")
+        except Exception as e:
+            logger.warning(f"Không thể đọc processed_set từ Redis: {e}")
+    return all_tickers
+
+
 @shared_task(bind=True)
-def fetch_daily_data_vnstock_task(self):
+def fetch_daily_data_vnstock_task(self, day_str=None):
     """
-    Task gộp: Lấy EOD cho 9/9/2025 (hoặc daily) dùng loop tuyến tính, tối ưu retry/delay.
-
-    Tối ưu chính:
-    - Dùng Redis để ghi 'processed' set (đánh dấu ticker đã xong) để task có thể resume
-    - Khi phát hiện rate-limit: đặt cooldown key vào Redis và **re-queue task** với countdown
-      để worker hiện tại **không bị block** (giúp hiệu năng cao hơn)
-    - Ghi DB theo chunk để tránh mất dữ liệu nếu task bị re-queued/kill
+    Điều phối lấy EOD cho hôm nay theo giờ Việt Nam (hoặc ngày day_str): chia các mã cần lấy thành từng chunk
+    CHUNK_SIZE mã, mỗi chunk là một subtask fetch_eod_chunk_task trên queue 'ingestion'
+    (chạy song song trên mọi worker của queue), gom lại bằng chord với finalize_eod_ingestion_task.
+
+    - Mỗi chunk tự ghi DB và đánh dấu 'processed' set trong Redis ngay khi xong, nên worker bị
+      restart chỉ mất chunk đang chạy (acks_late: chunk đó được giao lại)
+    - Callback kiểm tra độ phủ rồi chạy run_stock_analysis_task (thay cho lịch cố định lúc 18:00)
+    - Tốc độ gọi do bộ giới hạn dùng chung (api.rate_limit.get_limiter) điều khiển; nếu lúc bắt đầu
+      đang có cooldown thì **re-queue task** với countdown để worker không bị block
+    - Ngày không có phiên (nghỉ lễ, cuối tuần; xem api.trading_calendar) thì bỏ qua, không gọi vnstock
     """
     logger.info("=" * 60)
-    logger.info("BẮT ĐẦU TASK LẤY DỮ LIỆU HÀNG NGÀY TỪ VNSTOCK 3.2.6 (LOOP TỐI ƯU)")
+    logger.info("BẮT ĐẦU TASK LẤY DỮ LIỆU HÀNG NGÀY TỪ VNSTOCK 3.2.6 (CHORD THEO CHUNK)")
 
-    today_str = '2025-09-09'
-    today = datetime.strptime(today_str, '%Y-%m-%d').date()
-
-    cooldown_key = f"vnstock:rate_limit_cooldown"
+    today_str = day_str or market_today().isoformat()
+    if not is_trading_day(today_str):
+        logger.info(f"{today_str} không phải phiên giao dịch, bỏ qua.")
+        return f"{today_str} không phải phiên giao dịch."
     processed_set = f"vnstock:processed:{today_str}"
 
     try:
-        # BƯỚC 1: LẤY DANH SÁCH TICKER
-        logger.info("Đang lấy danh sách ticker từ Listing...")
-        listing_client = Listing()
-        df_all_symbols = listing_client.all_symbols()
-
-        all_tickers = df_all_symbols['symbol'].tolist()
-        original_count = len(all_tickers)
-        all_tickers = [
-            ticker for ticker in all_tickers
-            if 3 <= len(ticker) <= 5 and ticker.isalpha() and not any(c.isdigit() for c in ticker)
-        ]
-        skipped_count = original_count - len(all_tickers)
-        logger.info(f"Lọc thành công: {len(all_tickers)} ticker hợp lệ (bỏ qua {skipped_count}).")
-
-        all_stocks_map = {stock.ticker: stock for stock in Stock.objects.all()}
-        # Only keep tickers that exist in DB
-        all_tickers = [t for t in all_tickers if t in all_stocks_map]
-        logger.info(f"Sau khi khớp DB: {len(all_tickers)} ticker cần xử lý.")
-
-        # If Redis processed set exists, filter out already processed tickers
-        if redis_client:
-            try:
-                processed_members = redis_client.smembers(processed_set) or set()
-                if processed_members:
-                    before = len(all_tickers)
-                    all_tickers = [t for t in all_tickers if t not in processed_members]
-                    logger.info(f"Đã lọc {before - len(all_tickers)} tickers đã xử lý trước đó.")
-            except Exception as e:
-                logger.warning(f"Không thể đọc processed_set từ Redis: {e}")
-
-        # BƯỚC 2: LẤY DỮ LIỆU EOD
-        buffer = []  # buffer để bulk_create theo chunk
-        success_count = 0
-        error_count = 0
-        start_time = datetime.now()
-
-        for i, ticker in enumerate(all_tickers, 1):
-            # Before calling API, check global cooldown (if set by other worker)
-            if redis_client:
-                try:
-                    if redis_client.exists(cooldown_key):
-                        ttl = redis_client.ttl(cooldown_key) or 10
-                        logger.info(f"Cooldown active (set by another worker). Re-queueing task after {ttl}s and exiting current run.")
-                        # Re-queue task to resume after TTL + small margin
-                        fetch_daily_data_vnstock_task.apply_async(countdown=ttl + 5)
-                        return f"Re-queued due to cooldown (ttl={ttl})"
-                except Exception as e:
-                    logger.warning(f"Error checking cooldown key in Redis: {e}")
-
-            general_retry_count = 0
-            rate_limit_retry_count = 0
-            ticker_processed = False
-
-            while (general_retry_count < MAX_GENERAL_RETRIES or rate_limit_retry_count < MAX_RATE_LIMIT_RETRIES) and not ticker_processed:
-                try:
-                    logger.info(f"Xử lý {i}/{len(all_tickers)}: {ticker} (Retry: G{general_retry_count}, RL{rate_limit_retry_count})")
-
-                    quote_client = Quote(symbol=ticker, source='TCBS')
-                    df_history = quote_client.history(start=today_str, end=today_str, resolution='1d')
-
-                    if df_history is None or df_history.empty:
-                        logger.warning(f"Không có dữ liệu cho {ticker} ngày {today_str}. Bỏ qua.")
-                        error_count += 1
-                        ticker_processed = True
-                        # mark processed to avoid retrying repeatedly
-                        if redis_client:
-                            try:
-                                redis_client.sadd(processed_set, ticker)
-                            except Exception:
-                                pass
-                        continue
-
-                    # Lấy row cuối
-                    row = df_history.iloc[-1]
-                    date_str = row.name if df_history.index.name == 'time' else row.get('time', today_str)
-                    date_obj = pd.to_datetime(date_str, errors='coerce').date()
-
-                    if date_obj != today:
-                        logger.warning(f"Dữ liệu {ticker} không phải {today_str}. Bỏ qua.")
-                        error_count += 1
-                        ticker_processed = True
-                        if redis_client:
-                            try:
-                                redis_client.sadd(processed_set, ticker)
-                            except Exception:
-                                pass
-                        continue
-
-                    if row.get('volume', 0) == 0:
-                        logger.warning(f"Volume=0 cho {ticker} ngày {today_str}. Bỏ qua.")
-                        error_count += 1
-                        ticker_processed = True
-                        if redis_client:
-                            try:
-                                redis_client.sadd(processed_set, ticker)
-                            except Exception:
-                                pass
-                        continue
-
-                    stock_data = StockData(
-                        stock=all_stocks_map[ticker],
-                        date=date_obj,
-                        open=float(row['open']),
-                        high=float(row['high']),
-                        low=float(row['low']),
-                        close=float(row['close']),
-                        volume=int(row['volume'])
-                    )
-                    buffer.append(stock_data)
-
-                    # Mark as processed in Redis so resume skips it
-                    if redis_client:
-                        try:
-                            redis_client.sadd(processed_set, ticker)
-                        except Exception:
-                            pass
-
-                    success_count += 1
-                    ticker_processed = True
-
-                except Exception as e:
-                    error_msg = str(e).lower()
-                    is_rate_limit = any(phrase in error_msg for phrase in ["rate limit", "quá nhiều", "429", "throttled", "too many requests"]) or ('429' in error_msg)
-
-                    if is_rate_limit:
-                        # Try to extract Retry-After from exception.response.headers if present
-                        wait_time = None
-                        resp = getattr(e, 'response', None)
-                        try:
-                            if resp is not None and getattr(resp, 'headers', None):
-                                ra = resp.headers.get('Retry-After')
-                                if ra:
-                                    try:
-                                        wait_time = int(float(ra))
-                                    except Exception:
-                                        wait_time = None
-                        except Exception:
-                            wait_time = None
-
-                        # fallback exponential backoff
-                        rate_limit_retry_count += 1
-                        if wait_time is None:
-                            wait_time = min(RATE_LIMIT_BASE_WAIT * (2 ** (rate_limit_retry_count - 1)), 600)
-
-                        logger.warning(f"⚠️ Rate limit detected for {ticker}. Will wait {wait_time}s and re-queue task.")
-
-                        # Set cooldown in Redis so other workers also pause
-                        try:
-                            if redis_client:
-                                redis_client.set(cooldown_key, '1', nx=True, ex=int(wait_time))
-                        except Exception as ex_redis:
-                            logger.warning(f"Could not set cooldown key in Redis: {ex_redis}")
-
-                        # Persist buffer so far to DB to avoid data loss
-                        if buffer:
-                            try:
-                                StockData.objects.bulk_create(buffer, ignore_conflicts=True)
-                                logger.info(f"Flushed {len(buffer)} records to DB before cooldown.")
-                                buffer = []
-                            except Exception as ex_db:
-                                logger.error(f"Error bulk inserting buffer before cooldown: {ex_db}")
-
-                        # Re-queue the same task to resume after wait_time + small margin
-                        try:
-                            fetch_daily_data_vnstock_task.apply_async(countdown=int(wait_time) + 5)
-                            logger.info("Task requeued to resume after cooldown.")
-                        except Exception as ex_apply:
-                            logger.error(f"Failed to requeue task: {ex_apply}")
-
-                        # Exit current run to free worker slot
-                        return f"Rate limited on {ticker}. Requeued to resume after {wait_time}s"
-
-                    else:
-                        general_retry_count += 1
-                        if general_retry_count < MAX_GENERAL_RETRIES:
-                            logger.warning(f"Lỗi tạm thời cho {ticker}: {str(e)[:200]}... Retry sau {RETRY_DELAY}s.")
-                            time.sleep(RETRY_DELAY)
-                        else:
-                            logger.error(f"Lỗi cố định cho {ticker}: {e}")
-                            error_count += 1
-                            # mark processed so we won't retry forever
-                            if redis_client:
-                                try:
-                                    redis_client.sadd(processed_set, ticker)
-                                except Exception:
-                                    pass
-                            ticker_processed = True
-
-            # small spacing between tickers to reduce risk of hitting rate limit
-            time.sleep(INITIAL_DELAY)
-
-            # flush buffer to DB by chunk
-            if len(buffer) >= CHUNK_SIZE:
-                try:
-                    StockData.objects.bulk_create(buffer, ignore_conflicts=True)
-                    logger.info(f"Bulk inserted {len(buffer)} records into DB.")
-                    buffer = []
-                except Exception as ex_db:
-                    logger.error(f"Error bulk inserting buffer: {ex_db}")
-
-            # Cập nhật tiến độ logging
-            elapsed = (datetime.now() - start_time).total_seconds()
-            processed = i
-            avg_time = elapsed / processed if processed > 0 else 0
-            remaining = (len(all_tickers) - processed) * avg_time
-            eta = datetime.now() + timedelta(seconds=remaining)
-            logger.info(f"Tiến độ: {processed}/{len(all_tickers)} | Success: {success_count} | Errors: {error_count} | ETA: {remaining / 60:.1f} phút (~{eta.strftime('%H:%M:%S')})")
-
-        # BƯỚC 3: LƯU DB (flush remaining buffer)
-        if buffer:
-            try:
-                StockData.objects.bulk_create(buffer, ignore_conflicts=True)
-                logger.info(f"Final bulk insert: {len(buffer)} records into DB.")
-            except Exception as ex_db:
-                logger.error(f"Error bulk inserting final buffer: {ex_db}")
-
-        # cleanup Redis processed set and cooldown if you want to reuse same key later
-        if redis_client:
-            try:
-                redis_client.delete(cooldown_key)
-                # Optionally keep processed_set for next resume (useful if you run repeatedly)
-                # If you want to clear processed set after successful full run, uncomment:
-                # redis_client.delete(processed_set)
-            except Exception:
-                pass
-
-        total_time = (datetime.now() - start_time).total_seconds()
-        summary = f"HOÀN TẤT: {success_count} ticker thành công, {error_count} lỗi. Thời gian: {total_time / 60:.1f} phút."
+        # Before starting, check global cooldown (if set by other worker)
+        ttl = int(get_limiter('vnstock').cooldown_remaining())
+        if ttl:
+            logger.info(f"Cooldown active (set by another worker). Re-queueing task after {ttl}s.")
+            fetch_daily_data_vnstock_task.apply_async(kwargs={'day_str': today_str}, countdown=ttl + 5)
+            return f"Re-queued due to cooldown (ttl={ttl})"
+
+        all_tickers = _eod_universe(processed_set)
+        chunks = [all_tickers[i:i + CHUNK_SIZE] for i in range(0, len(all_tickers), CHUNK_SIZE)]
+        if not chunks:
+            logger.info("Không còn mã nào cần lấy, chỉ chạy bước hoàn tất.")
+            finalize_eod_ingestion_task.delay([], today_str)
+            return "Không còn mã nào cần lấy."
+
+        header = group(fetch_eod_chunk_task.s(chunk, today_str) for chunk in chunks)
+        result = chord(header)(finalize_eod_ingestion_task.s(today_str))
+        summary = f"Đã chia {len(all_tickers)} mã thành {len(chunks)} chunk (chord {result.id})."
         logger.info(summary)
         return summary
 
     except Exception as e:
         logger.error(f"Lỗi nghiêm trọng trong task: {e}", exc_info=True)
         return f"Task thất bại: {e}"
+
+
+@shared_task(bind=True, acks_late=True, max_retries=MAX_CHUNK_RETRIES)
+def fetch_eod_chunk_task(self, tickers, day_str, carried=None):
+    """
+    Lấy EOD cho một chunk mã, ghi DB rồi mới đánh dấu processed (an toàn khi worker chết giữa chừng).
+    Các mã bị rate limit hết số lần thử được chạy lại bằng self.retry sau cooldown; kết quả cộng dồn qua
+    `carried` để chord nhận đủ thống kê của cả chunk. Trả về dict thống kê cho finalize_eod_ingestion_task.
+    """
+    today = datetime.strptime(day_str, '%Y-%m-%d').date()
+    processed_set = f"vnstock:processed:{day_str}"
+    limiter = get_limiter('vnstock')
+    summary = carried or {'tickers': [], 'success': 0, 'errors': 0, 'rate_limited': []}
+    summary['tickers'] = sorted(set(summary['tickers']) | set(tickers))
+
+    frames, done, rate_limited = [], [], []
+
+    def fetch_one(ticker):
+        # Qua provider cache: phản hồi đã lưu không tốn token của bộ giới hạn
+        params = {'call': 'Quote.history', 'symbol': ticker, 'source': 'TCBS', 'start': day_str, 'end': day_str,
+                  'resolution': '1d'}
+        return cached_call('vnstock', params,
+                           lambda: Quote(symbol=ticker, source='TCBS').history(start=day_str, end=day_str,
+                                                                               resolution='1d'),
+                           limiter=limiter, cacheable=has_data)
+
+    results = fetch_many(tickers, fetch_one, limiter=limiter, workers=FETCH_WORKERS,
+                         max_general_retries=MAX_GENERAL_RETRIES, max_rate_limit_retries=MAX_RATE_LIMIT_RETRIES,
+                         retry_delay=RETRY_DELAY, acquire=False)
+    for ticker, df_history, error in results:
+        if error is not None and is_rate_limit_error(error):
+            # Không đánh dấu processed: lần thử sau (sau cooldown) sẽ lấy lại mã này
+            rate_limited.append(ticker)
+            continue
+        if error is not None:
+            logger.error(f"Lỗi cố định cho {ticker}: {error}")
+            summary['errors'] += 1
+        else:
+            frame, reason = _daily_frame(ticker, df_history, today)
+            if frame is None:
+                logger.warning(f"{reason} Bỏ qua.")
+                summary['errors'] += 1
+            else:
+                frames.append(frame)
+                summary['success'] += 1
+        # mark processed (sau khi ghi DB) để không thử lại mãi
+        done.append(ticker)
+
+    written = 0
+    if frames:
+        # Upsert phát hiện thay đổi: giá được sửa khi chạy lại trong ngày sẽ ghi đè bản cũ; price panel và trạng
+        # thái indicators được cập nhật qua tín hiệu price_history_changed
+        written = load_price_frame(pd.concat(frames, ignore_index=True), upsert=True)
+    _mark_processed(processed_set, done)
+    logger.info(f"Chunk {tickers[0]}..{tickers[-1]}: {written} bản ghi, {len(rate_limited)} mã bị rate limit.")
+
+    if rate_limited and self.request.retries < self.max_retries:
+        countdown = int(limiter.cooldown_remaining()) or RATE_LIMIT_BASE_WAIT
+        retry = self.retry(args=(rate_limited, day_str), kwargs={'carried': summary}, countdown=countdown + 5,
+                           throw=False)
+        # Chế độ eager (CELERY_TASK_ALWAYS_EAGER): apply() tự chạy lại chữ ký retry khi task trả về Retry,
+        # còn ném Retry thì bị EAGER_PROPAGATES đẩy thẳng lên coordinator
+        if self.request.is_eager:
+            return retry
+        raise retry
+    summary['rate_limited'] = rate_limited
+    summary['errors'] += len(rate_limited)
+    return summary
+
+
+@shared_task
+def finalize_eod_ingestion_task(chunk_results, day_str):
+    """
+    Callback của chord: tổng hợp kết quả các chunk, kiểm tra độ phủ dữ liệu ngày day_str trong DB
+    rồi kích hoạt bước phân tích.
+    """
+    day = datetime.strptime(day_str, '%Y-%m-%d').date()
+    tickers = sorted({ticker for result in chunk_results for ticker in result['tickers']})
+    success = sum(result['success'] for result in chunk_results)
+    errors = sum(result['errors'] for result in chunk_results)
+
+    # Kiểm tra độ phủ trực tiếp trong DB (không tin vào bộ đếm nếu có chunk bị giao lại)
+    covered = set(StockData.objects.filter(date=day, stock_id__in=tickers).values_list('stock_id', flat=True))
+    missing = [ticker for ticker in tickers if ticker not in covered]
+    logger.info(f"EOD {day_str}: {len(covered)}/{len(tickers)} mã có dữ liệu | Success: {success} | Errors: {errors}")
+    if missing:
+        logger.warning(f"{len(missing)} mã chưa có dữ liệu ngày {day_str}: {', '.join(missing[:50])}"
+                       f"{' ...' if len(missing) > 50 else ''}")
+
+    # Price panel đã được receiver của price_history_changed cập nhật khi từng chunk ghi DB
+    run_stock_analysis_task.delay(incremental=True)
+    return {'day': day_str, 'tickers': len(tickers), 'covered': len(covered), 'missing': missing}
+
+
+@shared_task
+def run_stock_analysis_task(incremental=False):
+    """Chạy ADMRS cho ngày gần nhất (lệnh run_stock_analysis)."""
+    call_command('run_stock_analysis', incremental=incremental)
+    return "Stock analysis completed."
+
+
+# ==================== BACKTEST TASK ====================
+
+@shared_task
+def run_backtest_task(run_key):
+    """Chạy một BacktestRun đang chờ (tạo từ API) và lưu kết quả."""
+    from .backtest_runs import execute_run
+    from .models import BacktestRun
+
+    run = BacktestRun.objects.filter(key=run_key).first()
+    if run is None or run.status == BacktestRun.StatusChoices.DONE:
+        return run_key
+    try:
+        execute_run(run)
+    except Exception as e:
+        logger.error(f"Backtest {run_key} thất bại: {e}", exc_info=True)
+    return run_key
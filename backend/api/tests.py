@@ -1,3 +1,815 @@
-from django.test import TestCase
+import decimal
+import io
+import os
+import tempfile
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+import redis
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .analysis_logic import (
+    run_analysis_on_data, _compute_indicators, _detect_rsi_bearish_divergence, _rsi_bearish_divergence_series,
+    _rule_columns, compute_signal_components
+)
+from .analysis_config import ANALYSIS_WINDOW_BARS, MASTER_WEIGHTS, MIN_AVG_TRADE_VALUE
+from . import tasks
+from .backtest_runs import (
+    ENGINE_VERSION, HEARTBEAT_INTERVAL, STALE_HEARTBEATS, normalize_config, run_key, strategy_version,
+    encode_equity_curve, decode_equity_curve, encode_trades, decode_trades
+)
+from .bulk_loader import changed_rows, insert_sql, load_price_frame, prepare_price_frame, row_hashes
+from .coverage import missing_ranges
+from .data_loader import liquid_tickers, load_analysis_window, load_recent_bars, window_start_date
+from .backtest_engine import (
+    SignalCalendar, signals_to_frame, run_backtest, _run_backtest_decimal, walk_forward_windows,
+    load_backtest_data, performance_metrics, run_parameter_sweep, signals_from_components
+)
+from .indicator_state import IncrementalIndicators, advance_indicator_states
+from .models import BacktestRun, IndicatorState, Stock, StockData, TickerCoverage
+from .monte_carlo import run_monte_carlo
+from .price_panel import PANEL_FIELDS, PricePanel
+from .provider_cache import ProviderCache, ProviderCacheMiss
+from .rate_limit import RedisRateLimiter, TokenBucket, get_limiter, reset_limiters
+from .rule_engine import compile_rules
+from .signals import price_history_changed
+from .trading_calendar import TradingCalendar, holidays
+from .vnstock_fetcher import fetch_many, quote_history
+
+
+def _make_price_history(tickers=('AAA', 'BBB', 'CCC'), days=600, seed=42):
+    """Dữ liệu OHLCV giả lập cố định (random walk có xu hướng) cho các bài test phân tích."""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2020-01-01', periods=days)
+    frames = []
+    for n, ticker in enumerate(tickers):
+        drift = 0.0004 * (n + 1)
+        close = 30 * np.exp(np.cumsum(rng.normal(drift, 0.02, days)))
+        open_ = close * (1 + rng.normal(0, 0.01, days))
+        high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.01, days)))
+        low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.01, days)))
+        volume = rng.integers(500_000, 3_000_000, days) * (1 + 2 * (rng.random(days) > 0.9))
+        frames.append(pd.DataFrame({
+            'stock_id': ticker, 'date': dates, 'open': open_, 'high': high, 'low': low, 'close': close,
+            'volume': volume,
+        }))
+    df_all = pd.concat(frames, ignore_index=True)
+    for col in ['open', 'high', 'low', 'close', 'volume']:
+        df_all[col] = pd.to_numeric(df_all[col], downcast='float')
+    return df_all
+
+
+class VectorizedScoringParityTests(SimpleTestCase):
+    def test_full_history_matches_loop(self):
+        df_all = _make_price_history()
+        expected = run_analysis_on_data(df_all, scan_full_history=True, vectorized=False)
+        actual = run_analysis_on_data(df_all, scan_full_history=True, vectorized=True)
+        self.assertTrue(expected)
+        self.assertEqual(actual, expected)
+
+    def test_latest_day_matches_loop(self):
+        df_all = _make_price_history(seed=7)
+        expected = run_analysis_on_data(df_all, scan_full_history=False, vectorized=False)
+        actual = run_analysis_on_data(df_all, scan_full_history=False, vectorized=True)
+        self.assertEqual(actual, expected)
+
+
+class RsiDivergenceTests(SimpleTestCase):
+    def test_series_matches_window_detector(self):
+        rng = np.random.default_rng(0)
+        for _ in range(10):
+            n = int(rng.integers(10, 300))
+            # Làm tròn để có các đỉnh bằng nhau (argrelextrema dùng so sánh nghiêm ngặt)
+            close = np.round(np.cumsum(rng.normal(0, 1, n)), 1).astype(np.float32)
+            rsi = np.round(rng.uniform(20, 80, n), 0)
+            rsi[:14] = np.nan
+            df = pd.DataFrame({'close': close, 'RSI_14': rsi})
+            expected = [_detect_rsi_bearish_divergence(df.iloc[:i + 1]) for i in range(n)]
+            self.assertEqual(_rsi_bearish_divergence_series(close, rsi).tolist(), expected)
+
+
+class ParallelAnalysisTests(SimpleTestCase):
+    def test_process_pool_matches_serial(self):
+        df_all = _make_price_history(tickers=[f'T{n:02d}' for n in range(6)])
+        expected = run_analysis_on_data(df_all, scan_full_history=True)
+        actual = run_analysis_on_data(df_all, scan_full_history=True, workers=3)
+        self.assertEqual(actual, expected)
+
+
+class IncrementalIndicatorTests(SimpleTestCase):
+    def test_state_matches_full_recompute(self):
+        df_stock = _make_price_history(tickers=('AAA',), days=700).reset_index(drop=True)
+        expected = _compute_indicators(df_stock.copy()).iloc[-20:].reset_index(drop=True)
+
+        state = IncrementalIndicators.from_history(df_stock.iloc[:-5])
+        state = IncrementalIndicators(state.to_dict())  # vòng tuần tự hoá như khi lưu DB
+        for row in df_stock.iloc[-5:].itertuples(index=False):
+            state.update(row.date, row.open, row.high, row.low, row.close, row.volume)
+        actual = state.tail_frame()
+
+        for col in ['SMA20', 'SMA50', 'SMA150', 'RSI_14', 'MACD', 'MACDs', 'RVOL', '52_Week_High', 'CMF_20',
+                    'ATR_14', 'CDL_ENGULFING']:
+            np.testing.assert_allclose(actual[col], expected[col].astype(float), rtol=1e-6, atol=1e-6, err_msg=col)
+
+
+class PricePanelTests(SimpleTestCase):
+    def test_append_and_reload_round_trip(self):
+        df_all = _make_price_history(days=300)
+        # Bỏ một ô ở giữa để panel có chỗ trống (mã ngừng giao dịch)
+        df_all = df_all.drop(index=df_all.index[(df_all['stock_id'] == 'BBB')][100]).reset_index(drop=True)
+        rows = list(df_all[['stock_id', 'date', *PANEL_FIELDS]].itertuples(index=False, name=None))
+        empty = PricePanel([], [], {f: np.empty((0, 0)) for f in PANEL_FIELDS})
+
+        with tempfile.TemporaryDirectory() as directory:
+            # Nạp 250 ngày đầu cho 2 mã, sau đó nối thêm ngày mới và một mã mới
+            first_dates = df_all['date'].drop_duplicates().iloc[:250]
+            initial = [r for r in rows if r[0] != 'CCC' and r[1] in set(first_dates)]
+            empty.append_rows(initial, directory=directory)
+            PricePanel.load(directory).append_rows([r for r in rows if r[0] != 'CCC'], directory=directory)
+            PricePanel.load(directory).append_rows([r for r in rows if r[0] == 'CCC'], directory=directory)
+
+            panel = PricePanel.load(directory)
+            self.assertEqual(panel.tickers, ['AAA', 'BBB', 'CCC'])
+            self.assertEqual(panel.row_count, len(df_all))
+            pd.testing.assert_frame_equal(panel.to_long_frame(), df_all.astype({'volume': np.float32}),
+                                          check_dtype=False)
+            expected_close = df_all.pivot(index='date', columns='stock_id', values='close')
+            np.testing.assert_array_equal(panel.frame('close').to_numpy(), expected_close.to_numpy())
+
+    def test_append_writes_in_place(self):
+        df_all = _make_price_history(days=60)
+        rows = list(df_all[['stock_id', 'date', *PANEL_FIELDS]].itertuples(index=False, name=None))
+        last_day = df_all['date'].max()
+        with tempfile.TemporaryDirectory() as directory:
+            PricePanel([], [], {f: np.empty((0, 0)) for f in PANEL_FIELDS}).append_rows(
+                [r for r in rows if not (r[0] == 'BBB' and r[1] == last_day)], directory=directory)
+            inode = os.stat(os.path.join(directory, 'close.bin')).st_ino
+
+            # Ô trống của ngày đã có, một ô bị sửa (overwrite) và một ngày mới
+            next_day = last_day + pd.offsets.BDay()
+            PricePanel.load(directory).append_rows(
+                [('BBB', last_day, 1.0, 2.0, 0.5, 1.5, 10.0), ('AAA', last_day, 1.0, 2.0, 0.5, 9.5, 10.0),
+                 ('AAA', next_day, 1.0, 2.0, 0.5, 1.25, 10.0)], overwrite=True, directory=directory)
+
+            panel = PricePanel.load(directory)
+            self.assertEqual(os.stat(os.path.join(directory, 'close.bin')).st_ino, inode)
+            self.assertEqual(panel.meta['row_count'], len(df_all) + 1)
+            self.assertEqual(panel.meta['row_count'], panel.row_count)
+            close = panel.frame('close')
+            self.assertEqual([close.loc[last_day, 'BBB'], close.loc[last_day, 'AAA'], close.loc[next_day, 'AAA']],
+                             [1.5, 9.5, 1.25])
+            self.assertTrue(np.isnan(close.loc[next_day, 'BBB']))
+
+
+class BulkLoaderTests(SimpleTestCase):
+    def test_prepare_price_frame_coerces_and_dedupes(self):
+        df_history = pd.DataFrame({
+            'time': ['2024-01-03', '2024-01-02', '2024-01-03', 'bad', '2024-01-04'],
+            'open': [2.0, 1.234, 9.0, 3.0, 'x'], 'high': [3, 2, 9, 4, 5], 'low': [1, 1, 9, 1, 1],
+            'close': [2.5, 1.5, 9.0, 3.0, 4.0], 'volume': [20.0, 10.0, 90.0, 40.0, 50.0],
+        })
+        frame = prepare_price_frame(df_history, 'AAA')
+        self.assertEqual(frame['date'].dt.strftime('%Y-%m-%d').tolist(), ['2024-01-02', '2024-01-03'])
+        self.assertEqual(frame['open'].tolist(), [1.23, 2.0])
+        self.assertEqual(frame['volume'].dtype, np.int64)
+        self.assertEqual(set(frame['stock_id']), {'AAA'})
+        with self.assertRaises(ValueError):
+            prepare_price_frame(df_history.drop(columns='volume'), 'AAA')
+
+    def test_insert_sql_per_vendor(self):
+        self.assertTrue(insert_sql('mysql').startswith('INSERT IGNORE INTO api_stockdata'))
+        self.assertIn('ON DUPLICATE KEY UPDATE open = VALUES(open)', insert_sql('mysql', upsert=True))
+        self.assertIn('ON CONFLICT (stock_id, date) DO NOTHING', insert_sql('sqlite'))
+        self.assertIn('DO UPDATE SET open = excluded.open', insert_sql('postgresql', upsert=True))
+
+    def test_row_hashes_match_stored_decimals(self):
+        incoming = pd.DataFrame({'open': [10.004, 11.0], 'high': [10.5, 11.5], 'low': [9.9, 10.9],
+                                 'close': [10.2, 11.2], 'volume': [1000.0, 2000.0]})
+        # Giá trị đọc lại từ DecimalField
+        stored = pd.DataFrame({'open': [decimal.Decimal('10.00'), decimal.Decimal('11.00')],
+                               'high': [decimal.Decimal('10.50'), decimal.Decimal('11.50')],
+                               'low': [decimal.Decimal('9.90'), decimal.Decimal('10.90')],
+                               'close': [decimal.Decimal('10.20'), decimal.Decimal('11.25')],
+                               'volume': [1000, 2000]})
+        self.assertEqual((row_hashes(incoming) == row_hashes(stored)).tolist(), [True, False])
+
+
+class PriceUpsertTests(TestCase):
+    def setUp(self):
+        for ticker in ('AAA', 'BBB'):
+            Stock.objects.create(ticker=ticker, company_name=ticker)
+        self.days = pd.bdate_range('2024-03-04', periods=3)
+        self.frame = pd.DataFrame({
+            'stock_id': 'AAA', 'date': self.days, 'open': [10.0, 10.5, 11.0], 'high': [10.5, 11.0, 11.5],
+            'low': [9.5, 10.0, 10.5], 'close': [10.2, 10.8, 11.2], 'volume': np.array([100, 200, 300], dtype=np.int64),
+        })
+        load_price_frame(self.frame)
+        self.events = []
+        handler = lambda sender, **kwargs: self.events.append(kwargs)
+        price_history_changed.connect(handler, weak=False)
+        self.addCleanup(price_history_changed.disconnect, handler)
+
+    def _corrected(self):
+        frame = self.frame.copy()
+        frame.loc[1, 'close'] = 10.9
+        new_row = self.frame.iloc[[2]].assign(date=pd.Timestamp('2024-03-07'))
+        return pd.concat([frame, new_row], ignore_index=True)
+
+    def test_changed_rows_skips_unchanged(self):
+        rows, changes = changed_rows(self._corrected())
+        self.assertEqual(rows['date'].tolist(), [self.days[1], pd.Timestamp('2024-03-07')])
+        self.assertEqual(changes, {'AAA': (self.days[1].date(), self.days[1].date())})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(load_price_frame(self.frame, upsert=True), 0)
+        self.assertEqual(self.events, [])
+
+    def test_upsert_writes_corrections_and_signals(self):
+        IndicatorState.objects.create(stock_id='AAA', last_date=self.days[2].date(), bar_count=3)
+        IndicatorState.objects.create(stock_id='BBB', last_date=self.days[2].date(), bar_count=3)
+        with tempfile.TemporaryDirectory() as directory, override_settings(PRICE_PANEL_DIR=directory):
+            PricePanel.from_database().save(directory)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertEqual(load_price_frame(self._corrected(), upsert=True), 2)
+            panel = PricePanel.load(directory)
+            self.assertEqual(panel.ticker_frame('AAA')['close'].round(2).tolist(), [10.2, 10.9, 11.2, 11.2])
+
+        self.assertEqual(StockData.objects.get(stock_id='AAA', date=self.days[1]).close, decimal.Decimal('10.90'))
+        day = self.days[1].date()
+        self.assertEqual(self.events[0]['changes'], {'AAA': (day, day)})
+        self.assertEqual(self.events[0]['written'], {'AAA': (day, pd.Timestamp('2024-03-07').date())})
+        self.assertIsNotNone(TickerCoverage.objects.get(stock_id='AAA').revised_at)
+        # Chỉ trạng thái của mã bị sửa bị xoá
+        self.assertEqual(list(IndicatorState.objects.values_list('stock_id', flat=True)), ['BBB'])
+
+    def test_advance_states_appends_new_sessions_and_rebuilds_corrections(self):
+        logs = []
+        advance_indicator_states(log=logs.append)
+        # BBB chưa có dữ liệu giá nên không có trạng thái
+        self.assertEqual(list(IndicatorState.objects.values_list('stock_id', 'bar_count')), [('AAA', 3)])
+
+        new_day = self.frame.iloc[[2]].assign(date=pd.Timestamp('2024-03-07'))
+        with self.captureOnCommitCallbacks(execute=True):
+            load_price_frame(new_day, upsert=True)
+        advance_indicator_states(log=logs.append)
+        state = IndicatorState.objects.get(stock_id='AAA')
+        self.assertEqual((state.last_date, state.bar_count), (pd.Timestamp('2024-03-07').date(), 4))
+        self.assertIn('(0 mã dựng lại toàn bộ)', logs[-1])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            load_price_frame(self._corrected(), upsert=True)
+        self.assertFalse(IndicatorState.objects.exists())
+        advance_indicator_states(log=logs.append)
+        self.assertEqual(IndicatorState.objects.get(stock_id='AAA').state['closes'][1], 10.9)
+        self.assertIn('(1 mã dựng lại toàn bộ)', logs[-1])
+
+    def test_backfilled_history_rebuilds_state(self):
+        advance_indicator_states()
+        self.assertEqual(IndicatorState.objects.get(stock_id='AAA').bar_count, 3)
+
+        # Seed/import nạp thêm lịch sử cũ hơn (không upsert): trạng thái đã dựng phải bị dựng lại
+        older = self.frame.assign(date=pd.bdate_range('2024-02-26', periods=3))
+        with self.captureOnCommitCallbacks(execute=True):
+            load_price_frame(older)
+        self.assertEqual(self.events[-1], {'signal': price_history_changed, 'changes': {},
+                                           'written': {'AAA': (older['date'].min().date(), older['date'].max().date())}})
+        self.assertFalse(IndicatorState.objects.exists())
+        advance_indicator_states()
+        state = IndicatorState.objects.get(stock_id='AAA')
+        self.assertEqual((state.bar_count, state.last_date), (6, self.days[-1].date()))
+
+
+class CoverageTests(SimpleTestCase):
+    def test_missing_ranges(self):
+        d = pd.Timestamp
+        start, end = d('2020-01-01').date(), d('2024-12-31').date()
+        self.assertEqual(missing_ranges(None, None, start, end), [(start, end)])
+        self.assertEqual(missing_ranges(start, end, start, end), [])
+        self.assertEqual(missing_ranges(d('2021-03-01').date(), d('2024-12-20').date(), start, end),
+                         [(start, d('2021-02-28').date()), (d('2024-12-21').date(), end)])
+        # Khoảng yêu cầu nằm trọn sau phần đã có
+        self.assertEqual(missing_ranges(start, d('2022-01-01').date(), d('2023-01-01').date(), end),
+                         [(d('2023-01-01').date(), end)])
+        self.assertEqual(missing_ranges(start, end, end, start), [])
+
+
+class TradingCalendarTests(SimpleTestCase):
+    def setUp(self):
+        self.calendar = TradingCalendar(holidays(2023, 2025))
+
+    def test_tet_and_weekends_are_skipped(self):
+        d = lambda s: pd.Timestamp(s).date()
+        self.assertFalse(self.calendar.is_trading_day('2024-02-09'))
+        self.assertFalse(self.calendar.is_trading_day('2024-02-17'))
+        self.assertTrue(self.calendar.is_trading_day('2024-02-15'))
+        self.assertEqual(self.calendar.previous_session('2024-02-15'), d('2024-02-07'))
+        self.assertEqual(self.calendar.next_session('2024-02-07'), d('2024-02-15'))
+        self.assertEqual(self.calendar.previous_session('2024-02-15', inclusive=True), d('2024-02-15'))
+        self.assertEqual(self.calendar.sessions_between('2024-02-07', '2024-02-16'),
+                         [d('2024-02-07'), d('2024-02-15'), d('2024-02-16')])
+
+    def test_session_range_and_window(self):
+        d = lambda s: pd.Timestamp(s).date()
+        # Chỉ gồm Tết và cuối tuần: không có phiên nào để gọi API
+        self.assertIsNone(self.calendar.session_range(d('2024-02-08'), d('2024-02-14')))
+        self.assertEqual(self.calendar.session_range(d('2024-02-03'), d('2024-02-18')),
+                         (d('2024-02-05'), d('2024-02-16')))
+        self.assertEqual(self.calendar.session_count('2024-02-01', '2024-02-29'), 16)
+        self.assertEqual(self.calendar.window_start('2024-02-18', 3), d('2024-02-07'))
+
+
+class AnalysisWindowTests(SimpleTestCase):
+    def test_window_matches_full_history_on_latest_day(self):
+        df_stock = _make_price_history(tickers=('AAA',), days=900, seed=3)
+        expected = _compute_indicators(df_stock.copy()).iloc[-1]
+        actual = _compute_indicators(df_stock.iloc[-ANALYSIS_WINDOW_BARS:].reset_index(drop=True)).iloc[-1]
+        for col in ['SMA150', 'RSI_14', 'MACD', 'MACDs', 'ATR_14', 'CMF_20', '52_Week_High', 'RVOL']:
+            self.assertAlmostEqual(float(actual[col]), float(expected[col]), places=6, msg=col)
+
+
+def _stored_price_history(tickers=('AAA', 'BBB', 'CCC'), days=60, seed=5):
+    """Ghi _make_price_history vào StockData (giá làm tròn như DecimalField); trả về khung đã ghi."""
+    frame = _make_price_history(tickers=tickers, days=days, seed=seed)
+    frame[['open', 'high', 'low', 'close']] = frame[['open', 'high', 'low', 'close']].astype(np.float64).round(2)
+    frame['volume'] = frame['volume'].astype(np.int64)
+    for ticker in tickers:
+        Stock.objects.get_or_create(ticker=ticker, defaults={'company_name': ticker})
+    load_price_frame(frame)
+    return frame
+
+
+class AnalysisWindowLoadTests(TestCase):
+    def test_panel_and_database_windows_match(self):
+        _stored_price_history()
+        start_date = window_start_date(20)
+        with tempfile.TemporaryDirectory() as directory, override_settings(PRICE_PANEL_DIR=directory):
+            # Chưa có panel: đọc DB theo cửa sổ, không dựng panel
+            expected = load_analysis_window(20, tickers=['AAA', 'CCC'], start_date=start_date)
+            self.assertFalse(os.listdir(directory))
+            self.assertEqual(len(expected), 40)
+
+            PricePanel.from_database().save(directory)
+            with mock.patch('api.data_loader.load_recent_bars') as load_recent_bars:
+                actual = load_analysis_window(20, tickers=['AAA', 'CCC'], start_date=start_date)
+            load_recent_bars.assert_not_called()
+        pd.testing.assert_frame_equal(actual.reset_index(drop=True), expected)
+
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class LiquidTickersTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        frame = _stored_price_history(tickers=('AAA', 'BBB', 'CCC', 'DDD'), days=40)
+        last_20 = frame['date'] >= frame['date'].unique()[-20]
+        StockData.objects.filter(stock_id='BBB').update(volume=F('volume') / 1000)
+        # CCC đúng bằng ngưỡng (25 * 40000 * 1000), DDD thấp hơn một chút trong 20 phiên cuối
+        for ticker, volume in (('CCC', 40000), ('DDD', 39999)):
+            StockData.objects.filter(stock_id=ticker, date__in=frame.loc[last_20, 'date'].dt.date.unique()).update(
+                close=25, volume=volume)
+        # EEE thanh khoản cao nhưng chưa đủ 20 phiên
+        Stock.objects.create(ticker='EEE', company_name='EEE')
+        load_price_frame(frame[last_20 & (frame['stock_id'] == 'AAA')].tail(10).assign(stock_id='EEE'))
+
+    def _in_loop_check(self):
+        """Điều kiện thanh khoản cũ trong vòng lặp phân tích, chạy trên khung đã tải của mọi mã."""
+        df_all = load_recent_bars(ANALYSIS_WINDOW_BARS)
+        passed = []
+        for ticker, df_stock in df_all.groupby('stock_id'):
+            avg_trade_value_20d = (df_stock['close'] * 1000 * df_stock['volume']).rolling(window=20).mean().iloc[-1]
+            if not pd.isna(avg_trade_value_20d) and avg_trade_value_20d >= MIN_AVG_TRADE_VALUE:
+                passed.append(ticker)
+        return passed
+
+    def test_matches_in_loop_check(self):
+        self.assertEqual(liquid_tickers(use_cache=False), ['AAA', 'CCC'])
+        self.assertEqual(liquid_tickers(use_cache=False), self._in_loop_check())
+        self.assertEqual(liquid_tickers(window_start=window_start_date(20), use_cache=False), ['AAA', 'CCC'])
+
+    def test_cached_per_last_date(self):
+        self.assertEqual(liquid_tickers(), ['AAA', 'CCC'])
+        # Sửa thẳng StockData không đổi ngày cuối: vẫn dùng kết quả đã cache
+        StockData.objects.filter(stock_id='BBB').update(volume=F('volume') * 1000)
+        self.assertEqual(liquid_tickers(), ['AAA', 'CCC'])
+        self.assertEqual(liquid_tickers(use_cache=False), ['AAA', 'BBB', 'CCC'])
+
+        # Phiên mới làm đổi khoá cache nên kết quả được tính lại
+        last = StockData.objects.filter(stock_id='AAA').latest('date')
+        load_price_frame(pd.DataFrame({
+            'stock_id': ['AAA'], 'date': [pd.Timestamp(last.date) + pd.offsets.BDay()], 'open': [30.0],
+            'high': [31.0], 'low': [29.0], 'close': [30.0], 'volume': [1_000_000],
+        }))
+        self.assertEqual(liquid_tickers(), ['AAA', 'BBB', 'CCC'])
+
+
+class RuleEngineTests(SimpleTestCase):
+    def test_weight_sets_match_individual_scoring(self):
+        df_stock = _compute_indicators(_make_price_history(tickers=('AAA',), days=400).reset_index(drop=True))
+        rules = compile_rules()
+        masks = rules.evaluate(_rule_columns(df_stock, rules))
+        weight_sets = [
+            {},
+            {'MASTER_WEIGHTS': {'TREND': 50, 'MOMENTUM': 30, 'VOLUME': 20}},
+            {'SIGNAL_SCORES': {key: 1 for key in rules.keys}},
+        ]
+        finals = rules.score_weight_sets(masks, weight_sets)
+
+        np.testing.assert_array_equal(finals[0], rules.final_scores(rules.group_scores(masks)))
+        for final, weights in zip(finals[1:], weight_sets[1:]):
+            table = weights.get('SIGNAL_SCORES')
+            expected = rules.final_scores(rules.group_scores(masks, table), weights.get('MASTER_WEIGHTS'),
+                                          None if table is None else {'TREND': 6, 'MOMENTUM': 5, 'VOLUME': 3})
+            np.testing.assert_allclose(final, expected)
+
+
+class StrategyBatchTests(SimpleTestCase):
+    def test_weight_set_columns_share_indicator_pass(self):
+        df_all = _make_price_history(days=400)
+        components = compute_signal_components(df_all, weight_sets={
+            'default': {'MASTER_WEIGHTS': dict(MASTER_WEIGHTS)},
+            'trend_only': {'MASTER_WEIGHTS': {'TREND': 100, 'MOMENTUM': 0, 'VOLUME': 0}},
+        })
+        np.testing.assert_allclose(components['final_score_default'], components['final_score'])
+        self.assertFalse(np.allclose(components['final_score_trend_only'], components['final_score']))
+
+
+class BacktestEngineTests(SimpleTestCase):
+    def test_array_engine_matches_decimal_reference(self):
+        df_all = _make_price_history(tickers=[f'T{n:02d}' for n in range(8)], days=800, seed=5)
+        # Giá trong StockData có 2 chữ số thập phân
+        for col in ['open', 'high', 'low', 'close']:
+            df_all[col] = df_all[col].round(2).astype(np.float32)
+        open_prices = df_all.pivot(index='date', columns='stock_id', values='open').ffill()
+        close_prices = df_all.pivot(index='date', columns='stock_id', values='close').ffill()
+        signals_df = signals_to_frame(run_analysis_on_data(df_all, scan_full_history=True))
+
+        for max_holding_period in (20, 60):
+            expected = _run_backtest_decimal(signals_df, open_prices, close_prices, start_year=2021,
+                                             max_holding_period=max_holding_period)
+            trades = []
+            actual = run_backtest(signals_df, open_prices, close_prices, start_year=2021,
+                                  max_holding_period=max_holding_period, trades=trades)
+            pd.testing.assert_series_equal(actual, expected)
+            self.assertTrue(trades)
+
+    def test_signal_calendar_buckets(self):
+        signals_df = pd.DataFrame({
+            'ticker': ['B', 'A', 'B', 'A'], 'target_price': [decimal.Decimal('2.50')] * 4,
+            'stop_loss': [decimal.Decimal('1.25')] * 4,
+        }, index=pd.to_datetime(['2024-01-03', '2024-01-02', '2024-01-02', '2024-01-05']))
+        trading_days = pd.bdate_range('2024-01-01', '2024-01-08')
+        calendar = SignalCalendar(signals_df, trading_days, {'A': 0, 'B': 1})
+
+        for i, day in enumerate(trading_days):
+            previous = signals_df.index[signals_df.index < day]
+            if previous.empty:
+                self.assertEqual(calendar.day_bucket[i], -1)
+                continue
+            bucket = calendar.day_bucket[i]
+            rows = slice(calendar.offsets[bucket], calendar.offsets[bucket + 1])
+            expected = signals_df.loc[[previous.max()]]
+            self.assertEqual(calendar.columns[rows].tolist(), [{'A': 0, 'B': 1}[t] for t in expected['ticker']])
+        self.assertEqual(calendar.targets.tolist(), [250] * 4)
+
+    def test_walk_forward_windows_are_contiguous(self):
+        trading_days = pd.bdate_range('2020-01-01', '2024-06-28')
+        windows = walk_forward_windows(trading_days, train_years=2, test_years=1)
+        self.assertEqual([w[1] for w in windows],
+                         [pd.Timestamp('2022-01-01'), pd.Timestamp('2023-01-01'), pd.Timestamp('2024-01-01')])
+        for (_, _, end), (_, next_start, _) in zip(windows, windows[1:]):
+            self.assertEqual(end, next_start)
+        self.assertEqual(windows[-1][2], pd.Timestamp('2024-06-29'))
+
+
+
+class ParameterSweepTests(TestCase):
+    GRID = {'thresholds': [50.0, 65.0], 'target_multipliers': ['1.5', '2.5'], 'stop_multipliers': ['1'],
+            'holding_periods': [20, 60]}
+    PARAMS = ['threshold', 'target_multiplier', 'stop_multiplier', 'max_holding_period']
+
+    def setUp(self):
+        _stored_price_history(days=600, seed=5)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.enterContext(override_settings(PRICE_PANEL_DIR=self.directory))
+        df_all, self.open_prices, self.close_prices = load_backtest_data()
+        self.components = compute_signal_components(df_all)
+
+    def test_rows_match_single_backtests(self):
+        results = run_parameter_sweep(self.components, self.open_prices, self.close_prices, *self.GRID.values())
+        self.assertEqual(len(results), 8)
+        self.assertTrue(results['final_value'].notna().any())
+        for row in results.to_dict('records'):
+            signals_df = signals_from_components(self.components, row['threshold'], row['target_multiplier'],
+                                                 row['stop_multiplier'])
+            self.assertEqual(row['signals'], len(signals_df))
+            if signals_df.empty:
+                self.assertTrue(np.isnan(row.get('final_value', np.nan)))
+                continue
+            history = run_backtest(signals_df, self.open_prices, self.close_prices,
+                                   max_holding_period=row['max_holding_period'])
+            metrics = performance_metrics(history)
+            for key in ('final_value', 'total_return', 'sharpe_ratio', 'max_drawdown', 'calmar_ratio'):
+                self.assertAlmostEqual(row[key], metrics[key], msg=f"{key} {row}")
+
+    def test_command_writes_ranked_grid(self):
+        output = os.path.join(self.directory, 'sweep.csv')
+        call_command('backtest_sweep', '--thresholds', '50,65', '--target-multipliers', '1.5,2.5',
+                     '--stop-multipliers', '1', '--holding-periods', '20,60', '--output', output,
+                     stdout=io.StringIO())
+        ranked = pd.read_csv(output)
+        self.assertEqual(list(ranked['rank']), list(range(1, 9)))
+        self.assertTrue(ranked['sharpe_ratio'].dropna().is_monotonic_decreasing)
+
+        expected = run_parameter_sweep(self.components, self.open_prices, self.close_prices, *self.GRID.values())
+        expected = expected.astype({'target_multiplier': float, 'stop_multiplier': float})
+        merged = ranked.merge(expected, on=self.PARAMS, suffixes=('', '_expected'))
+        self.assertEqual(len(merged), 8)
+        np.testing.assert_allclose(merged['sharpe_ratio'], merged['sharpe_ratio_expected'], atol=1e-4)
+
+class MonteCarloTests(SimpleTestCase):
+    def _trades(self, n=300, seed=0):
+        rng = np.random.default_rng(seed)
+        dates = pd.bdate_range('2021-01-01', periods=n * 2)
+        return [{
+            'entry_date': dates[2 * k], 'exit_date': dates[2 * k + 1], 'entry_price': decimal.Decimal('10.00'),
+            'exit_price': decimal.Decimal(str(round(10 * (1 + rng.normal(0.01, 0.05)), 2))),
+        } for k in range(n)]
+
+    def test_permutation_keeps_final_return(self):
+        simulation = run_monte_carlo(self._trades(), n_paths=3_000, method='permute', seed=1)
+        self.assertEqual(simulation['cagr'].shape, (3_000,))
+        np.testing.assert_allclose(simulation['cagr'], simulation['cagr'][0])
+        self.assertTrue((simulation['max_drawdown'] <= 0).all())
+        self.assertGreater(simulation['max_drawdown'].std(), 0)
+
+    def test_resample_spreads_outcomes(self):
+        simulation = run_monte_carlo(self._trades(), n_paths=3_000, method='resample', seed=1)
+        self.assertGreater(np.percentile(simulation['cagr'], 95), np.percentile(simulation['cagr'], 5))
+
+
+class BacktestRunTests(SimpleTestCase):
+    def test_equivalent_configs_share_key(self):
+        a = normalize_config({'target_multiplier': 2, 'threshold': '65'})
+        b = normalize_config({'target_multiplier': '2.0'})
+        self.assertEqual(run_key(a, '100:2024-06-28'), run_key(b, '100:2024-06-28'))
+        self.assertNotEqual(run_key(a, '100:2024-06-28'), run_key(a, '101:2024-06-28'))
+        # Đổi bảng điểm hoặc phiên bản engine -> khoá mới, không dùng lại kết quả cũ
+        current = run_key(a, '100:2024-06-28')
+        with mock.patch.dict('api.analysis_config.SIGNAL_SCORES', {'RSI_ABOVE_50': 3}):
+            self.assertNotEqual(run_key(a, '100:2024-06-28'), current)
+        with mock.patch('api.backtest_runs.ENGINE_VERSION', ENGINE_VERSION + 1):
+            self.assertNotEqual(run_key(a, '100:2024-06-28'), current)
+        self.assertEqual(run_key(a, '100:2024-06-28', strategy_version()), current)
+        with self.assertRaises(ValueError):
+            normalize_config({'unknown': 1})
+
+    def test_result_encoding_round_trip(self):
+        history = pd.Series(np.linspace(1e8, 1.2e8, 250), index=pd.bdate_range('2021-01-01', periods=250))
+        pd.testing.assert_series_equal(decode_equity_curve(encode_equity_curve(history)), history,
+                                       check_freq=False)
+        trades = [{'ticker': 'AAA', 'shares': np.int64(100), 'entry_date': pd.Timestamp('2021-01-04'),
+                   'entry_price': decimal.Decimal('30.9'), 'exit_price': None}]
+        self.assertEqual(decode_trades(encode_trades(trades)),
+                         [{'ticker': 'AAA', 'shares': 100, 'entry_date': '2021-01-04', 'entry_price': '30.9',
+                           'exit_price': None}])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class BacktestRunViewTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('tester', password='secret'))
+
+    def test_form_post_and_only_stale_runs_requeued(self):
+        with mock.patch('api.views.run_backtest_task') as task:
+            response = self.client.post('/api/backtests/', {'threshold': '70', 'consume_signals_once': 'false'})
+            self.assertEqual(response.status_code, 202)
+            run = BacktestRun.objects.get()
+            self.assertEqual((run.config['threshold'], run.config['consume_signals_once']), (70.0, False))
+            self.assertEqual(task.delay.call_count, 1)
+
+            # Đang RUNNING lâu nhưng vẫn có heartbeat: không giao lại
+            long_ago = timezone.now() - timedelta(hours=2)
+            BacktestRun.objects.update(status=BacktestRun.StatusChoices.RUNNING, created_at=long_ago)
+            self.client.post('/api/backtests/', {'threshold': '70'}, format='json')
+            self.assertEqual(task.delay.call_count, 1)
+
+            # Mất heartbeat (worker chết): giao lại đúng một lần
+            silent = timedelta(seconds=HEARTBEAT_INTERVAL * STALE_HEARTBEATS + 1)
+            BacktestRun.objects.update(updated_at=timezone.now() - silent)
+            response = self.client.post('/api/backtests/', {'threshold': '70'}, format='json')
+            self.assertEqual(response.status_code, 202)
+            task.delay.assert_called_with(run.key)
+            self.client.post('/api/backtests/', {'threshold': '70'}, format='json')
+            self.assertEqual(task.delay.call_count, 2)
+        self.assertEqual(BacktestRun.objects.get().status, BacktestRun.StatusChoices.PENDING)
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True)
+    def test_eager_mode_runs_inline(self):
+        # CELERY_TASK_ALWAYS_EAGER: backtest chạy ngay trong request và POST trả luôn kết quả
+        history = pd.Series([1e8, 1.1e8], index=pd.bdate_range('2024-01-01', periods=2))
+        with mock.patch('api.backtest_runs.simulate', return_value=(history, [], {'total_return': 0.1})):
+            response = self.client.post('/api/backtests/', {}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], BacktestRun.StatusChoices.DONE)
+        self.assertEqual(response.data['metrics'], {'total_return': 0.1})
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True)
+class EodIngestionFlowTests(TestCase):
+    """Coordinator -> các chunk -> callback của chord, chạy eager với vnstock / Redis / bước phân tích giả lập."""
+    DAY = '2024-03-05'
+
+    def setUp(self):
+        for ticker in ('AAA', 'BBB', 'CCC'):
+            Stock.objects.create(ticker=ticker, company_name=ticker)
+        self.calls = []
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patches = [
+            override_settings(PRICE_PANEL_DIR=directory.name),
+            mock.patch('api.tasks.CHUNK_SIZE', 2),
+            mock.patch('api.tasks.redis_client', None),
+            mock.patch('api.tasks.get_limiter', return_value=TokenBucket(rate=100, capacity=100)),
+            mock.patch('api.tasks.listing', return_value=pd.DataFrame({'symbol': ['AAA', 'BBB', 'CCC', 'XY1']})),
+            mock.patch('api.tasks.fetch_many', side_effect=self._fetch_many),
+            mock.patch('api.tasks.run_stock_analysis_task'),
+        ]
+        for patcher in patches:
+            self.enterContext(patcher)
+        self.analysis = tasks.run_stock_analysis_task
+
+    def _fetch_many(self, tickers, fetch_one, **kwargs):
+        # BBB bị rate limit ở lần gọi đầu; CCC không có phiên nào trong ngày
+        self.calls.append(list(tickers))
+        history = lambda: pd.DataFrame({'time': [self.DAY], 'open': [10.0], 'high': [11.0], 'low': [9.5],
+                                        'close': [10.5], 'volume': [1000]})
+        results = []
+        for ticker in tickers:
+            if ticker == 'BBB' and sum('BBB' in call for call in self.calls) == 1:
+                results.append((ticker, None, Exception('429 Too Many Requests')))
+            elif ticker == 'CCC':
+                results.append((ticker, pd.DataFrame(), None))
+            else:
+                results.append((ticker, history(), None))
+        return results
+
+    def test_chunks_retry_rate_limited_and_callback_checks_coverage(self):
+        with mock.patch.object(tasks.finalize_eod_ingestion_task, 'run',
+                               wraps=tasks.finalize_eod_ingestion_task.run) as finalize:
+            summary = tasks.fetch_daily_data_vnstock_task.apply(kwargs={'day_str': self.DAY}).get()
+        self.assertIn('2 chunk', summary)
+
+        # Chunk đầu (AAA, BBB) được retry riêng cho BBB, cộng dồn thống kê qua `carried`
+        self.assertEqual(self.calls, [['AAA', 'BBB'], ['BBB'], ['CCC']])
+        chunk_results = finalize.call_args.args[0]
+        self.assertEqual(chunk_results, [
+            {'tickers': ['AAA', 'BBB'], 'success': 2, 'errors': 0, 'rate_limited': []},
+            {'tickers': ['CCC'], 'success': 0, 'errors': 1, 'rate_limited': []},
+        ])
+        self.assertEqual(sorted(StockData.objects.filter(date=self.DAY).values_list('stock_id', flat=True)),
+                         ['AAA', 'BBB'])
+        self.assertEqual(tasks.finalize_eod_ingestion_task.run(chunk_results, self.DAY),
+                         {'day': self.DAY, 'tickers': 3, 'covered': 2, 'missing': ['CCC']})
+        self.analysis.delay.assert_called_with(incremental=True)
+
+
+class _FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TokenBucketTests(SimpleTestCase):
+    def test_burst_then_steady_rate(self):
+        clock = _FakeClock()
+        bucket = TokenBucket(2, capacity=4, clock=clock, sleep=clock.sleep)
+        for _ in range(4):
+            bucket.acquire()
+        self.assertEqual(clock.now, 0)
+        for _ in range(4):
+            bucket.acquire()
+        self.assertAlmostEqual(clock.now, 2.0)
+
+    def test_rate_limit_backs_off_and_pauses(self):
+        clock = _FakeClock()
+        bucket = TokenBucket(4, capacity=1, min_rate=1, clock=clock, sleep=clock.sleep)
+        self.assertEqual(bucket.on_rate_limited(retry_after=10), 10)
+        self.assertEqual(bucket.rate, 2)
+        # Các lỗi 429 khác trong lúc đang tạm dừng không giảm tốc độ thêm
+        self.assertEqual(bucket.on_rate_limited(), 10)
+        self.assertEqual(bucket.rate, 2)
+        bucket.acquire()
+        self.assertGreaterEqual(clock.now, 10)
+
+
+class _BrokenRedis:
+    def register_script(self, script):
+        def run(keys, args):
+            raise redis.ConnectionError('down')
+        return run
+
+    def pttl(self, key):
+        raise redis.ConnectionError('down')
+
+    def set(self, *args, **kwargs):
+        raise redis.ConnectionError('down')
+
+
+class SharedLimiterTests(SimpleTestCase):
+    def tearDown(self):
+        reset_limiters()
+
+    @override_settings(RATE_LIMIT_BACKEND='memory', PROVIDER_RATE_LIMITS={'vnstock': {'rate': 3, 'burst': 5}})
+    def test_memory_backend_is_shared_per_provider(self):
+        reset_limiters()
+        limiter = get_limiter('vnstock')
+        self.assertIsInstance(limiter, TokenBucket)
+        self.assertIs(get_limiter('vnstock'), limiter)
+        self.assertEqual((limiter.rate, limiter.capacity), (3, 5))
+
+    def test_redis_limiter_falls_back_to_memory(self):
+        limiter = RedisRateLimiter('test', rate=10, burst=2, client=_BrokenRedis())
+        self.assertEqual(limiter.try_acquire(), 0)
+        self.assertEqual(limiter.try_acquire(), 0)
+        self.assertGreater(limiter.try_acquire(), 0)
+        self.assertEqual(limiter.on_rate_limited(retry_after=5), 5)
+        self.assertGreater(limiter.cooldown_remaining(), 4)
+
+
+class FetchManyTests(SimpleTestCase):
+    def test_retries_rate_limited_ticker(self):
+        calls = []
+
+        class RateLimited(Exception):
+            pass
+
+        def fetch_one(ticker):
+            calls.append(ticker)
+            if ticker == 'BBB' and calls.count('BBB') == 1:
+                raise RateLimited('429 Too Many Requests')
+            return ticker.lower()
+
+        bucket = TokenBucket(1000, capacity=10, base_cooldown=0.01)
+        results = {ticker: (value, error) for ticker, value, error in
+                   fetch_many(['AAA', 'BBB', 'CCC'], fetch_one, limiter=bucket, workers=2)}
+        self.assertEqual(results, {'AAA': ('aaa', None), 'BBB': ('bbb', None), 'CCC': ('ccc', None)})
+        self.assertEqual(calls.count('BBB'), 2)
+
+
+class ProviderCacheTests(SimpleTestCase):
+    def test_read_write_then_replay(self):
+        calls = []
+
+        def history(symbol):
+            calls.append(symbol)
+            return pd.DataFrame({'close': [1.0, 2.0]})
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ProviderCache(directory, mode='read-write')
+            first = cache.fetch('vnstock', {'symbol': 'AAA'}, history, 'AAA')
+            again = cache.fetch('vnstock', {'symbol': 'AAA'}, history, 'AAA')
+            cache.fetch('vnstock', {'symbol': 'BBB'}, history, 'BBB')
+            pd.testing.assert_frame_equal(first, again)
+            self.assertEqual(calls, ['AAA', 'BBB'])
+            # Cùng nội dung -> một object dùng chung
+            self.assertEqual(len(cache._objects()), 1)
+            self.assertEqual(cache.fetch('vnstock', {'symbol': 'AAA'}, history, 'AAA', ttl=0).shape, (2, 1))
+            self.assertEqual(calls, ['AAA', 'BBB', 'AAA'])
+
+            replay = ProviderCache(directory, mode='replay', ttl=0)
+            pd.testing.assert_frame_equal(replay.fetch('vnstock', {'symbol': 'BBB'}, history, 'BBB'), first)
+            with self.assertRaises(ProviderCacheMiss):
+                replay.fetch('vnstock', {'symbol': 'CCC'}, history, 'CCC')
+            self.assertEqual(len(calls), 3)
+
+    def test_quote_history_ttl_follows_market_date(self):
+        # 00:30 giờ Việt Nam ngày 03/01 là 17:30 UTC ngày 02/01: phiên 03/01 vẫn là "hôm nay"
+        with mock.patch('api.vnstock_fetcher.market_today', return_value=date(2024, 1, 3)), \
+                mock.patch('api.vnstock_fetcher.cached_call') as cached_call:
+            quote_history('AAA', '2024-01-01', '2024-01-03')
+            quote_history('AAA', '2023-12-01', '2024-01-02')
+        self.assertEqual([call.kwargs['ttl'] for call in cached_call.call_args_list], [0, None])
+
+    def test_evicts_least_recently_used(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ProviderCache(directory, mode='read-write', max_bytes=2500)
+            payload = lambda n: np.random.default_rng(n).bytes(1000)
+            for n in range(3):
+                cache.fetch('ssi', {'page': n}, payload, n)
+            self.assertEqual(cache.get('ssi', {'page': 0}), (False, None))
+            self.assertTrue(cache.get('ssi', {'page': 2})[0])
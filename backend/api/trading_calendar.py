@@ -0,0 +1,153 @@
+# backend/api/trading_calendar.py
+"""
+Lịch giao dịch của HOSE/HNX: phiên là ngày thứ Hai–thứ Sáu không rơi vào ngày nghỉ lễ của sàn.
+
+Ngày nghỉ được liệt kê theo thông báo của sàn cho từng năm trong HOSE_HOLIDAYS (Tết Âm lịch, Giỗ Tổ
+Hùng Vương, ngày nghỉ bù...); năm chưa có trong bảng chỉ tính các ngày lễ dương lịch cố định, nên hàng năm
+cần bổ sung lịch nghỉ mới. Bảng chỉ ghi những ngày chắc chắn đóng cửa: thiếu một ngày nghỉ chỉ tốn một lần
+gọi API thừa, còn ghi nhầm một phiên thành ngày nghỉ sẽ làm bỏ sót dữ liệu.
+
+Các phép tra cứu (is_trading_day, previous_session, sessions_between...) dùng np.busdaycalendar dựng một lần,
+không truy vấn database.
+"""
+
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+MARKET_TZ = ZoneInfo('Asia/Ho_Chi_Minh')
+WEEKMASK = '1111100'
+
+# Tết Dương lịch, Giải phóng miền Nam, Quốc tế Lao động, Quốc khánh (dùng cho năm chưa có trong bảng)
+FIXED_HOLIDAYS = ((1, 1), (4, 30), (5, 1), (9, 2))
+
+# Ngày nghỉ rơi vào ngày làm việc, kể cả nghỉ bù (ngày thứ Bảy / Chủ nhật không cần ghi)
+HOSE_HOLIDAYS = {
+    2018: ['2018-01-01', '2018-02-14', '2018-02-15', '2018-02-16', '2018-02-19', '2018-02-20', '2018-04-25',
+           '2018-04-30', '2018-05-01', '2018-09-03'],
+    2019: ['2019-01-01', '2019-02-04', '2019-02-05', '2019-02-06', '2019-02-07', '2019-02-08', '2019-04-15',
+           '2019-04-29', '2019-04-30', '2019-05-01', '2019-09-02'],
+    2020: ['2020-01-01', '2020-01-23', '2020-01-24', '2020-01-27', '2020-01-28', '2020-01-29', '2020-04-02',
+           '2020-04-30', '2020-05-01', '2020-09-02'],
+    2021: ['2021-01-01', '2021-02-10', '2021-02-11', '2021-02-12', '2021-02-15', '2021-02-16', '2021-04-21',
+           '2021-04-30', '2021-05-03', '2021-09-02', '2021-09-03'],
+    2022: ['2022-01-03', '2022-01-31', '2022-02-01', '2022-02-02', '2022-02-03', '2022-02-04', '2022-04-11',
+           '2022-05-02', '2022-05-03', '2022-09-01', '2022-09-02'],
+    2023: ['2023-01-02', '2023-01-20', '2023-01-23', '2023-01-24', '2023-01-25', '2023-01-26', '2023-05-01',
+           '2023-05-02', '2023-05-03', '2023-09-01', '2023-09-04'],
+    2024: ['2024-01-01', '2024-02-08', '2024-02-09', '2024-02-12', '2024-02-13', '2024-02-14', '2024-04-18',
+           '2024-04-29', '2024-04-30', '2024-05-01', '2024-09-02', '2024-09-03'],
+    2025: ['2025-01-01', '2025-01-27', '2025-01-28', '2025-01-29', '2025-01-30', '2025-01-31', '2025-04-07',
+           '2025-04-30', '2025-05-01', '2025-05-02', '2025-09-01', '2025-09-02'],
+    2026: ['2026-01-01', '2026-02-16', '2026-02-17', '2026-02-18', '2026-02-19', '2026-02-20', '2026-04-27',
+           '2026-04-30', '2026-05-01', '2026-09-02'],
+}
+
+CALENDAR_START_YEAR = 2000
+
+
+def _to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def holidays(first_year, last_year):
+    """Danh sách ngày nghỉ (date) của sàn trong các năm [first_year, last_year]."""
+    days = []
+    for year in range(first_year, last_year + 1):
+        if year in HOSE_HOLIDAYS:
+            days.extend(date.fromisoformat(day) for day in HOSE_HOLIDAYS[year])
+        else:
+            days.extend(date(year, month, day) for month, day in FIXED_HOLIDAYS)
+    return days
+
+
+class TradingCalendar:
+    """Tra cứu phiên giao dịch; mọi hàm nhận date / datetime / chuỗi 'YYYY-MM-DD' và trả về date."""
+
+    def __init__(self, holiday_dates=()):
+        self._calendar = np.busdaycalendar(weekmask=WEEKMASK,
+                                           holidays=np.array(sorted(holiday_dates), dtype='datetime64[D]'))
+
+    def is_trading_day(self, day):
+        return bool(np.is_busday(np.datetime64(_to_date(day), 'D'), busdaycal=self._calendar))
+
+    def previous_session(self, day, inclusive=False):
+        """Phiên gần nhất trước `day` (hoặc chính `day` nếu inclusive và là phiên)."""
+        day = _to_date(day) if inclusive else _to_date(day) - timedelta(days=1)
+        return np.busday_offset(day, 0, roll='backward', busdaycal=self._calendar).astype(object)
+
+    def next_session(self, day, inclusive=False):
+        """Phiên gần nhất sau `day` (hoặc chính `day` nếu inclusive và là phiên)."""
+        day = _to_date(day) if inclusive else _to_date(day) + timedelta(days=1)
+        return np.busday_offset(day, 0, roll='forward', busdaycal=self._calendar).astype(object)
+
+    def sessions_between(self, start, end):
+        """Các phiên trong [start, end] (cả hai đầu), tăng dần."""
+        start, end = _to_date(start), _to_date(end)
+        if start > end:
+            return []
+        days = np.arange(start, end + timedelta(days=1), dtype='datetime64[D]')
+        return days[np.is_busday(days, busdaycal=self._calendar)].astype(object).tolist()
+
+    def session_count(self, start, end):
+        """Số phiên trong [start, end]."""
+        start, end = _to_date(start), _to_date(end)
+        if start > end:
+            return 0
+        return int(np.busday_count(start, end + timedelta(days=1), busdaycal=self._calendar))
+
+    def session_range(self, start, end):
+        """(phiên đầu, phiên cuối) của [start, end]; None nếu khoảng không có phiên nào (cuối tuần, Tết...)."""
+        first, last = self.next_session(start, inclusive=True), self.previous_session(end, inclusive=True)
+        return (first, last) if first <= last else None
+
+    def window_start(self, end, sessions):
+        """Phiên đầu tiên của cửa sổ `sessions` phiên kết thúc tại phiên cuối <= end."""
+        last = self.previous_session(end, inclusive=True)
+        return np.busday_offset(last, -(sessions - 1), roll='backward', busdaycal=self._calendar).astype(object)
+
+
+def market_today():
+    """Ngày hiện tại theo giờ Việt Nam (server chạy UTC)."""
+    return datetime.now(MARKET_TZ).date()
+
+
+@lru_cache(maxsize=4)
+def _calendar_until(last_year):
+    return TradingCalendar(holidays(CALENDAR_START_YEAR, last_year))
+
+
+def get_calendar():
+    """TradingCalendar dùng chung, gồm ngày nghỉ tới hết năm sau năm hiện tại."""
+    return _calendar_until(max(market_today().year, max(HOSE_HOLIDAYS)) + 1)
+
+
+def is_trading_day(day):
+    return get_calendar().is_trading_day(day)
+
+
+def previous_session(day, inclusive=False):
+    return get_calendar().previous_session(day, inclusive)
+
+
+def next_session(day, inclusive=False):
+    return get_calendar().next_session(day, inclusive)
+
+
+def sessions_between(start, end):
+    return get_calendar().sessions_between(start, end)
+
+
+def session_range(start, end):
+    return get_calendar().session_range(start, end)
+
+
+def latest_session(day=None):
+    """Phiên gần nhất tính tới `day` (mặc định hôm nay theo giờ Việt Nam), kể cả chính ngày đó."""
+    return get_calendar().previous_session(day or market_today(), inclusive=True)
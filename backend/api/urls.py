@@ -6,7 +6,9 @@ from .views import (RegisterAPIView,
                     WatchlistDeleteView,
                     ArticleListAPIView,
                     StockScreenerAPIView,
-                    StockSearchAPIView)
+                    StockSearchAPIView,
+                    BacktestRunListCreateView,
+                    BacktestRunDetailAPIView)
 from rest_framework.routers import DefaultRouter
 from rest_framework.authtoken.views import obtain_auth_token
 
@@ -30,4 +32,7 @@ urlpatterns = [
 
     path('screener/', StockScreenerAPIView.as_view(), name='stock-screener'),
 
+    path('backtests/', BacktestRunListCreateView.as_view(), name='backtest-list-create'),
+    path('backtests/<str:key>/', BacktestRunDetailAPIView.as_view(), name='backtest-detail'),
+
 ]
\ No newline at end of file
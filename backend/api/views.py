@@ -1,6 +1,9 @@
 # api/views.py
 
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.http import QueryDict
+from django.utils import timezone
 from django.db.models import Q
 from django.db.models.functions import Length
 from rest_framework import generics, status
@@ -10,14 +13,17 @@ from rest_framework.views import APIView
 import pandas as pd
 import pandas_ta as ta
 
-from .models import Stock, StockData, Watchlist, PotentialStock, Article
+from .backtest_runs import get_or_create_run, is_stale, run_payload
+from .models import Stock, StockData, Watchlist, PotentialStock, Article, BacktestRun
 from .pagination import StandardResultsSetPagination
+from .price_panel import get_price_panel
 from .serializers import (
     RegisterSerializer, StockSerializer, WatchlistSerializer,
-    ArticleSerializer, PotentialStockSerializer, StockDataSerializer
+    ArticleSerializer, PotentialStockSerializer, StockDataSerializer, BacktestRunSerializer
 )
-# Import hàm lấp đầy khoảng trống
-from ssi_integration.services import update_historical_data
+from .tasks import run_backtest_task
+# Lấp đầy khoảng trống dữ liệu ở nền (stale-while-revalidate)
+from ssi_integration.tasks import schedule_refresh
 
 
 # ==============================================================================
@@ -122,27 +128,48 @@ class StockSearchAPIView(generics.ListAPIView):
 # ==============================================================================
 
 class StockDataAPIView(APIView):
+    """
+    Dữ liệu giá + chỉ báo cho biểu đồ. Trả ngay dữ liệu đang có; việc lấp khoảng trống từ SSI chạy ở nền
+    (ssi_integration.tasks.schedule_refresh). Độ mới của dữ liệu nằm trong các header:
+    X-Data-As-Of (phiên cuối được trả về), X-Data-Checked-At (lần lấy SSI gần nhất), X-Data-Refresh (trạng thái refresh).
+    """
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
         ticker_symbol = request.query_params.get('ticker', 'FPT').upper()
 
         try:
-            # BƯỚC 1: Lấp đầy khoảng trống dữ liệu bằng cách gọi API SSI
-            update_historical_data(ticker_symbol)
-
-            # BƯỚC 2: Truy vấn toàn bộ dữ liệu (cũ + mới) từ database
-            queryset = StockData.objects.filter(stock__ticker=ticker_symbol).order_by('date')
-
-            if not queryset.exists():
-                return Response(
-                    {"error": f"Không tìm thấy dữ liệu cho mã {ticker_symbol} trong database."},
-                    status=status.HTTP_404_NOT_FOUND)
-
-            # BƯỚC 3: Chuyển dữ liệu sang Pandas DataFrame để tính toán
-            # Quan trọng: Dùng serializer để lấy đúng kiểu dữ liệu (Decimal -> float)
-            serializer = StockDataSerializer(queryset, many=True)
-            df = pd.DataFrame(serializer.data)
+            # BƯỚC 1: Đưa refresh từ SSI vào hàng đợi (tối đa một refresh mỗi mã), không chờ kết quả
+            refresh_state, coverage = schedule_refresh(ticker_symbol)
+            if coverage is None:
+                return Response({"error": f"Mã {ticker_symbol} không tồn tại trong database."},
+                                status=status.HTTP_404_NOT_FOUND)
+
+            # BƯỚC 2: Lấy toàn bộ lịch sử (cũ + mới) từ price panel, không tạo đối tượng ORM cho từng dòng.
+            # Không dựng panel trong request; panel thiếu phiên cuối đã lưu của mã (ví dụ sau seed/import) bị bỏ qua
+            panel = get_price_panel(validate=False, build=False)
+            df = panel.ticker_frame(ticker_symbol) if panel is not None else None
+            if df is not None and (df.empty or (coverage.last_date is not None
+                                                and df['date'].iloc[-1] < pd.Timestamp(coverage.last_date))):
+                df = None
+            if df is not None:
+                df['date'] = df['date'].astype(str)
+                # Panel lưu giá float32, làm tròn lại để trả về giống giá trị gốc trong database
+                df[['open', 'high', 'low', 'close']] = df[['open', 'high', 'low', 'close']].round(2)
+                df['volume'] = df['volume'].astype('int64')
+            else:
+                # BƯỚC 3: Mã chưa có trong panel (hoặc panel cũ hơn database) -> đọc trực tiếp từ database
+                queryset = StockData.objects.filter(stock__ticker=ticker_symbol).order_by('date')
+
+                if not queryset.exists():
+                    message = f"Không tìm thấy dữ liệu cho mã {ticker_symbol} trong database."
+                    if refresh_state in ('queued', 'in-flight'):
+                        message += " Dữ liệu đang được tải từ SSI, vui lòng thử lại sau."
+                    return Response({"error": message}, status=status.HTTP_404_NOT_FOUND)
+
+                # Quan trọng: Dùng serializer để lấy đúng kiểu dữ liệu (Decimal -> float)
+                serializer = StockDataSerializer(queryset, many=True)
+                df = pd.DataFrame(serializer.data)
 
             # Đảm bảo các cột có đúng kiểu dữ liệu số
             ohlcv_columns = ['open', 'high', 'low', 'close', 'volume']
@@ -163,7 +190,11 @@ class StockDataAPIView(APIView):
 
             # Chuyển DataFrame thành danh sách các dictionary để trả về JSON
             data = df.to_dict(orient='records')
-            return Response(data)
+            response = Response(data)
+            response['X-Data-As-Of'] = str(df['date'].iloc[-1]) if len(df) else ''
+            response['X-Data-Checked-At'] = coverage.last_fetched_at.isoformat() if coverage.last_fetched_at else ''
+            response['X-Data-Refresh'] = refresh_state
+            return response
 
         except Exception as e:
             # Ghi lại lỗi chi tiết để debug
@@ -171,4 +202,74 @@ class StockDataAPIView(APIView):
             import traceback
             traceback.print_exc()
             return Response({"error": f"Đã xảy ra lỗi không xác định: {str(e)}"},
-                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+# ==============================================================================
+# BACKTEST VIEWS (KẾT QUẢ LƯU THEO ĐỊA CHỈ NỘI DUNG)
+# ==============================================================================
+
+BACKTEST_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+class BacktestRunListCreateView(APIView):
+    """
+    GET: danh sách các lần backtest đã lưu.
+    POST: gửi cấu hình (các khoá trong backtest_runs.DEFAULT_CONFIG, thiếu thì lấy mặc định).
+    Nếu cùng cấu hình đã chạy trên dữ liệu hiện tại thì trả kết quả sẵn có (200),
+    ngược lại tạo bản ghi mới và đưa vào hàng đợi Celery (202). Nhận cả JSON lẫn dữ liệu form.
+    Lần chạy lỗi, hoặc PENDING/RUNNING đã mất heartbeat (backtest_runs.is_stale), được giao lại.
+    Lưu ý: khi CELERY_TASK_ALWAYS_EAGER bật (mặc định lúc phát triển, không có worker) backtest chạy ngay trong
+    request và POST trả luôn kết quả (200); production cần đặt False để mô phỏng chạy trên worker.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        queryset = BacktestRun.objects.defer('equity_curve', 'trades')
+        run_status = request.query_params.get('status')
+        if run_status:
+            queryset = queryset.filter(status=run_status.upper())
+        paginator = StandardResultsSetPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        return paginator.get_paginated_response(BacktestRunSerializer(page, many=True).data)
+
+    def post(self, request):
+        try:
+            config = request.data.dict() if isinstance(request.data, QueryDict) else request.data
+            run, created = get_or_create_run(config)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if run.status == BacktestRun.StatusChoices.DONE:
+            return Response(run_payload(run), status=status.HTTP_200_OK)
+        if created or run.status == BacktestRun.StatusChoices.FAILED or is_stale(run):
+            # Chỉ request đổi được trạng thái đã đọc (status + updated_at) mới giao task: không chạy trùng khi
+            # nhiều request tới cùng lúc
+            claimed = BacktestRun.objects.filter(key=run.key, status=run.status, updated_at=run.updated_at).update(
+                status=BacktestRun.StatusChoices.PENDING, updated_at=timezone.now())
+            if claimed:
+                run_backtest_task.delay(run.key)
+            run.refresh_from_db()
+            if run.status == BacktestRun.StatusChoices.DONE:  # Celery chạy eager
+                return Response(run_payload(run), status=status.HTTP_200_OK)
+        return Response(BacktestRunSerializer(run).data, status=status.HTTP_202_ACCEPTED)
+
+
+class BacktestRunDetailAPIView(APIView):
+    """Kết quả đầy đủ (chỉ số, đường vốn, sổ lệnh) của một lần backtest theo khoá."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, key):
+        cache_key = f'backtest_run:{key}'
+        payload = cache.get(cache_key)
+        if payload is not None:
+            return Response(payload)
+
+        run = BacktestRun.objects.filter(key=key).first()
+        if run is None:
+            return Response({"error": f"Không tìm thấy backtest {key}."}, status=status.HTTP_404_NOT_FOUND)
+        payload = run_payload(run)
+        # Khoá gắn với nội dung nên kết quả đã xong không bao giờ đổi -> cache được
+        if run.status == BacktestRun.StatusChoices.DONE:
+            cache.set(cache_key, payload, BACKTEST_CACHE_TIMEOUT)
+        return Response(payload)
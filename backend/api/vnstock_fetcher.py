@@ -0,0 +1,108 @@
+# backend/api/vnstock_fetcher.py
+"""
+Lấy dữ liệu vnstock cho nhiều mã song song với số luồng giới hạn.
+
+Mỗi yêu cầu phải lấy token từ bộ giới hạn tốc độ dùng chung (api.rate_limit.get_limiter('vnstock'), chung cho
+mọi worker qua Redis), nên số luồng chỉ quyết định số yêu cầu đang chờ phản hồi cùng lúc, còn tốc độ gọi do bộ
+giới hạn điều khiển. Kết quả được trả về luồng gọi (theo thứ tự hoàn thành) để việc ghi database vẫn diễn ra
+trên một luồng duy nhất.
+"""
+
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from vnstock import Listing, Quote
+
+from .provider_cache import cached_call, has_data
+from .rate_limit import get_limiter, is_rate_limit_error, retry_after_seconds
+from .trading_calendar import market_today
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+
+MAX_GENERAL_RETRIES = 2
+MAX_RATE_LIMIT_RETRIES = 30
+RETRY_DELAY = 2
+
+# Danh sách mã đổi chậm: giữ bản lưu trong provider cache tối đa 1 ngày
+LISTING_CACHE_TTL = 24 * 3600
+
+
+def quote_history(ticker, start, end, limiter=None, interval='1D'):
+    """Quote(ticker).history(start, end) qua provider cache; limiter chỉ lấy token khi thực sự gọi vnstock."""
+    start, end = str(start), str(end)
+    params = {'call': 'Quote.history', 'symbol': ticker, 'start': start, 'end': end, 'interval': interval}
+    # Khoảng tới hôm nay (giờ Việt Nam) còn đổi: luôn gọi mới (vẫn lưu để replay), khoảng đã qua dùng TTL mặc định
+    ttl = 0 if end >= market_today().isoformat() else None
+    return cached_call('vnstock', params,
+                       lambda: Quote(symbol=ticker).history(start=start, end=end, interval=interval),
+                       limiter=limiter, ttl=ttl, cacheable=has_data)
+
+
+def listing(method):
+    """Listing().<method>() (all_symbols, symbols_by_exchange...) qua provider cache."""
+    return cached_call('vnstock', {'call': f'Listing.{method}'}, lambda: getattr(Listing(), method)(),
+                       limiter=get_limiter('vnstock'), ttl=LISTING_CACHE_TTL, cacheable=has_data)
+
+
+def _fetch_with_retries(ticker, fetch_one, limiter, max_general_retries, max_rate_limit_retries, retry_delay,
+                        acquire):
+    general_retry_count = 0
+    rate_limit_retry_count = 0
+    while True:
+        if acquire:
+            limiter.acquire()
+        try:
+            result = fetch_one(ticker)
+        except Exception as e:
+            if is_rate_limit_error(e):
+                rate_limit_retry_count += 1
+                wait_time = limiter.on_rate_limited(retry_after_seconds(e))
+                logger.warning(f"⚠️ Rate limit cho {ticker}. Tạm dừng {wait_time:.0f}s (lần {rate_limit_retry_count}).")
+                if rate_limit_retry_count >= max_rate_limit_retries:
+                    return ticker, None, e
+            else:
+                general_retry_count += 1
+                if general_retry_count >= max_general_retries:
+                    return ticker, None, e
+                logger.warning(f"Lỗi tạm thời cho {ticker}: {str(e)[:200]}... Retry sau {retry_delay}s.")
+                time.sleep(retry_delay)
+            continue
+        limiter.on_success()
+        return ticker, result, None
+
+
+def fetch_many(tickers, fetch_one, limiter=None, workers=DEFAULT_WORKERS, max_general_retries=MAX_GENERAL_RETRIES,
+               max_rate_limit_retries=MAX_RATE_LIMIT_RETRIES, retry_delay=RETRY_DELAY, acquire=True):
+    """
+    Gọi fetch_one(ticker) cho mọi mã, tối đa `workers` yêu cầu cùng lúc; yield (ticker, kết quả, lỗi)
+    theo thứ tự hoàn thành (lỗi là None khi thành công).
+    - limiter: bộ giới hạn tốc độ (acquire / on_success / on_rate_limited), mặc định get_limiter('vnstock').
+    - acquire=False: fetch_one tự lấy token khi thực sự gọi mạng (ví dụ qua api.provider_cache, để phản hồi
+      đã lưu không phải chờ bộ giới hạn); fetch_many vẫn báo thành công / 429 cho limiter.
+    Dừng vòng lặp sớm (break / close generator) sẽ huỷ các mã chưa bắt đầu.
+    """
+    limiter = limiter or get_limiter('vnstock')
+    tickers = iter(tickers)
+    args = (fetch_one, limiter, max_general_retries, max_rate_limit_retries, retry_delay, acquire)
+    executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='vnstock-fetch')
+    pending = set()
+    try:
+        # Chỉ nộp tối đa `workers` tác vụ một lúc để dừng sớm không phải huỷ cả danh sách
+        for ticker in tickers:
+            pending.add(executor.submit(_fetch_with_retries, ticker, *args))
+            if len(pending) >= workers:
+                break
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                ticker = next(tickers, None)
+                if ticker is not None:
+                    pending.add(executor.submit(_fetch_with_retries, ticker, *args))
+                yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
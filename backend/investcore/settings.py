@@ -96,6 +96,18 @@ DATABASES = {
         'PASSWORD': config('DB_PASSWORD'),
         'HOST': config('DB_HOST'),
         'PORT': config('DB_PORT'),
+        # Cho phép api.bulk_loader nạp bằng LOAD DATA LOCAL INFILE (server cũng phải bật local_infile)
+        'OPTIONS': {'local_infile': config('DB_LOCAL_INFILE', default=0, cast=int)},
+    }
+}
+
+
+# Cache dùng chung (Redis) cho các kết quả tính toán lặp lại giữa các lần chạy / request
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': config('REDIS_URL'),
+        'KEY_PREFIX': 'investcore',
     }
 }
 
@@ -122,6 +134,8 @@ CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
     "http://127.0.0.1:3000",
 ]
+# Header độ mới dữ liệu của StockDataAPIView để frontend đọc được
+CORS_EXPOSE_HEADERS = ['X-Data-As-Of', 'X-Data-Checked-At', 'X-Data-Refresh']
 
 # CẤU HÌNH CHO DJANGO REST FRAMEWORK
 REST_FRAMEWORK = {
@@ -157,6 +171,33 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Thư mục chứa price panel (các mảng OHLCV dạng cột dùng chung, xem api/price_panel.py)
+PRICE_PANEL_DIR = Path(config('PRICE_PANEL_DIR', default=str(BASE_DIR / 'var' / 'price_panel')))
+
+# Giới hạn tốc độ gọi nhà cung cấp dữ liệu, dùng chung cho mọi worker / lệnh qua Redis (xem api/rate_limit.py).
+# rate: số yêu cầu/giây (đặt ngay dưới giới hạn của nhà cung cấp), burst: số yêu cầu được gọi dồn.
+RATE_LIMIT_BACKEND = config('RATE_LIMIT_BACKEND', default='redis')  # 'redis' hoặc 'memory'
+RATE_LIMIT_REDIS_URL = config('RATE_LIMIT_REDIS_URL', default=config('REDIS_URL'))
+PROVIDER_RATE_LIMITS = {
+    'vnstock': {
+        'rate': config('VNSTOCK_RATE_LIMIT', default=1.5, cast=float),
+        'burst': config('VNSTOCK_RATE_BURST', default=4, cast=int),
+    },
+    'ssi': {
+        'rate': config('SSI_RATE_LIMIT', default=1.0, cast=float),
+        'burst': config('SSI_RATE_BURST', default=2, cast=int),
+    },
+}
+
+# Cache phản hồi thô của vnstock / SSI / Firecrawl trên đĩa (api.provider_cache).
+# MODE: 'off' | 'read-write' (dùng lại phản hồi còn hạn) | 'replay' (chỉ đọc cache, chạy offline)
+PROVIDER_CACHE = {
+    'MODE': config('PROVIDER_CACHE_MODE', default='off'),
+    'DIR': config('PROVIDER_CACHE_DIR', default=str(BASE_DIR / 'var' / 'provider_cache')),
+    'TTL': config('PROVIDER_CACHE_TTL', default=7 * 24 * 3600, cast=int),  # giây
+    'MAX_BYTES': config('PROVIDER_CACHE_MAX_MB', default=2048, cast=int) * 1024 * 1024,
+}
+
 # ==============================================================================
 # CELERY SETTINGS
 # ==============================================================================
@@ -166,9 +207,18 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Asia/Ho_Chi_Minh' # Đặt múi giờ Việt Nam
-CELERY_TASK_ALWAYS_EAGER = True
+# Eager (chạy task ngay trong process gọi) tiện khi phát triển không có worker; đặt False khi đã chạy worker.
+# Khi eager, refresh nền của StockDataAPIView bị bỏ qua (không gọi SSI trong request) và backtest gửi qua API
+# chạy ngay trong request
+CELERY_TASK_ALWAYS_EAGER = config('CELERY_TASK_ALWAYS_EAGER', default=True, cast=bool)
 CELERY_TASK_EAGER_PROPAGATES = True
 
+# Subtask lấy EOD theo chunk chạy trên queue riêng để không chiếm worker của các task khác:
+#   celery -A investcore worker -Q ingestion -c 4
+CELERY_TASK_ROUTES = {
+    'api.tasks.fetch_eod_chunk_task': {'queue': 'ingestion'},
+}
+
 # Cấu hình cho Celery Beat
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
 
@@ -183,10 +233,6 @@ CELERY_BEAT_SCHEDULE = {
         'schedule': crontab(hour=17, minute=0, day_of_week='mon-fri'),
         'options': {'expires': 3600},
     },
-    'run-stock-analysis-daily': {
-        'task': 'api.tasks.run_stock_analysis_task',
-        'schedule': crontab(hour=18, minute=0, day_of_week='mon-fri'),
-    },
 }
 
 
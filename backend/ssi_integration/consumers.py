@@ -1,6 +1,7 @@
 # ssi_integration/consumers.py
 
 import json
+import math
 import threading
 import time  # Thêm import time
 from asgiref.sync import async_to_sync
@@ -8,6 +9,9 @@ from channels.generic.websocket import WebsocketConsumer
 from ssi_fc_data.fc_md_stream import MarketDataStream
 from ssi_fc_data.fc_md_client import MarketDataClient
 from .ssi_config import get_ssi_config
+from api.rate_limit import get_limiter
+
+RATE_LIMITED_CLOSE_CODE = 4429  # mã đóng websocket riêng của ứng dụng (4000-4999)
 
 
 class StockDataConsumer(WebsocketConsumer):
@@ -22,6 +26,16 @@ class StockDataConsumer(WebsocketConsumer):
         )
         self.accept()
 
+        # Mở stream cũng gọi API xác thực của SSI -> dùng chung giới hạn tốc độ, nhưng không chờ token trong
+        # handler kết nối: hết lượt thì báo lỗi cho client và đóng kết nối
+        wait = get_limiter('ssi').try_acquire()
+        if wait > 0:
+            print(f"SSI rate limit, không mở stream cho {self.ticker} (thử lại sau {wait:.1f}s)")
+            self.is_running = False
+            self.send(text_data=json.dumps({'error': 'rate_limited', 'retry_after': math.ceil(wait)}))
+            self.close(code=RATE_LIMITED_CLOSE_CODE)
+            return
+
         self.ssi_stream_thread = threading.Thread(target=self.start_ssi_stream)
         self.ssi_stream_thread.daemon = True
         self.ssi_stream_thread.start()
@@ -0,0 +1,45 @@
+# ssi_integration/management/commands/ssi_gap_fill.py
+
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+from ssi_integration.services import GAP_FILL_WORKERS, gap_fill_market
+from ssi_integration.tasks import gap_fill_market_task
+
+
+def _date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+class Command(BaseCommand):
+    help = ('Fills missing daily OHLC history for many tickers from SSI FastConnect, grouping tickers by missing '
+            'date range and fetching concurrently with one authenticated client.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('tickers', nargs='*', help='Tickers to fill (default: every valid ticker in the DB).')
+        parser.add_argument('--start', type=_date, default=None, help='First date to cover (default: 5 years ago).')
+        parser.add_argument('--end', type=_date, default=None, help='Last date to cover (default: today).')
+        parser.add_argument('--workers', type=int, default=GAP_FILL_WORKERS,
+                            help=f'Number of concurrent SSI requests (default: {GAP_FILL_WORKERS}).')
+        parser.add_argument('--revalidate', action='store_true',
+                            help='Re-fetch every session in the range, including stored ones, and overwrite rows '
+                                 'whose OHLCV changed (provider corrections).')
+        parser.add_argument('--async', action='store_true', dest='run_async',
+                            help='Queue a Celery task instead of running in this process.')
+
+    def handle(self, *args, **options):
+        tickers = [ticker.upper() for ticker in options['tickers']] or None
+        if options['run_async']:
+            result = gap_fill_market_task.delay(
+                tickers=tickers, workers=options['workers'], revalidate=options['revalidate'],
+                start=options['start'].isoformat() if options['start'] else None,
+                end=options['end'].isoformat() if options['end'] else None)
+            self.stdout.write(self.style.SUCCESS(f"Đã đưa task gap-fill vào hàng đợi (id {result.id})."))
+            return
+
+        self.stdout.write(self.style.SUCCESS("=== Bổ sung dữ liệu thiếu từ SSI ==="))
+        summary = gap_fill_market(tickers=tickers, start=options['start'], end=options['end'],
+                                  workers=options['workers'], log=self.stdout.write, revalidate=options['revalidate'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Xong: {summary['tickers']} mã, {summary['ranges']} khoảng ngày, {summary['rows']} dòng đã ghi, "
+            f"{summary['errors']} lỗi."))
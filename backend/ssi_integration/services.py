@@ -1,11 +1,28 @@
 # ssi_integration/services.py
 
-from datetime import date, timedelta
-from django.utils import timezone
+import threading
+from collections import defaultdict
+from dataclasses import asdict
+from datetime import timedelta
+
+import pandas as pd
+from django.db import transaction
 from ssi_fc_data.fc_md_client import MarketDataClient
 from ssi_fc_data.model.model import daily_ohlc
 from .ssi_config import get_ssi_config
-from api.models import Stock, StockData
+from api.bulk_loader import load_price_frame, prepare_price_frame
+from api.coverage import coverage_map, plan_fetches, record_fetch, record_fetches
+from api.models import Stock, TickerCoverage
+from api.provider_cache import cached_call
+from api.rate_limit import call_limited, get_limiter, is_rate_limit_error
+from api.trading_calendar import get_calendar, market_today
+from api.vnstock_fetcher import fetch_many
+
+# --- Gap-fill toàn thị trường ---
+GAP_FILL_WORKERS = 4
+GAP_FILL_PAGE_SIZE = 1000
+GAP_FILL_LOOKBACK_DAYS = 365 * 5
+GAP_FILL_BATCH_ROWS = 50000
 
 
 def update_historical_data(ticker: str):
@@ -13,27 +30,28 @@ def update_historical_data(ticker: str):
     Kiểm tra và cập nhật dữ liệu lịch sử bị thiếu cho một mã cổ phiếu.
     """
     print("\n" + "=" * 20 + f" BẮT ĐẦU CẬP NHẬT CHO {ticker} " + "=" * 20)
-    try:
-        stock = Stock.objects.get(ticker=ticker)
-    except Stock.DoesNotExist:
+    if not Stock.objects.filter(ticker=ticker).exists():
         print(f"[DEBUG] Lỗi: Mã {ticker} không tồn tại trong database.")
         print("=" * 60 + "\n")
         return
 
-    last_entry = StockData.objects.filter(stock=stock).order_by('-date').first()
-    today = timezone.now().date()
-    print(f"[DEBUG] Ngày hôm nay (theo server): {today.strftime('%Y-%m-%d')}")
+    # Ngày cuối đã có lấy từ độ phủ đã ghi nhận (TickerCoverage) thay vì truy vấn StockData
+    last_date = coverage_map([ticker])[ticker].last_date
+    # Chỉ lấy theo phiên giao dịch: cuối tuần / ngày nghỉ lễ không tạo lời gọi API
+    calendar = get_calendar()
+    today = calendar.previous_session(market_today(), inclusive=True)
+    print(f"[DEBUG] Phiên giao dịch gần nhất: {today.strftime('%Y-%m-%d')}")
 
-    if last_entry:
-        from_date = last_entry.date + timedelta(days=1)
-        print(f"[DEBUG] Ngày dữ liệu cuối cùng trong DB: {last_entry.date.strftime('%Y-%m-%d')}")
-        print(f"[DEBUG] Sẽ bắt đầu lấy dữ liệu từ ngày: {from_date.strftime('%Y-%m-%d')}")
+    if last_date:
+        from_date = calendar.next_session(last_date)
+        print(f"[DEBUG] Ngày dữ liệu cuối cùng trong DB: {last_date.strftime('%Y-%m-%d')}")
+        print(f"[DEBUG] Sẽ bắt đầu lấy dữ liệu từ phiên: {from_date.strftime('%Y-%m-%d')}")
     else:
-        from_date = today - timedelta(days=365 * 5)
-        print(f"[DEBUG] Không có dữ liệu trong DB. Sẽ bắt đầu lấy dữ liệu từ ngày: {from_date.strftime('%Y-%m-%d')}")
+        from_date = calendar.next_session(today - timedelta(days=365 * 5), inclusive=True)
+        print(f"[DEBUG] Không có dữ liệu trong DB. Sẽ bắt đầu lấy dữ liệu từ phiên: {from_date.strftime('%Y-%m-%d')}")
 
-    if from_date > today:  # Sửa thành '>' để tránh trường hợp from_date == today
-        print(f"[DEBUG] Điều kiện dừng được kích hoạt: from_date ({from_date}) > today ({today}).")
+    if from_date > today:  # Không còn phiên nào sau ngày dữ liệu cuối cùng
+        print(f"[DEBUG] Điều kiện dừng được kích hoạt: from_date ({from_date}) > phiên gần nhất ({today}).")
         print(f"[DEBUG] Kết luận: Dữ liệu cho mã {ticker} đã được cập nhật. Không cần gọi API.")
         print("=" * 60 + "\n")
         return
@@ -42,9 +60,6 @@ def update_historical_data(ticker: str):
     print(f"Đang lấy dữ liệu cho mã {ticker} từ {from_date.strftime('%d/%m/%Y')} đến {today.strftime('%d/%m/%Y')}...")
 
     try:
-        config = get_ssi_config()
-        client = MarketDataClient(config)
-
         request_obj = daily_ohlc(
             symbol=ticker,
             fromDate=from_date.strftime('%d/%m/%Y'),
@@ -52,7 +67,13 @@ def update_historical_data(ticker: str):
             pageSize=2000
         )
 
-        response = client.daily_ohlc(config, request_obj)
+        # Giới hạn tốc độ dùng chung cho mọi lời gọi SSI (mọi request API / worker)
+        # Qua provider cache: khoảng ngày kết thúc hôm nay luôn gọi mới (ttl=0), bản lưu chỉ dùng khi replay offline
+        limiter = get_limiter('ssi')
+        response = cached_call('ssi', {'call': 'daily_ohlc', **asdict(request_obj)}, call_limited, limiter,
+                               lambda: SharedMarketDataClient().daily_ohlc(request_obj), ttl=0, cacheable=_is_success)
+        if str(response.get('status')) == '429':
+            limiter.on_rate_limited()
 
         # ==============================================================================
         # SỬA LỖI LOGIC KIỂM TRA RESPONSE
@@ -60,37 +81,163 @@ def update_historical_data(ticker: str):
         # ==============================================================================
         response_status = response.get('status')
         if (response_status == 200 or str(response_status).lower() == 'success') and response.get('data'):
-            new_data_points = []
-            for item in response['data']:
-                trading_date_str = item.get('TradingDate')
-                day, month, year = map(int, trading_date_str.split('/'))
-
-                # Bỏ qua các bản ghi có giá trị không hợp lệ
-                try:
-                    new_point = StockData(
-                        stock=stock,
-                        date=date(year, month, day),
-                        open=float(item.get('Open')),
-                        high=float(item.get('High')),
-                        low=float(item.get('Low')),
-                        close=float(item.get('Close')),
-                        volume=int(item.get('Volume'))
-                    )
-                    new_data_points.append(new_point)
-                except (ValueError, TypeError):
-                    print(f"Bỏ qua bản ghi không hợp lệ: {item}")
-                    continue
-
-            if new_data_points:
-                # Dùng ignore_conflicts để tránh lỗi nếu có ngày bị trùng
-                StockData.objects.bulk_create(new_data_points, ignore_conflicts=True)
-                print(f"ĐÃ LƯU THÀNH CÔNG {len(new_data_points)} NGÀY DỮ LIỆU MỚI CHO MÃ {ticker}.")
+            # Bản ghi có giá trị không hợp lệ bị bỏ qua khi chuẩn hoá khung
+            frame = daily_ohlc_frame(ticker, response['data'])
+            if not frame.empty:
+                with transaction.atomic():
+                    # Upsert phát hiện thay đổi: price panel / trạng thái indicators cập nhật qua price_history_changed
+                    written = load_price_frame(frame, upsert=True)
+                    record_fetch(ticker, TickerCoverage.StatusChoices.OK, from_date, frame['date'].iloc[-1].date())
+                print(f"ĐÃ LƯU THÀNH CÔNG {written} NGÀY DỮ LIỆU MỚI CHO MÃ {ticker}.")
+            else:
+                record_fetch(ticker, TickerCoverage.StatusChoices.EMPTY, from_date)
+        elif response_status == 200 or str(response_status).lower() == 'success':
+            record_fetch(ticker, TickerCoverage.StatusChoices.EMPTY, from_date)
+            print(f"Không có dữ liệu mới từ API SSI cho mã {ticker}.")
         else:
+            status = (TickerCoverage.StatusChoices.RATE_LIMITED if str(response_status) == '429'
+                      else TickerCoverage.StatusChoices.ERROR)
+            record_fetch(ticker, status, error=response.get('message', response))
             print(f"Không có dữ liệu mới hoặc có lỗi từ API SSI cho mã {ticker}. Response: {response}")
 
     except Exception as e:
         import traceback
         traceback.print_exc()
         print(f"Lỗi nghiêm trọng khi cập nhật dữ liệu cho mã {ticker}: {e}")
+        record_fetch(ticker, TickerCoverage.StatusChoices.RATE_LIMITED if is_rate_limit_error(e)
+                     else TickerCoverage.StatusChoices.ERROR, error=e)
+
+    print("=" * 60 + "\n")
+
+
+class SSIResponseError(Exception):
+    """Response không thành công từ SSI (status 429 được fetch_many coi là rate limit)."""
+
+
+class SharedMarketDataClient:
+    """
+    Một MarketDataClient đã xác thực dùng chung cho nhiều luồng: token chỉ lấy một lần và làm mới khi hết hạn
+    (khoá để các luồng không cùng xin token mới).
+    """
+
+    def __init__(self, config=None):
+        self.config = config
+        self.client = None  # tạo (và xác thực) ở lần gọi đầu tiên: replay offline không cần mạng
+        self._lock = threading.Lock()
+
+    def daily_ohlc(self, request_obj):
+        with self._lock:
+            if self.client is None:
+                self.config = self.config or get_ssi_config()
+                self.client = MarketDataClient(self.config)
+            self.client._get_access_token()
+        return self.client.daily_ohlc(self.config, request_obj)
+
+
+def _is_success(response):
+    status = response.get('status')
+    return status == 200 or str(status).lower() == 'success'
+
+
+def fetch_daily_ohlc(shared_client, ticker, from_date, to_date, limiter=None, page_size=GAP_FILL_PAGE_SIZE):
+    """Mọi bản ghi DailyOhlc của một mã trong [from_date, to_date], lật qua các trang; SSIResponseError nếu lỗi."""
+    limiter = limiter or get_limiter('ssi')
+    # Khoảng ngày tới hôm nay còn đổi: luôn gọi mới (vẫn lưu để replay), khoảng đã qua dùng TTL mặc định
+    ttl = 0 if to_date >= market_today() else None
+    items, page = [], 1
+    while True:
+        request_obj = daily_ohlc(symbol=ticker, fromDate=from_date.strftime('%d/%m/%Y'),
+                                 toDate=to_date.strftime('%d/%m/%Y'), pageIndex=page, pageSize=page_size)
+        response = cached_call('ssi', {'call': 'daily_ohlc', **asdict(request_obj)}, shared_client.daily_ohlc,
+                               request_obj, limiter=limiter, ttl=ttl, cacheable=_is_success)
+        if not _is_success(response):
+            raise SSIResponseError(f"SSI status {response.get('status')}: {response.get('message')}")
+        data = response.get('data') or []
+        items.extend(data)
+        total = response.get('totalRecord')
+        if len(data) < page_size or (total is not None and len(items) >= int(total)):
+            return items
+        page += 1
+
+
+def daily_ohlc_frame(ticker, items):
+    """Khung giá của api.bulk_loader từ các bản ghi DailyOhlc (TradingDate dạng dd/mm/yyyy)."""
+    df = pd.DataFrame(items, columns=['TradingDate', 'Open', 'High', 'Low', 'Close', 'Volume'])
+    df = df.rename(columns={'Open': 'open', 'High': 'high', 'Low': 'low', 'Close': 'close', 'Volume': 'volume'})
+    df['time'] = pd.to_datetime(df.pop('TradingDate'), format='%d/%m/%Y', errors='coerce')
+    return prepare_price_frame(df, ticker)
+
+
+def _default_tickers():
+    return [ticker for ticker in Stock.objects.values_list('ticker', flat=True)
+            if 3 <= len(ticker) <= 5 and ticker.isalpha()]
+
+
+def gap_fill_market(tickers=None, start=None, end=None, workers=GAP_FILL_WORKERS, log=print, revalidate=False):
+    """
+    Bổ sung dữ liệu còn thiếu cho nhiều mã (mặc định toàn bộ mã hợp lệ) từ SSI DailyOhlc.
+
+    Phần thiếu của từng mã lấy theo TickerCoverage trong [start, end] (mặc định 5 năm gần nhất tới hôm nay)
+    rồi gom theo khoảng ngày: các mã thiếu cùng một khoảng (thường là cùng số phiên cuối) được lấy chung một
+    lượt, mỗi (mã, khoảng) chỉ gọi một lần. Dùng một client đã xác thực cho mọi yêu cầu, tối đa `workers`
+    yêu cầu song song dưới bộ giới hạn tốc độ 'ssi'. Trả về dict thống kê.
+    Dữ liệu được ghi bằng upsert phát hiện thay đổi (api.bulk_loader); revalidate=True lấy lại toàn bộ các phiên
+    trong [start, end] kể cả phần đã có, nên giá được nhà cung cấp điều chỉnh sẽ ghi đè bản cũ mà không phải xoá
+    dữ liệu.
+    """
+    end = end or market_today()
+    start = start or end - timedelta(days=GAP_FILL_LOOKBACK_DAYS)
+    if revalidate:
+        sessions = get_calendar().session_range(start, end)
+        plan = {ticker: [sessions] for ticker in tickers or _default_tickers()} if sessions else {}
+    else:
+        plan = plan_fetches(tickers or _default_tickers(), start, end)
+    groups = defaultdict(list)
+    for ticker, ranges in plan.items():
+        for date_range in ranges:
+            groups[date_range].append(ticker)
+    summary = {'tickers': len(plan), 'ranges': len(groups), 'rows': 0, 'empty': 0, 'errors': 0}
+    if not groups:
+        log("Không có mã nào thiếu dữ liệu.")
+        return summary
+
+    log(f"{len(plan)} mã thiếu dữ liệu, gom thành {len(groups)} khoảng ngày.")
+    shared_client = SharedMarketDataClient()
+    limiter = get_limiter('ssi')
+    frames, outcomes = [], []
+
+    def flush():
+        with transaction.atomic():
+            if frames:
+                summary['rows'] += load_price_frame(pd.concat(frames, ignore_index=True), upsert=True)
+            record_fetches(outcomes)
+        frames.clear()
+        outcomes.clear()
+
+    for (from_date, to_date), group in sorted(groups.items()):
+        log(f"-> {from_date} → {to_date}: {len(group)} mã")
+
+        def fetch_one(ticker):
+            return fetch_daily_ohlc(shared_client, ticker, from_date, to_date, limiter=limiter)
+
+        for ticker, items, error in fetch_many(group, fetch_one, limiter=limiter, workers=workers, acquire=False):
+            if error is not None:
+                log(f"   Lỗi {ticker}: {error}")
+                status = (TickerCoverage.StatusChoices.RATE_LIMITED if is_rate_limit_error(error)
+                          else TickerCoverage.StatusChoices.ERROR)
+                outcomes.append((ticker, status, None, None, error))
+                summary['errors'] += 1
+                continue
+            frame = daily_ohlc_frame(ticker, items)
+            if frame.empty:
+                outcomes.append((ticker, TickerCoverage.StatusChoices.EMPTY, from_date, None, ''))
+                summary['empty'] += 1
+                continue
+            frames.append(frame)
+            outcomes.append((ticker, TickerCoverage.StatusChoices.OK, from_date, frame['date'].iloc[-1].date(), ''))
+            if sum(len(f) for f in frames) >= GAP_FILL_BATCH_ROWS:
+                flush()
+        flush()
 
-    print("=" * 60 + "\n")
\ No newline at end of file
+    log(f"Hoàn tất: {summary['rows']} dòng mới | {summary['empty']} mã không có dữ liệu | {summary['errors']} lỗi.")
+    return summary
@@ -0,0 +1,72 @@
+# ssi_integration/tasks.py
+
+import logging
+from datetime import datetime
+
+from celery import shared_task
+from django.core.cache import cache
+from django.utils import timezone
+
+from api.coverage import coverage_map
+from api.models import Stock
+from api.trading_calendar import latest_session
+from .services import GAP_FILL_WORKERS, gap_fill_market, update_historical_data
+
+logger = logging.getLogger(__name__)
+
+# Một refresh cho mỗi mã tại một thời điểm (khoá Redis, tự hết hạn nếu worker chết giữa chừng)
+REFRESH_LOCK_TIMEOUT = 5 * 60
+# Không gọi lại SSI nếu lần lấy gần nhất của mã còn mới hơn khoảng này (ví dụ nhiều lượt xem biểu đồ cuối tuần)
+REFRESH_MIN_INTERVAL = 15 * 60
+
+
+def _refresh_lock_key(ticker):
+    return f"ssi_refresh:{ticker}"
+
+
+@shared_task
+def gap_fill_market_task(tickers=None, start=None, end=None, workers=GAP_FILL_WORKERS, revalidate=False):
+    """Bổ sung dữ liệu giá còn thiếu từ SSI cho nhiều mã (ngày dạng 'YYYY-MM-DD'); xem services.gap_fill_market."""
+    start = datetime.strptime(start, '%Y-%m-%d').date() if start else None
+    end = datetime.strptime(end, '%Y-%m-%d').date() if end else None
+    return gap_fill_market(tickers=tickers, start=start, end=end, workers=workers, log=logger.info,
+                           revalidate=revalidate)
+
+
+@shared_task
+def refresh_ticker_task(ticker):
+    """Lấp khoảng trống dữ liệu của một mã từ SSI rồi nhả khoá refresh (xem schedule_refresh)."""
+    try:
+        update_historical_data(ticker)
+    finally:
+        cache.delete(_refresh_lock_key(ticker))
+
+
+def schedule_refresh(ticker):
+    """
+    Stale-while-revalidate cho một mã: đưa refresh_ticker_task vào hàng đợi nếu mã còn thiếu phiên giao dịch,
+    lần lấy gần nhất đã cũ và chưa có refresh nào của mã đang chạy (cache.add là SET NX trên Redis).
+    Trả về (trạng thái 'queued' | 'in-flight' | 'fresh' | 'unavailable', TickerCoverage của mã);
+    ('unknown', None) nếu mã không có trong database.
+    Không bao giờ chạy refresh trong process gọi: khi CELERY_TASK_ALWAYS_EAGER bật (không có worker) delay() sẽ
+    gọi SSI ngay trong request, nên bỏ qua refresh và trả về 'unavailable'.
+    """
+    if not Stock.objects.filter(ticker=ticker).exists():
+        return 'unknown', None
+    coverage = coverage_map([ticker])[ticker]
+    if coverage.last_date is not None and coverage.last_date >= latest_session():
+        return 'fresh', coverage
+    fetched_at = coverage.last_fetched_at
+    if fetched_at and (timezone.now() - fetched_at).total_seconds() < REFRESH_MIN_INTERVAL:
+        return 'fresh', coverage
+    if refresh_ticker_task.app.conf.task_always_eager:
+        return 'unavailable', coverage
+    if not cache.add(_refresh_lock_key(ticker), timezone.now().isoformat(), REFRESH_LOCK_TIMEOUT):
+        return 'in-flight', coverage
+    try:
+        refresh_ticker_task.delay(ticker)
+    except Exception as e:
+        cache.delete(_refresh_lock_key(ticker))
+        logger.warning(f"Không thể đưa refresh {ticker} vào hàng đợi: {e}")
+        return 'unavailable', coverage
+    return 'queued', coverage
@@ -0,0 +1,188 @@
+import functools
+import tempfile
+from datetime import date, timedelta
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api.bulk_loader import load_price_frame
+from api.models import Stock, StockData, TickerCoverage
+from api.provider_cache import reset_provider_cache
+from api.rate_limit import TokenBucket
+from ssi_integration import services, tasks
+
+
+def _store_history(ticker, days):
+    """Ghi `days` phiên giá giả lập của một mã vào StockData; trả về ngày cuối."""
+    dates = pd.bdate_range('2024-01-02', periods=days)
+    close = np.round(np.linspace(20, 30, days), 2)
+    Stock.objects.create(ticker=ticker, company_name=ticker)
+    load_price_frame(pd.DataFrame({
+        'stock_id': ticker, 'date': dates, 'open': close, 'high': close + 0.5, 'low': close - 0.5, 'close': close,
+        'volume': np.full(days, 1000, dtype=np.int64),
+    }))
+    return dates[-1].date()
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                   CELERY_TASK_ALWAYS_EAGER=False)
+class ScheduleRefreshTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.last_date = _store_history('AAA', 5)
+        patcher = mock.patch.object(tasks.refresh_ticker_task, 'delay')
+        self.delay = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_queued_then_in_flight_until_lock_released(self):
+        self.assertEqual(tasks.schedule_refresh('AAA')[0], 'queued')
+        self.delay.assert_called_once_with('AAA')
+        self.assertEqual(tasks.schedule_refresh('AAA')[0], 'in-flight')
+        self.assertEqual(self.delay.call_count, 1)
+
+        # Refresh lỗi vẫn nhả khoá để lượt xem sau được giao lại
+        with mock.patch.object(tasks, 'update_historical_data', side_effect=RuntimeError('SSI down')):
+            with self.assertRaises(RuntimeError):
+                tasks.refresh_ticker_task.run('AAA')
+        self.assertEqual(tasks.schedule_refresh('AAA')[0], 'queued')
+        self.assertEqual(self.delay.call_count, 2)
+
+    def test_fresh_when_covered_or_recently_checked(self):
+        with mock.patch.object(tasks, 'latest_session', return_value=self.last_date):
+            self.assertEqual(tasks.schedule_refresh('AAA')[0], 'fresh')
+        TickerCoverage.objects.filter(stock_id='AAA').update(last_fetched_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(tasks.schedule_refresh('AAA')[0], 'fresh')
+        self.delay.assert_not_called()
+        self.assertEqual(tasks.schedule_refresh('ZZZ'), ('unknown', None))
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+    def test_eager_mode_never_refreshes_inline(self):
+        with mock.patch.object(tasks, 'update_historical_data') as update:
+            self.assertEqual(tasks.schedule_refresh('AAA')[0], 'unavailable')
+        update.assert_not_called()
+        self.delay.assert_not_called()
+        self.assertIsNone(cache.get(tasks._refresh_lock_key('AAA')))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class StockDataHeadersTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.last_date = _store_history('AAA', 60)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('tester', password='secret'))
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(PRICE_PANEL_DIR=directory.name))
+
+    def test_freshness_headers(self):
+        checked_at = timezone.now() - timedelta(hours=1)
+        TickerCoverage.objects.create(stock_id='AAA', first_date='2024-01-02', last_date=self.last_date,
+                                      last_fetched_at=checked_at)
+        with mock.patch.object(tasks, 'latest_session', return_value=self.last_date):
+            response = self.client.get('/api/stock-data/', {'ticker': 'aaa'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Data-As-Of'], str(self.last_date))
+        self.assertEqual(response['X-Data-Checked-At'], checked_at.isoformat())
+        self.assertEqual(response['X-Data-Refresh'], 'fresh')
+
+        # Thiếu phiên mới nhất: refresh được đưa vào hàng đợi, request vẫn trả dữ liệu đang có
+        with override_settings(CELERY_TASK_ALWAYS_EAGER=False), \
+                mock.patch.object(tasks.refresh_ticker_task, 'delay') as delay:
+            response = self.client.get('/api/stock-data/', {'ticker': 'AAA'})
+        delay.assert_called_once_with('AAA')
+        self.assertEqual((response['X-Data-Refresh'], response['X-Data-As-Of']), ('queued', str(self.last_date)))
+
+    def test_unknown_ticker(self):
+        response = self.client.get('/api/stock-data/', {'ticker': 'ZZZ'})
+        self.assertEqual(response.status_code, 404)
+
+
+class FakeMarketDataClient:
+    """SharedMarketDataClient giả: trả DailyOhlc theo trang từ `history` (mã -> danh sách phiên, None = lỗi)."""
+
+    def __init__(self, history):
+        self.history = history
+        self.calls = []
+
+    def daily_ohlc(self, request_obj):
+        self.calls.append((request_obj.symbol, request_obj.fromDate, request_obj.toDate, request_obj.pageIndex))
+        sessions = self.history[request_obj.symbol]
+        if sessions is None:
+            return {'status': 500, 'message': 'Internal error'}
+        first = (request_obj.pageIndex - 1) * request_obj.pageSize
+        page = sessions[first:first + request_obj.pageSize]
+        return {'status': 200, 'totalRecord': len(sessions), 'data': [
+            {'TradingDate': day.strftime('%d/%m/%Y'), 'Open': 30, 'High': 31, 'Low': 29, 'Close': 30, 'Volume': 1000}
+            for day in page]}
+
+
+@override_settings(PROVIDER_CACHE={'MODE': 'off'})
+class GapFillMarketTests(TestCase):
+    def setUp(self):
+        reset_provider_cache()
+        self.addCleanup(reset_provider_cache)
+        # AAA, BBB có tới 08/01 nên cùng thiếu 09/01 -> 12/01; CCC, DDD chưa có dữ liệu nên thiếu cả khoảng
+        _store_history('AAA', 5)
+        _store_history('BBB', 5)
+        Stock.objects.bulk_create([Stock(ticker='CCC', company_name='CCC'), Stock(ticker='DDD', company_name='DDD')])
+        recent = list(pd.bdate_range('2024-01-09', '2024-01-12'))
+        self.ssi_client = FakeMarketDataClient({'AAA': recent, 'BBB': recent, 'CCC': [], 'DDD': None})
+        # Trang 3 bản ghi để 4 phiên thiếu phải lấy qua 2 trang
+        fetch_daily_ohlc = functools.partial(services.fetch_daily_ohlc, page_size=3)
+        for name, new in (('SharedMarketDataClient', lambda: self.ssi_client),
+                          ('get_limiter', lambda provider: TokenBucket(1000, capacity=1000)),
+                          ('fetch_daily_ohlc', fetch_daily_ohlc)):
+            patcher = mock.patch.object(services, name, new)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch('api.vnstock_fetcher.time.sleep')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_groups_by_missing_range_and_records_coverage(self):
+        recorded = []
+        record_fetches = services.record_fetches
+
+        def record(outcomes):
+            recorded.extend(outcome[0] for outcome in outcomes)
+            record_fetches(outcomes)
+
+        with mock.patch.object(services, 'record_fetches', record):
+            summary = services.gap_fill_market(start=date(2024, 1, 2), end=date(2024, 1, 12), log=lambda _: None)
+        self.assertEqual(summary, {'tickers': 4, 'ranges': 2, 'rows': 8, 'empty': 1, 'errors': 1})
+
+        # Mỗi (mã, khoảng) một lượt; AAA/BBB lật 2 trang, DDD lỗi được thử lại một lần
+        self.assertEqual(sorted(self.ssi_client.calls), [
+            ('AAA', '09/01/2024', '12/01/2024', 1), ('AAA', '09/01/2024', '12/01/2024', 2),
+            ('BBB', '09/01/2024', '12/01/2024', 1), ('BBB', '09/01/2024', '12/01/2024', 2),
+            ('CCC', '02/01/2024', '12/01/2024', 1),
+            ('DDD', '02/01/2024', '12/01/2024', 1), ('DDD', '02/01/2024', '12/01/2024', 1),
+        ])
+        self.assertEqual(StockData.objects.filter(stock_id='AAA').count(), 9)
+
+        coverages = {coverage.stock_id: coverage for coverage in TickerCoverage.objects.all()}
+        self.assertEqual((coverages['AAA'].last_status, coverages['AAA'].last_date),
+                         (TickerCoverage.StatusChoices.OK, date(2024, 1, 12)))
+        self.assertEqual((coverages['CCC'].last_status, coverages['CCC'].first_date, coverages['CCC'].last_date),
+                         (TickerCoverage.StatusChoices.EMPTY, date(2024, 1, 2), None))
+        self.assertEqual((coverages['DDD'].last_status, coverages['DDD'].first_date),
+                         (TickerCoverage.StatusChoices.ERROR, None))
+        self.assertIn('SSI status 500', coverages['DDD'].last_error)
+        # Kết quả của một khoảng không có dữ liệu không bị ghi lại ở lượt flush sau
+        self.assertEqual(sorted(recorded), ['AAA', 'BBB', 'CCC', 'DDD'])
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+    def test_command_queues_task(self):
+        call_command('ssi_gap_fill', 'aaa', 'ccc', '--start', '2024-01-02', '--end', '2024-01-12', '--async',
+                     stdout=mock.Mock())
+        self.assertEqual(sorted(call[0] for call in self.ssi_client.calls), ['AAA', 'AAA', 'CCC'])
+        self.assertEqual(TickerCoverage.objects.get(stock_id='AAA').last_date, date(2024, 1, 12))
+        self.assertEqual(TickerCoverage.objects.get(stock_id='CCC').last_status, TickerCoverage.StatusChoices.EMPTY)